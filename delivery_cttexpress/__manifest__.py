@@ -3,7 +3,7 @@
 {
     "name": "CTT Express",
     "summary": "Delivery Carrier implementation for CTT Express API",
-    'version': '17.0.1.1.1',
+    'version': '17.0.1.2.0',
     "category": "Delivery",
     "website": "https://github.com/OCA/delivery-carrier",
     "author": "Tecnativa, Odoo Community Association (OCA)",
@@ -18,6 +18,7 @@
         "views/delivery_cttexpress_view.xml",
         "views/stock_picking_views.xml",
         'data/delivery_carrier_data.xml',
+        "data/ir_cron_data.xml",
     ],
     'assets': {
         'web.assets_backend': [
@@ -0,0 +1,9 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+
+def migrate(cr, version):
+    # is_ctt se calculaba a partir del nombre del transportista
+    cr.execute(
+        "UPDATE delivery_carrier SET is_ctt = (delivery_type = 'ctt') "
+        "WHERE is_ctt IS DISTINCT FROM (delivery_type = 'ctt')"
+    )
@@ -1,2 +1,5 @@
 from . import delivery_carrier
+from . import delivery_cttexpress_rate
+from . import delivery_cttexpress_service_type
+from . import sale_order
 from . import stock_picking
@@ -1,11 +1,23 @@
 # Copyright 2022 Tecnativa - David Vidal
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import copy
 import logging
-_logger = logging.getLogger(__name__)
+import threading
+
 from lxml import etree
 from zeep import Client
 from zeep.helpers import serialize_object
 from zeep.plugins import HistoryPlugin
+from zeep.transports import Transport
+from zeep.wsdl import Document
+
+from .cttexpress_transport import (
+    CTTEXPRESS_RETRIES,
+    CTTEXPRESS_TIMEOUT,
+    call_with_retries,
+    get_circuit_breaker,
+    get_session,
+)
 
 _logger = logging.getLogger(__name__)
 
@@ -14,23 +26,92 @@ CTTEXPRESS_API_URL = {
     "prod": "http://iberws.tourlineexpress.com:8700/ClientsAPI.svc?singleWsdl",
 }
 
+# Parsed WSDL documents and their transports, shared by every request object of
+# this worker process. Keyed by environment ("test" or "prod").
+_WSDL_CACHE = {}
+_WSDL_CACHE_LOCK = threading.Lock()
+
+
+def get_cached_wsdl(environment):
+    """Get the parsed WSDL and the transport for the given environment.
+
+    The WSDL is downloaded and parsed only once per worker. The transport, with
+    the pooled session shared by the SOAP calls and explicit timeouts, is shared
+    as well.
+
+    :param str environment: "test" or "prod"
+    :return tuple: (zeep.wsdl.Document, zeep.transports.Transport)
+    """
+    cached = _WSDL_CACHE.get(environment)
+    if cached:
+        return cached
+    with _WSDL_CACHE_LOCK:
+        # Another thread could have loaded it while we were waiting
+        cached = _WSDL_CACHE.get(environment)
+        if cached:
+            return cached
+        transport = Transport(
+            session=get_session("soap"),
+            timeout=CTTEXPRESS_TIMEOUT,
+            operation_timeout=CTTEXPRESS_TIMEOUT,
+        )
+        document = Document(CTTEXPRESS_API_URL[environment], transport)
+        _WSDL_CACHE[environment] = cached = (document, transport)
+        _logger.debug("CTT Express WSDL loaded for %s environment", environment)
+    return cached
+
+
+def invalidate_client_cache(environment=None):
+    """Drop the cached WSDL so it's loaded again on the next request.
+
+    :param str environment: "test" or "prod". All of them when not given.
+    """
+    with _WSDL_CACHE_LOCK:
+        if environment:
+            _WSDL_CACHE.pop(environment, None)
+        else:
+            _WSDL_CACHE.clear()
+
+
+# Longer texts (i.e.: base64 encoded documents) are truncated in the logs
+CTTEXPRESS_LOG_MAX_TEXT = 256
+
+
+def envelope_to_string(envelope):
+    """Serialize a SOAP envelope for logging, truncating the long texts
+
+    :param envelope: lxml element
+    :return bytes: Pretty printed XML
+    """
+    if envelope is None:
+        return False
+    long_nodes = [
+        node
+        for node in envelope.iter()
+        if node.text and len(node.text) > CTTEXPRESS_LOG_MAX_TEXT
+    ]
+    if long_nodes:
+        # Don't alter the envelope kept in the history
+        envelope = copy.deepcopy(envelope)
+        for node in envelope.iter():
+            if node.text and len(node.text) > CTTEXPRESS_LOG_MAX_TEXT:
+                node.text = "{}... [{} characters truncated]".format(
+                    node.text[:64], len(node.text) - 64
+                )
+    return etree.tostring(envelope, encoding="UTF-8", pretty_print=True)
+
 
 def log_request(method):
-    """Decorator to write raw request/response in the CTT request object"""
+    """Decorator to keep the raw request/response envelopes in the CTT request
+    object. They're only serialized when they're actually logged."""
 
     def wrapper(*args, **kwargs):
         res = method(*args, **kwargs)
         try:
-            args[0].ctt_last_request = etree.tostring(
-                args[0].history.last_sent["envelope"],
-                encoding="UTF-8",
-                pretty_print=True,
-            )
-            args[0].ctt_last_response = etree.tostring(
-                args[0].history.last_received["envelope"],
-                encoding="UTF-8",
-                pretty_print=True,
-            )
+            args[0]._last_sent_envelope = args[0].history.last_sent["envelope"]
+            args[0]._last_received_envelope = args[0].history.last_received[
+                "envelope"
+            ]
         # Don't fail hard on this. Sometimes zeep can't keep history
         except Exception:
             return res
@@ -50,15 +131,32 @@ class CTTExpressRequest:
         self.agency = agency
         self.customer = customer
         self.contract = contract
+        # Every request object keeps its own history, so the logged raw
+        # request/responses are the ones of this object calls.
         self.history = HistoryPlugin(maxlen=10)
-        # We'll store raw xml request/responses in this properties
-        self.ctt_last_request = False
-        self.ctt_last_response = False
+        # Last raw xml request/response envelopes, see ctt_last_request and
+        # ctt_last_response
+        self._last_sent_envelope = None
+        self._last_received_envelope = None
+        environment = "prod" if prod else "test"
+        self.breaker = get_circuit_breaker("soap-" + environment)
+        document, transport = get_cached_wsdl(environment)
         self.client = Client(
-            wsdl=CTTEXPRESS_API_URL["prod" if prod else "test"],
+            wsdl=document,
+            transport=transport,
             plugins=[self.history],
         )
 
+    @property
+    def ctt_last_request(self):
+        """Last raw xml request, serialized on demand"""
+        return envelope_to_string(self._last_sent_envelope)
+
+    @property
+    def ctt_last_response(self):
+        """Last raw xml response, serialized on demand"""
+        return envelope_to_string(self._last_received_envelope)
+
     @staticmethod
     def _format_error(error):
         """Common method to format error outputs
@@ -80,6 +178,20 @@ class CTTExpressRequest:
             return []
         return [(x.FileName, x.FileContent) for x in documents.Document]
 
+    def _call(self, operation, idempotent=False, **values):
+        """Call an API operation through the circuit breaker. Idempotent ones
+        are retried after transient failures.
+
+        :param str operation: API operation name
+        :param bool idempotent: The operation can be safely repeated
+        :return: The operation response
+        """
+        return call_with_retries(
+            lambda: getattr(self.client.service, operation)(**values),
+            retries=CTTEXPRESS_RETRIES if idempotent else 0,
+            breaker=self.breaker,
+        )
+
     def _credentials(self):
         """Get the credentials in the API expected format.
 
@@ -106,7 +218,7 @@ class CTTExpressRequest:
             str: Shipping code
         """
         values = dict(self._credentials(), **shipping_values)
-        response = self.client.service.ManifestShipping(**values)
+        response = self._call("ManifestShipping", **values)
         return (
             self._format_error(response.ErrorCodes),
             self._format_document(response.Documents),
@@ -123,7 +235,7 @@ class CTTExpressRequest:
             list: of OrderedDict with statuses
         """
         values = dict(self._credentials(), ShippingCode=shipping_code)
-        response = self.client.service.GetTracking(**values)
+        response = self._call("GetTracking", idempotent=True, **values)
         return (
             self._format_error(response.ErrorCodes),
             (response.Tracking and serialize_object(response.Tracking.Tracking) or []),
@@ -139,7 +251,7 @@ class CTTExpressRequest:
             list: documents in the form of tuples (file_content, file_name)
         """
         values = dict(self._credentials(), ShippingCode=shipping_code)
-        response = self.client.service.GetDocuments(**values)
+        response = self._call("GetDocuments", idempotent=True, **values)
         return (
             self._format_error(response.ErrorCodes),
             self._format_document(response.Documents),
@@ -153,33 +265,29 @@ class CTTExpressRequest:
         model_code="SINGLE",
         kind_code="PDF",
     ):
+        """Get the documents of one or several shippings at once. Maps to API's
+        GetDocumentsV2.
+
+        :param shipping_codes: Shipping codes list or string separated by ;
+        :param str document_code: Document code
+        :param str model_code: Document model code (SINGLE|MULTI1|MULTI3|MULTI4)
+        :param str kind_code: Document format (PDF|PNG|BMP)
+        :return tuple: tuple containing:
+            list: error codes in the form of tuples (code, descriptions)
+            list: documents in the form of tuples (file_name, file_content)
+        """
+        if isinstance(shipping_codes, str):
+            shipping_codes = shipping_codes.split(";")
         _logger.debug("shipping_codes en get_documents_multi: %s", shipping_codes)
         values = dict(
             self._credentials(),
-            ShippingCodes=shipping_codes,
+            # Array of strings: zeep would only send the first item of a list
+            ShippingCodes={"string": shipping_codes},
             DocumentCode=document_code,
             ModelCode=model_code,
             KindCode=kind_code,
         )
-        _logger.debug("values en get_documents_multi: %s", values)
-        response = self.client.service.GetDocumentsV2(**values)
-        
-        # Aquí puedes imprimir el raw history para comparar el XML, como ya lo mostramos antes:
-        _logger.debug("Zeep History last_sent (raw): %s", self.history.last_sent)
-        _logger.debug("Zeep History last_received (raw): %s", self.history.last_received)
-        
-        try:
-            last_sent_xml = etree.tostring(self.history.last_sent["envelope"], encoding="UTF-8", pretty_print=True)
-        except Exception as e:
-            last_sent_xml = "No se pudo serializar last_sent: %s" % e
-        try:
-            last_received_xml = etree.tostring(self.history.last_received["envelope"], encoding="UTF-8", pretty_print=True)
-        except Exception as e:
-            last_received_xml = "No se pudo serializar last_received: %s" % e
-
-        _logger.debug("Zeep last_sent XML: %s", last_sent_xml)
-        _logger.debug("Zeep last_received XML: %s", last_received_xml)
-        
+        response = self._call("GetDocumentsV2", idempotent=True, **values)
         return (
             self._format_error(response.ErrorCodes),
             self._format_document(response.Documents),
@@ -193,10 +301,9 @@ class CTTExpressRequest:
             list: error codes in the form of tuples (code, descriptions)
             list: list of tuples (service_code, service_description):
         """
-        credentials = self._credentials()
-        print("🚀 Enviando credenciales a CTT:", credentials)  # Depuración
-
-        response = self.client.service.GetServiceTypes(**credentials)
+        response = self._call(
+            "GetServiceTypes", idempotent=True, **self._credentials()
+        )
         return (
             self._format_error(response.ErrorCodes),
             [
@@ -213,7 +320,7 @@ class CTTExpressRequest:
         :return str: Error codes
         """
         values = dict(self._credentials(), ShippingCode=shipping_code)
-        response = self.client.service.CancelShipping(**values)
+        response = self._call("CancelShipping", **values)
         return [(x.ErrorCode, x.ErrorMessage) for x in response]
 
     @log_request
@@ -237,7 +344,7 @@ class CTTExpressRequest:
             FromDate=from_date,
             ToDate=to_date,
         )
-        response = self.client.service.ReportShipping(**values)
+        response = self._call("ReportShipping", idempotent=True, **values)
         return (
             self._format_error(response.ErrorCodes),
             self._format_document(response.Documents),
@@ -251,7 +358,9 @@ class CTTExpressRequest:
             int: Error code (0 for success)
             str: Validation result message
         """
-        response = self.client.service.ValidateUser(**self._credentials())[0]
+        response = self._call(
+            "ValidateUser", idempotent=True, **self._credentials()
+        )[0]
         return [(response.ErrorCode, response.ErrorMessage)]
 
     @log_request
@@ -273,5 +382,5 @@ class CTTExpressRequest:
                 "HourMinuteMax1": max_hour,
             }
         )
-        response = self.client.service.CreateRequest(**values)
+        response = self._call("CreateRequest", **values)
         return (self._format_error(response.ErrorCodes), response.RequestShippingCode)
@@ -0,0 +1,340 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import asyncio
+import json
+import logging
+import random
+import time
+
+from . import cttexpress_rest_request as rest_request
+from .cttexpress_transport import (
+    CTTEXPRESS_CONNECT_TIMEOUT,
+    CTTEXPRESS_READ_TIMEOUT,
+    CTTEXPRESS_RETRIES,
+    TRANSIENT_STATUS_CODES,
+    get_circuit_breaker,
+    is_transient_error,
+)
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+    _logger.debug("aiohttp isn't installed. CTT Express REST batches run in threads.")
+
+# Peticiones simultáneas por lote. Se puede cambiar con el parámetro del sistema
+# `delivery_cttexpress.rest_async_concurrency`.
+CTTEXPRESS_ASYNC_CONCURRENCY = 50
+
+
+def async_available():
+    """Tell if the asyncio client can be used"""
+    return aiohttp is not None
+
+
+class CttExpressRestError(Exception):
+    """Respuesta de error de la API REST"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        super().__init__("CTT Express HTTP {}: {}".format(status_code, text))
+
+
+class CttExpressAsyncRestAPI:
+    """Versión asyncio de `CttExpressRestAPI`, con las mismas operaciones. Las
+    peticiones de un lote comparten la sesión, el token (también con el cliente
+    síncrono) y un semáforo que limita las que están en vuelo::
+
+        async with CttExpressAsyncRestAPI(url, ...) as rest_api:
+            results = await rest_api.gather(rest_api.printLabel, codes, "SINGLE")
+
+    :param int max_concurrency: Peticiones simultáneas como máximo
+    """
+
+    def __init__(
+        self,
+        url,
+        client_id,
+        client_secret,
+        username,
+        password,
+        client_code,
+        platform,
+        max_concurrency=CTTEXPRESS_ASYNC_CONCURRENCY,
+    ):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required by the CTT Express asyncio client")
+        self.url = url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.username = username
+        self.password = password
+        self.client_code = client_code
+        self.platform = platform
+        self.max_concurrency = max_concurrency
+        self.token = None
+        self.token_expires = None
+        self.breaker = get_circuit_breaker("rest")
+        self.session = None
+        self._semaphore = None
+        self._token_lock = None
+
+    async def __aenter__(self):
+        # Los objetos de asyncio se crean dentro del bucle de eventos que los usa
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._token_lock = asyncio.Lock()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=CTTEXPRESS_CONNECT_TIMEOUT,
+                sock_read=CTTEXPRESS_READ_TIMEOUT,
+            ),
+        )
+        # El token se pide con la primera petición: si falla, falla cada
+        # petición del lote por separado y no el lote entero
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    @property
+    def _token_key(self):
+        return rest_request.token_cache_key(
+            self.client_id, self.username, self.client_secret, self.password
+        )
+
+    def _use_cached_token(self, rejected_token):
+        cached = rest_request._TOKEN_CACHE.get(self._token_key)
+        if cached and cached[0] != rejected_token and cached[1] > time.monotonic():
+            self.token, self.token_expires = cached
+            return True
+        return False
+
+    async def load_token(self, force=False):
+        """Obtiene el token de acceso, compartido con el resto de clientes del
+        worker. Sólo una corrutina del lote lo pide cuando hace falta.
+
+        :param bool force: Renovar aunque el token cacheado siga vigente
+        """
+        await self._load_token(force, self.breaker)
+
+    async def _load_token(self, force=False, breaker=None):
+        """`load_token` con el circuit breaker a usar al pedirlo. Dentro de una
+        petición se pide sin él, como en el cliente síncrono.
+
+        :param bool force: Renovar aunque el token cacheado siga vigente
+        :param CircuitBreaker breaker: Breaker por el que pasa la petición
+        """
+        rejected_token = self.token if force else None
+        if self._use_cached_token(rejected_token):
+            return
+        async with self._token_lock:
+            if self._use_cached_token(rejected_token):
+                return
+            await self._request_token(breaker)
+            rest_request._TOKEN_CACHE[self._token_key] = (
+                self.token,
+                self.token_expires,
+            )
+
+    async def _request_token(self, breaker=None):
+        """Solicita el token de acceso al servidor de autenticación.
+
+        :param CircuitBreaker breaker: Breaker por el que pasa la petición
+        """
+        payload = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": "urn:com:ctt-express:integration-clients:scopes:common/ALL",
+            "grant_type": "client_credentials",
+        }
+        status, text = await self._call_with_retries(
+            lambda: self._send(
+                "POST", rest_request.CTTEXPRESS_TOKEN_URL, data=payload
+            ),
+            idempotent=True,
+            breaker=breaker,
+        )
+        if status >= 400:
+            raise CttExpressRestError(status, text)
+        result = json.loads(text)
+        self.token = result.get("access_token")
+        expires_in = (
+            result.get("expires_in") or rest_request.CTTEXPRESS_TOKEN_DEFAULT_EXPIRY
+        )
+        self.token_expires = time.monotonic() + max(
+            int(expires_in) - rest_request.CTTEXPRESS_TOKEN_EXPIRY_MARGIN, 0
+        )
+
+    def get_headers(self):
+        """Prepara los encabezados para las peticiones a la API REST."""
+        return {
+            "user_name": self.username,
+            "password": self.password,
+            "Authorization": "Bearer " + (self.token or ""),
+            "Content-Type": "application/json",
+        }
+
+    async def _send(self, method, url, headers=None, **kwargs):
+        async with self.session.request(
+            method, url, headers=headers, **kwargs
+        ) as response:
+            return response.status, await response.text()
+
+    async def _call_with_retries(self, function, idempotent=False, breaker=None):
+        """Versión asyncio de `call_with_retries`: pasa por el circuit breaker
+        dado y reintenta con espera exponencial los fallos transitorios de las
+        operaciones idempotentes.
+
+        :param CircuitBreaker breaker: Breaker de la API, si lo hay
+        :return tuple: (status_code, text)
+        """
+        retries = CTTEXPRESS_RETRIES if idempotent else 0
+        delay = 0.5
+        for attempt in range(retries + 1):
+            if breaker:
+                breaker.before_call()
+            try:
+                status, text = await function()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if breaker:
+                    breaker.record_failure()
+                if attempt == retries:
+                    raise
+                _logger.debug("CTT Express call failed (%s), retrying", e)
+            except Exception as e:
+                if breaker:
+                    # Otros errores indican que la API responde
+                    if is_transient_error(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                raise
+            else:
+                if status not in TRANSIENT_STATUS_CODES:
+                    if breaker:
+                        breaker.record_success()
+                    return status, text
+                if breaker:
+                    breaker.record_failure()
+                if attempt == retries:
+                    return status, text
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, 8.0)
+
+    async def _request(self, method, endpoint, idempotent=False, **kwargs):
+        """Lanza la petición dentro del límite de concurrencia, con el token
+        pedido o renovado antes si hace falta. Si el token ha sido rechazado
+        (401), la repite una única vez con un token nuevo.
+
+        :return tuple: (status_code, text)
+        """
+        url = self.url + endpoint
+
+        async def send():
+            # El token forma parte de la llamada: no pasa otra vez por el breaker
+            if not self.token or self.token_expires <= time.monotonic():
+                await self._load_token()
+            status, text = await self._send(
+                method, url, headers=self.get_headers(), **kwargs
+            )
+            if status == 401:
+                _logger.info("Token de CTT Express rechazado, se solicita uno nuevo")
+                await self._load_token(force=True)
+                status, text = await self._send(
+                    method, url, headers=self.get_headers(), **kwargs
+                )
+            return status, text
+
+        async with self._semaphore:
+            return await self._call_with_retries(
+                send, idempotent=idempotent, breaker=self.breaker
+            )
+
+    async def _request_json(self, method, endpoint, idempotent=False, **kwargs):
+        status, text = await self._request(
+            method, endpoint, idempotent=idempotent, **kwargs
+        )
+        if status >= 400:
+            raise CttExpressRestError(status, text)
+        return json.loads(text) if text.strip() else {}
+
+    async def createShipment(self, data):
+        """Ejecuta la creación de un envío."""
+        return await self._request_json("POST", "/manifest/v1.0/shippings", json=data)
+
+    async def cancelShipment(self, shipping_code):
+        """Ejecuta la cancelación de un envío."""
+        status, text = await self._request(
+            "POST",
+            f"/manifest/v1.0/rpc-cancel-shipping-by-shipping-code/{shipping_code}",
+            json={},
+        )
+        if status >= 400:
+            raise CttExpressRestError(status, text)
+        if status == 201:
+            return {"status": "success"}
+        return json.loads(text) if text.strip() else {}
+
+    async def printLabel(self, shipping_code, print_format):
+        """Solicita la impresión de la etiqueta de un envío."""
+        params = {
+            "label_type_code": "PDF",
+            "model_type_code": print_format,
+            "label_offset": 1,
+        }
+        return await self._request_json(
+            "GET",
+            f"/trf/labelling/v1.0/shippings/{shipping_code}/shipping-labels",
+            idempotent=True,
+            params=params,
+        )
+
+    async def getTracking(self, shipping_code):
+        """Obtiene el histórico de estados de un envío."""
+        return await self._request_json(
+            "GET",
+            f"/trf/item-history-api/history/{shipping_code}",
+            idempotent=True,
+            params={"view": "APITRACK"},
+        )
+
+    async def gather(self, function, items, *args):
+        """Aplica la operación a todos los elementos a la vez, dentro del límite
+        de concurrencia. Como `concurrent_map`, un error se devuelve en el lugar
+        de su resultado en vez de abortar el resto.
+
+        :param callable function: Corrutina llamada con cada elemento y `args`
+        :param iterable items: Elementos a procesar
+        :return list: Resultados (o excepciones) en el orden de los elementos
+        """
+        return await asyncio.gather(
+            *(function(item, *args) for item in items), return_exceptions=True
+        )
+
+
+def run_rest_batch(client_params, function, items, max_concurrency=None):
+    """Run a coroutine for every item with a single asyncio client. It blocks
+    until all of them are done, so it can be called from the ORM.
+
+    :param dict client_params: `CttExpressAsyncRestAPI` keyword arguments
+    :param callable function: Coroutine called with the client and every item
+    :param iterable items: Items to process
+    :param int max_concurrency: Maximum concurrent requests
+    :return list: Results (or exceptions) in the same order as the items
+    """
+    items = list(items)
+    if max_concurrency:
+        client_params = dict(client_params, max_concurrency=max_concurrency)
+
+    async def _run():
+        async with CttExpressAsyncRestAPI(**client_params) as rest_api:
+            return await asyncio.gather(
+                *(function(rest_api, item) for item in items), return_exceptions=True
+            )
+
+    if not items:
+        return []
+    return asyncio.run(_run())
@@ -1,10 +1,62 @@
 import requests
+import hashlib
 import logging
+import threading
+import time
 from odoo import _
 from odoo.exceptions import UserError
 
+from .cttexpress_transport import (
+    CTTEXPRESS_RETRIES,
+    CTTEXPRESS_TIMEOUT,
+    TRANSIENT_STATUS_CODES,
+    call_with_retries,
+    get_circuit_breaker,
+    get_session,
+)
+
 _logger = logging.getLogger(__name__)
 
+CTTEXPRESS_TOKEN_URL = "https://es-ctt-integration-clients-pool-ids.auth.eu-central-1.amazoncognito.com/oauth2/token"
+# Segundos antes de la caducidad en los que ya se pide un token nuevo
+CTTEXPRESS_TOKEN_EXPIRY_MARGIN = 60
+# Duración asumida cuando la respuesta no trae expires_in
+CTTEXPRESS_TOKEN_DEFAULT_EXPIRY = 3600
+
+# Tokens compartidos por todas las instancias del worker, por cuenta y
+# credenciales (ver `token_cache_key`): {key: (access_token, monotonic_expiry)}
+_TOKEN_CACHE = {}
+_TOKEN_LOCKS = {}
+_TOKEN_LOCKS_LOCK = threading.Lock()
+
+
+def _token_lock(key):
+    with _TOKEN_LOCKS_LOCK:
+        return _TOKEN_LOCKS.setdefault(key, threading.Lock())
+
+
+def token_cache_key(client_id, username, client_secret, password):
+    """Clave de la caché de tokens. Incluye un hash de las credenciales, así
+    que al cambiarlas no se reutiliza el token obtenido con las anteriores.
+
+    :return tuple: (client_id, username, hash de las credenciales)
+    """
+    credentials = hashlib.sha256(
+        "\0".join((client_secret or "", password or "")).encode()
+    ).hexdigest()
+    return (client_id, username, credentials)
+
+
+def invalidate_token_cache(client_id=None, username=None):
+    """Olvida los tokens cacheados: los de la cuenta dada o todos."""
+    if client_id is None and username is None:
+        _TOKEN_CACHE.clear()
+        return
+    for key in list(_TOKEN_CACHE):
+        if key[:2] == (client_id, username):
+            _TOKEN_CACHE.pop(key, None)
+
+
 class CttExpressRestAPI:
     def __init__(self, url, client_id, client_secret, username, password, client_code, platform):
         self.url = url
@@ -16,12 +68,59 @@ class CttExpressRestAPI:
         self.platform = platform
         self.token = None
         self.token_expires = None
-        self.session = requests.Session()
-        self.load_token()
+        # Sesión con conexiones persistentes compartida por todo el worker
+        self.session = get_session("rest")
+        self.breaker = get_circuit_breaker("rest")
+        # El token se pide con la primera petición: si falla, falla cada
+        # petición por separado y no la creación del cliente
+
+    @property
+    def _token_key(self):
+        return token_cache_key(
+            self.client_id, self.username, self.client_secret, self.password
+        )
+
+    def load_token(self, force=False):
+        """Obtiene el token de acceso a la API REST.
+
+        El token se comparte entre instancias y se renueva sólo cuando está a
+        punto de caducar, o cuando se fuerza porque la API lo ha rechazado.
+
+        :param bool force: Renovar aunque el token cacheado siga vigente
+        """
+        self._load_token(force, self.breaker)
+
+    def _load_token(self, force=False, breaker=None):
+        """`load_token` con el circuit breaker a usar al pedirlo. Dentro de una
+        petición se pide sin él: forma parte de la llamada que ya ha pasado por
+        el breaker, que puede ser la única permitida para sondear la API.
+
+        :param bool force: Renovar aunque el token cacheado siga vigente
+        :param CircuitBreaker breaker: Breaker por el que pasa la petición
+        """
+        rejected_token = self.token if force else None
+        cached = _TOKEN_CACHE.get(self._token_key)
+        if cached and cached[0] != rejected_token and cached[1] > time.monotonic():
+            self.token, self.token_expires = cached
+            return
+        with _token_lock(self._token_key):
+            # Otro hilo puede haberlo renovado mientras esperábamos
+            cached = _TOKEN_CACHE.get(self._token_key)
+            if (
+                cached
+                and cached[0] != rejected_token
+                and cached[1] > time.monotonic()
+            ):
+                self.token, self.token_expires = cached
+                return
+            self._request_token(breaker)
+            _TOKEN_CACHE[self._token_key] = (self.token, self.token_expires)
+
+    def _request_token(self, breaker=None):
+        """Solicita el token de acceso al servidor de autenticación.
 
-    def load_token(self):
-        """Solicita y almacena el token de acceso a la API REST."""
-        token_url = "https://es-ctt-integration-clients-pool-ids.auth.eu-central-1.amazoncognito.com/oauth2/token"
+        :param CircuitBreaker breaker: Breaker por el que pasa la petición
+        """
         payload = {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
@@ -30,11 +129,25 @@ class CttExpressRestAPI:
         }
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         try:
-            response = self.session.post(token_url, data=payload, headers=headers)
+            response = call_with_retries(
+                lambda: self.session.post(
+                    CTTEXPRESS_TOKEN_URL,
+                    data=payload,
+                    headers=headers,
+                    timeout=CTTEXPRESS_TIMEOUT,
+                ),
+                retries=CTTEXPRESS_RETRIES,
+                breaker=breaker,
+                is_transient_result=self._is_transient_response,
+            )
             response.raise_for_status()
             result = response.json()
             self.token = result.get("access_token")
-            self.token_expires = result.get("expires_in")
+            expires_in = result.get("expires_in") or CTTEXPRESS_TOKEN_DEFAULT_EXPIRY
+            self.token_expires = (
+                time.monotonic()
+                + max(int(expires_in) - CTTEXPRESS_TOKEN_EXPIRY_MARGIN, 0)
+            )
         except Exception as e:
             _logger.error("Error al obtener token: %s", e)
             raise
@@ -48,13 +161,48 @@ class CttExpressRestAPI:
             'Content-Type': 'application/json'
         }
 
+    @staticmethod
+    def _is_transient_response(response):
+        return response.status_code in TRANSIENT_STATUS_CODES
+
+    def _request(self, method, url, idempotent=False, **kwargs):
+        """Lanza la petición, con el token pedido o renovado antes si hace
+        falta, y si el token ha sido rechazado (401), la repite una única vez
+        con un token nuevo. Las operaciones idempotentes se reintentan ante
+        fallos transitorios.
+
+        :param bool idempotent: La operación se puede repetir sin riesgo
+        """
+        kwargs.setdefault("timeout", CTTEXPRESS_TIMEOUT)
+
+        def send():
+            # El token forma parte de la llamada: no pasa otra vez por el breaker
+            if not self.token or self.token_expires <= time.monotonic():
+                self._load_token()
+            response = self.session.request(
+                method, url, headers=self.get_headers(), **kwargs
+            )
+            if response.status_code == 401:
+                _logger.info("Token de CTT Express rechazado, se solicita uno nuevo")
+                self._load_token(force=True)
+                response = self.session.request(
+                    method, url, headers=self.get_headers(), **kwargs
+                )
+            return response
+
+        return call_with_retries(
+            send,
+            retries=CTTEXPRESS_RETRIES if idempotent else 0,
+            breaker=self.breaker,
+            is_transient_result=self._is_transient_response,
+        )
+
     def createShipment(self, data):
         """Ejecuta la creación de un envío."""
         endpoint = "/manifest/v1.0/shippings"
         url = self.url + endpoint
-        headers = self.get_headers()
         try:
-            response = self.session.post(url, json=data, headers=headers)
+            response = self._request("POST", url, json=data)
             response.raise_for_status()
             result = response.json()
             return result
@@ -66,26 +214,19 @@ class CttExpressRestAPI:
         """Ejecuta la cancelación de un envío."""
         endpoint = f"/manifest/v1.0/rpc-cancel-shipping-by-shipping-code/{shipping_code}"
         url = self.url + endpoint
-        headers = {
-            'user_name': self.username,
-            'password': self.password,
-            'Authorization': 'Bearer ' + (self.token or ''),
-            'Content-Type': 'application/json'
-        }
 
-        _logger.info("🚚 Enviando cancelShipment a: %s", url)
-        _logger.info("🔐 Headers enviados: %s", headers)
+        _logger.debug("🚚 Enviando cancelShipment a: %s", url)
 
         try:
             # Enviar body vacío como en PHP
-            response = self.session.post(url, headers=headers, json={})
-            _logger.info("📬 Status code recibido: %s", response.status_code)
-            _logger.info("📨 Respuesta recibida: %s", response.text)
+            response = self._request("POST", url, json={})
+            _logger.debug("📬 Status code recibido: %s", response.status_code)
+            _logger.debug("📨 Respuesta recibida: %s", response.text)
 
             response.raise_for_status()
 
             if response.status_code == 201:
-                _logger.info("✅ Cancelación exitosa de envío %s", shipping_code)
+                _logger.debug("✅ Cancelación exitosa de envío %s", shipping_code)
                 return {"status": "success"}
 
             if response.text.strip():
@@ -111,12 +252,25 @@ class CttExpressRestAPI:
             "label_offset": 1
         }
         url = self.url + endpoint
-        headers = self.get_headers()
         try:
-            response = self.session.get(url, headers=headers, params=params)
+            response = self._request("GET", url, idempotent=True, params=params)
             response.raise_for_status()
             result = response.json()
             return result
         except Exception as e:
             _logger.error("Error en printLabel: %s", e)
-            raise
\ No newline at end of file
+            raise
+
+    def getTracking(self, shipping_code):
+        """Obtiene el histórico de estados de un envío."""
+        endpoint = f"/trf/item-history-api/history/{shipping_code}"
+        url = self.url + endpoint
+        try:
+            response = self._request(
+                "GET", url, idempotent=True, params={"view": "APITRACK"}
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            _logger.error("Error en getTracking: %s", e)
+            raise
@@ -0,0 +1,104 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Default size of the worker pools used to talk to CTT Express concurrently.
+# Can be changed with the `delivery_cttexpress.max_workers` system parameter.
+CTTEXPRESS_MAX_WORKERS = 8
+
+
+def concurrent_map(function, items, max_workers=CTTEXPRESS_MAX_WORKERS):
+    """Apply the function to every item using a bounded pool of threads.
+
+    The function must not use the ORM: cursors and environments can't be
+    shared between threads. An exception raised for an item is returned in
+    its place, so a failing item doesn't abort the rest of them.
+
+    :param callable function: Function called with every item
+    :param iterable items: Items to process
+    :param int max_workers: Maximum number of concurrent calls
+    :return list: Results (or exceptions) in the same order as the items
+    """
+
+    def _call(item):
+        try:
+            return function(item)
+        except Exception as e:
+            return e
+
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [_call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(_call, items))
+
+
+def retry_until(function, is_done, timeout, initial_delay=0.25, max_delay=2.0):
+    """Call the function right away and, while the result isn't done, again with
+    an exponential backoff with jitter until the timeout expires.
+
+    Only the answers that aren't done yet are retried. An exception is a
+    permanent error and is raised right away: transient network errors are
+    already retried by the transport.
+
+    :param callable function: Function to call without arguments
+    :param callable is_done: Function that tells if a result is the final one
+    :param float timeout: Seconds after which we stop trying
+    :param float initial_delay: Seconds to wait before the first retry
+    :param float max_delay: Maximum seconds to wait between retries
+    :return: The last result, done or not
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        result = function()
+        if is_done(result):
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        time.sleep(min(remaining, delay * random.uniform(0.5, 1.5)))
+        delay = min(delay * 2, max_delay)
+
+
+async def async_retry_until(
+    function, is_done, timeout, initial_delay=0.25, max_delay=2.0
+):
+    """asyncio version of `retry_until`. The waits don't block the event loop.
+
+    :param callable function: Coroutine function to call without arguments
+    :param callable is_done: Function that tells if a result is the final one
+    :param float timeout: Seconds after which we stop trying
+    :return: The last result, done or not
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        result = await function()
+        if is_done(result):
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        await asyncio.sleep(min(remaining, delay * random.uniform(0.5, 1.5)))
+        delay = min(delay * 2, max_delay)
+
+
+class LazyJson:
+    """Defer the JSON serialization of a value until it's actually logged::
+
+        _logger.info("Payload: %s", LazyJson(values))
+
+    :param value: JSON serializable value. Other objects are logged as strings.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value, default=str, sort_keys=True)
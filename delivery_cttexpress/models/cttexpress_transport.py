@@ -0,0 +1,216 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""HTTP transport shared by the CTT Express SOAP and REST clients: pooled
+keep-alive sessions, explicit timeouts, retries with backoff for idempotent
+operations and a circuit breaker per API that fails fast while CTT is down.
+It doesn't depend on Odoo, so it can be used from worker threads."""
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cttexpress_tools import CTTEXPRESS_MAX_WORKERS
+
+_logger = logging.getLogger(__name__)
+
+# Seconds to establish a connection and to wait for an answer
+CTTEXPRESS_CONNECT_TIMEOUT = 5
+CTTEXPRESS_READ_TIMEOUT = 30
+CTTEXPRESS_TIMEOUT = (CTTEXPRESS_CONNECT_TIMEOUT, CTTEXPRESS_READ_TIMEOUT)
+# Keep-alive connections per host. Several threads of the worker may run their
+# own pools of CTTEXPRESS_MAX_WORKERS at the same time.
+CTTEXPRESS_POOL_SIZE = 2 * CTTEXPRESS_MAX_WORKERS
+# Retries of the idempotent operations after a transient failure
+CTTEXPRESS_RETRIES = 3
+# Consecutive transient failures that open the circuit, and seconds it stays
+# open before a call is let through to probe the API again
+CTTEXPRESS_BREAKER_FAILURES = 5
+CTTEXPRESS_BREAKER_RESET = 30
+# HTTP statuses worth retrying
+TRANSIENT_STATUS_CODES = {429, 502, 503, 504}
+
+_SESSIONS = {}
+_BREAKERS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """The API failed too many times in a row and it isn't called for now"""
+
+
+class CircuitBreaker:
+    """Count the consecutive transient failures of an API. Once they reach the
+    threshold, calls fail right away until the reset timeout expires. Then a
+    single call is let through: if it works the circuit is closed again,
+    otherwise it stays open for another period.
+
+    :param str name: API name, for the messages
+    :param int failure_threshold: Consecutive failures that open the circuit
+    :param float reset_timeout: Seconds before probing the API again
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=CTTEXPRESS_BREAKER_FAILURES,
+        reset_timeout=CTTEXPRESS_BREAKER_RESET,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def before_call(self):
+        """:raises CircuitOpenError: If the API mustn't be called now"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(
+            "CTT Express {} API is unavailable after {} consecutive failures. "
+            "Try again later.".format(self.name, self.failures)
+        )
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    _logger.warning(
+                        "CTT Express %s API circuit opened after %s failures",
+                        self.name,
+                        self.failures,
+                    )
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+def get_session(name):
+    """Keep-alive session shared by every client of the worker for an API
+
+    :param str name: API name ("soap" or "rest")
+    :return requests.Session: Session with pooled connections
+    """
+    session = _SESSIONS.get(name)
+    if session:
+        return session
+    with _REGISTRY_LOCK:
+        session = _SESSIONS.get(name)
+        if not session:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=CTTEXPRESS_POOL_SIZE,
+                pool_maxsize=CTTEXPRESS_POOL_SIZE,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSIONS[name] = session
+    return session
+
+
+def get_circuit_breaker(name):
+    """Circuit breaker shared by every client of the worker for an API
+
+    :param str name: API name, e.g.: "soap-prod"
+    :return CircuitBreaker: The breaker
+    """
+    breaker = _BREAKERS.get(name)
+    if breaker:
+        return breaker
+    with _REGISTRY_LOCK:
+        return _BREAKERS.setdefault(name, CircuitBreaker(name))
+
+
+def reset_transport():
+    """Close the shared sessions and forget the breakers state"""
+    with _REGISTRY_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+        _BREAKERS.clear()
+
+
+def is_transient_error(error):
+    """Tell if a failed call could work if it's tried again
+
+    :param Exception error: The raised exception
+    :return bool: True for connection errors, timeouts and server overloads
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    return status_code in TRANSIENT_STATUS_CODES
+
+
+def call_with_retries(
+    function,
+    retries=0,
+    breaker=None,
+    is_transient_result=None,
+    initial_delay=0.5,
+    max_delay=8.0,
+):
+    """Call the function through the circuit breaker and, after a transient
+    failure, try it again with an exponential backoff with jitter. Only
+    idempotent operations should be retried.
+
+    :param callable function: Function to call without arguments
+    :param int retries: Times the call is repeated at most
+    :param CircuitBreaker breaker: Breaker of the API, if any
+    :param callable is_transient_result: Tell if a returned value is a
+        transient failure (e.g.: a 503 response). The last one is returned.
+    :param float initial_delay: Seconds to wait before the first retry
+    :param float max_delay: Maximum seconds to wait between retries
+    :return: The function result
+    :raises CircuitOpenError: If the API isn't being called for now
+    """
+    delay = initial_delay
+    for attempt in range(retries + 1):
+        if breaker:
+            breaker.before_call()
+        try:
+            result = function()
+        except Exception as e:
+            transient = is_transient_error(e)
+            if breaker:
+                # Other errors mean the API is answering
+                breaker.record_failure() if transient else breaker.record_success()
+            if not transient or attempt == retries:
+                raise
+            _logger.debug("CTT Express call failed (%s), retrying", e)
+        else:
+            if not (is_transient_result and is_transient_result(result)):
+                if breaker:
+                    breaker.record_success()
+                return result
+            if breaker:
+                breaker.record_failure()
+            if attempt == retries:
+                return result
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, max_delay)
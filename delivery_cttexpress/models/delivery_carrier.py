@@ -2,7 +2,8 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
-from datetime import date
+from odoo.tools import float_repr, float_round, ormcache
+from datetime import date, datetime, timedelta
 
 from .cttexpress_master_data import (
     CTTEXPRESS_DELIVERY_STATES_STATIC,
@@ -10,15 +11,125 @@ from .cttexpress_master_data import (
     REST_CTTEXPRESS_SERVICES,
 )
 from .cttexpress_request import CTTExpressRequest
-from .cttexpress_rest_request import CttExpressRestAPI
-import json
+from .cttexpress_rest_async_request import (
+    CTTEXPRESS_ASYNC_CONCURRENCY,
+    async_available,
+    run_rest_batch,
+)
+from .cttexpress_rest_request import CttExpressRestAPI, invalidate_token_cache
+from .cttexpress_tools import (
+    CTTEXPRESS_MAX_WORKERS,
+    LazyJson,
+    async_retry_until,
+    concurrent_map,
+    retry_until,
+)
+from .delivery_cttexpress_rate import get_zone, lookup_rate
 import base64
-import requests
 
 import logging
-import time
 _logger = logging.getLogger(__name__)
 
+# Hours the hired services of an account are trusted before asking CTT again
+CTTEXPRESS_SERVICE_TYPES_TTL = 24
+# Fields identifying the account the services are hired for
+CTTEXPRESS_ACCOUNT_FIELDS = {
+    "cttexpress_user",
+    "cttexpress_password",
+    "cttexpress_agency",
+    "cttexpress_customer",
+    "cttexpress_contract",
+    "prod_environment",
+}
+# Credentials of the REST accounts, whose tokens are cached by the worker
+CTTEXPRESS_REST_ACCOUNT_FIELDS = {
+    "cttexpress_rest_id",
+    "cttexpress_rest_secret",
+    "cttexpress_rest_user",
+    "cttexpress_rest_password",
+}
+
+
+def rest_label_content(api_result):
+    """Decode the label of a REST printLabel answer
+
+    :param dict api_result: printLabel JSON answer
+    :return bytes: Label content or False if there's none yet
+    """
+    if "data" in api_result and api_result["data"]:
+        # Se extrae el contenido en Base64
+        label_b64 = api_result["data"][0].get("label", False)
+    else:
+        label_b64 = False
+    return label_b64 and base64.b64decode(label_b64)
+
+
+def rest_cancel_error(response):
+    """Errors of a REST cancelShipment answer in the SOAP errors format
+
+    :param dict response: Decoded answer. Empty when it had no body.
+    :return list: Tuples (code, description)
+    """
+    error = (response or {}).get("error")
+    return [("REST", error)] if error else []
+
+
+def rest_trackings(api_result):
+    """Tracking events of a REST getTracking answer in the SOAP tracking format
+
+    :param dict api_result: getTracking JSON answer
+    :return list: Tracking values, from the oldest to the newest
+    """
+    history = ((api_result or {}).get("data") or {}).get("shipping_history") or {}
+    trackings = [
+        {
+            # Las fechas llegan en ISO 8601, a veces con la zona como "Z"
+            "StatusDateTime": datetime.fromisoformat(
+                event["event_date"].replace("Z", "+00:00")
+            ),
+            "StatusCode": str(event["code"]),
+            "StatusDescription": event.get("description"),
+            "IncidentCode": event.get("incident_code"),
+            "IncidentDescription": event.get("incident_description"),
+        }
+        for event in history.get("events") or []
+    ]
+    return sorted(trackings, key=lambda tracking: tracking["StatusDateTime"])
+
+
+def map_documents(references, documents):
+    """Map the documents returned for several shipping codes back to them. We
+    rely on the file names when they contain the shipping codes and on the
+    order when there's a document for every code. Otherwise (e.g. a single
+    document with all the labels) the first code gets all the documents, so
+    they're attached once, and the other codes get None.
+
+    :param list references: Shipping codes in the order they were requested
+    :param list documents: Documents as (file_name, file_content) tuples
+    :return dict: List of documents of every shipping code, or None when they
+        are in the documents of another one
+    """
+    by_name = {reference: [] for reference in references}
+    for file_name, file_content in documents:
+        owners = [ref for ref in references if ref in (file_name or "")]
+        if len(owners) != 1:
+            break
+        by_name[owners[0]].append((file_name, file_content))
+    else:
+        return by_name
+    if len(documents) == len(references):
+        return {ref: [document] for ref, document in zip(references, documents)}
+    _logger.info(
+        "CTT Express returned %s documents for %s shipping codes. They are "
+        "attached to %s, which includes the labels of: %s",
+        len(documents),
+        len(references),
+        references[0],
+        ", ".join(references[1:]),
+    )
+    return {references[0]: list(documents), **dict.fromkeys(references[1:])}
+
+
 class DeliveryCarrier(models.Model):
     _inherit = "delivery.carrier"
 
@@ -27,34 +138,70 @@ class DeliveryCarrier(models.Model):
         ondelete={'ctt': 'set default'}  # <- Política obligatoria para evitar errores
     )
 
-    is_ctt = fields.Boolean(string="Es CTT", compute="_compute_is_ctt", store=True)
+    is_ctt = fields.Boolean(
+        string="Es CTT", compute="_compute_is_ctt", store=True, index=True
+    )
     is_ctt_visible = fields.Boolean(
         string="Es CTT Visible", store=True
     )
 
-    @api.model
-    def create(self, vals):
-        record = super(DeliveryCarrier, self).create(vals)
-        record._onchange_delivery_type_ctt()
-        return record
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        for record in records:
+            record._onchange_delivery_type_ctt()
+        if any(records.mapped("is_ctt")):
+            self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        if CTTEXPRESS_REST_ACCOUNT_FIELDS.intersection(vals):
+            # Forget the tokens of the former credentials
+            for carrier in self:
+                invalidate_token_cache(
+                    carrier.cttexpress_rest_id, carrier.cttexpress_rest_user
+                )
+        ctt_carriers = "delivery_type" in vals and self.filtered("is_ctt")
+        res = super().write(vals)
+        # Las cachés solo dependen de qué transportistas son de CTT
+        if "delivery_type" in vals and self.filtered("is_ctt") != ctt_carriers:
+            self.env.registry.clear_cache()
+        if CTTEXPRESS_ACCOUNT_FIELDS.intersection(vals):
+            # Fetch the services of the new account in the background
+            cron = self.env.ref(
+                "delivery_cttexpress.ir_cron_cttexpress_service_types",
+                raise_if_not_found=False,
+            )
+            if cron:
+                cron.sudo()._trigger()
+        return res
+
+    def unlink(self):
+        is_ctt = any(self.mapped("is_ctt"))
+        res = super().unlink()
+        if is_ctt:
+            self.env.registry.clear_cache()
+        return res
 
-    @api.depends('name')
+    @api.depends("delivery_type")
     def _compute_is_ctt(self):
         for carrier in self:
-            # Obtiene el valor del nombre, que puede ser una cadena o un JSON
-            name_value = carrier.name
-            if isinstance(name_value, str):
-                try:
-                    name_value = json.loads(name_value)
-                except Exception:
-                    # Si no es un JSON, se mantiene la cadena
-                    pass
-            # Si es un dict, extraemos el valor en 'en_US' (o el idioma que prefieras)
-            if isinstance(name_value, dict):
-                value = name_value.get("en_US", "").strip().lower()
-            else:
-                value = str(name_value).strip().lower()
-            carrier.is_ctt = (value == "ctt express")
+            carrier.is_ctt = carrier.delivery_type == "ctt"
+
+    @api.model
+    @ormcache()
+    def _get_ctt_carrier_ids(self):
+        """Ids of the CTT Express carriers, cached per registry
+
+        :return frozenset: Carrier ids
+        """
+        return frozenset(
+            self.sudo()
+            .with_context(active_test=False)
+            .search([("is_ctt", "=", True)])
+            .ids
+        )
+
     cttexpress_api = fields.Selection(
         selection=[
             ('REST', 'REST'),
@@ -100,6 +247,42 @@ class DeliveryCarrier(models.Model):
         string="Document format",
     )
     cttexpress_document_offset = fields.Integer(string="Document Offset")
+    cttexpress_label_mode = fields.Selection(
+        selection=[
+            ("sync", "When recording the shipping"),
+            ("deferred", "Deferred"),
+        ],
+        default="sync",
+        string="Label retrieval",
+        help="Deferred: the labels are retrieved and attached to the pickings "
+        "later by a scheduled action, so recording the shippings doesn't wait "
+        "for them.",
+    )
+    cttexpress_label_timeout = fields.Float(
+        default=10.0,
+        string="Label timeout (s)",
+        help="Maximum seconds to wait for the label to be ready when recording "
+        "the shipping. Labels not ready by then are retrieved later.",
+    )
+
+    cttexpress_log_level = fields.Selection(
+        selection=[
+            ("none", "None"),
+            ("summary", "Summary"),
+            ("payload", "Payloads"),
+        ],
+        default="summary",
+        string="Request logging",
+        help="Summary: a line per recorded shipping. Payloads: the shipping "
+        "values sent to CTT Express as well. Raw SOAP requests and responses "
+        "are logged with the debug logging option.",
+    )
+    cttexpress_rate_ids = fields.One2many(
+        comodel_name="delivery.cttexpress.rate",
+        inverse_name="carrier_id",
+        string="CTT Express rates",
+        copy=True,
+    )
 
     custom_ask_package_number = fields.Boolean(
         string="Preguntar número de bultos", default=True,
@@ -122,67 +305,127 @@ class DeliveryCarrier(models.Model):
             rec.show_rest = (rec.cttexpress_api == 'REST')
 
     def _is_ctt(self):
-        # Si el nombre es un diccionario (o una cadena que representa un diccionario)
-        name_value = self.name
-        if isinstance(name_value, str):
-            try:
-                # Intentamos cargarlo como JSON
-                name_value = json.loads(name_value)
-            except Exception:
-                # Si falla, se queda como string
-                pass
-        # Si es un dict, tomamos el valor en 'en_US' (o el idioma que prefieras)
-        if isinstance(name_value, dict):
-            name_value = name_value.get("en_US", "").strip().lower()
-        else:
-            name_value = str(name_value).strip().lower()
+        """Tell if the carrier is a CTT Express one"""
+        if isinstance(self.id, int):
+            return self.id in self._get_ctt_carrier_ids()
+        # Registros en edición todavía sin guardar
+        return self.delivery_type == "ctt"
 
-        return name_value == "ctt express"
-
-    @api.onchange("delivery_type", "name")
+    @api.onchange("delivery_type")
     def _onchange_delivery_type_ctt(self):
         """Si el transportista es CTT Express, se activa la funcionalidad específica."""
-        if self._is_ctt():
+        if self.delivery_type == "ctt":
             self.price_method = "base_on_rule"
-            self.is_ctt = True
-        else:
-            self.is_ctt = False
 
     def _ctt_request(self):
         """Get CTT Request object
 
         :return CTTExpressRequest: CTT Express Request object
         """
-        return CTTExpressRequest(
-            user=self.cttexpress_user,
-            password=self.cttexpress_password,
-            agency=self.cttexpress_agency,
-            customer=self.cttexpress_customer,
-            contract=self.cttexpress_contract,
-            prod=self.prod_environment,
+        return CTTExpressRequest(**self._ctt_request_params())
+
+    def _ctt_request_params(self):
+        """CTT Request object arguments. As they're plain values, request objects
+        can be built from them in worker threads, where the ORM can't be used.
+
+        :return dict: CTTExpressRequest keyword arguments
+        """
+        self.ensure_one()
+        return {
+            "user": self.cttexpress_user,
+            "password": self.cttexpress_password,
+            "agency": self.cttexpress_agency,
+            "customer": self.cttexpress_customer,
+            "contract": self.cttexpress_contract,
+            "prod": self.prod_environment,
+        }
+
+    @api.model
+    def _cttexpress_max_workers(self):
+        """Maximum concurrent calls to the CTT Express API from this worker"""
+        return int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("delivery_cttexpress.max_workers", CTTEXPRESS_MAX_WORKERS)
         )
-    
+
     def _ctt_rest_request(self):
         """Crea el objeto de integración REST usando los parámetros de REST."""
-        return CttExpressRestAPI(
-            url="https://api.cttexpress.com/integrations",  
-            client_id=self.cttexpress_rest_id,
-            client_secret=self.cttexpress_rest_secret,
-            username=self.cttexpress_rest_user,
-            password=self.cttexpress_rest_password,
-            client_code=self.cttexpress_rest_agency,
-            platform=self.cttexpress_rest_shipping_type  # O el campo que corresponda
+        return CttExpressRestAPI(**self._ctt_rest_request_params())
+
+    def _ctt_rest_request_params(self):
+        """Argumentos de los clientes REST, síncrono y asyncio. Son valores
+        simples, así que se pueden usar fuera del ORM.
+
+        :return dict: Argumentos de `CttExpressRestAPI`
+        """
+        self.ensure_one()
+        return {
+            "url": "https://api.cttexpress.com/integrations",
+            "client_id": self.cttexpress_rest_id,
+            "client_secret": self.cttexpress_rest_secret,
+            "username": self.cttexpress_rest_user,
+            "password": self.cttexpress_rest_password,
+            "client_code": self.cttexpress_rest_agency,
+            "platform": self.cttexpress_rest_shipping_type,
+        }
+
+    def _cttexpress_use_rest_async(self):
+        """REST batches fan out from a single asyncio client when aiohttp is
+        installed. Otherwise they run in the worker threads pool.
+        """
+        self.ensure_one()
+        return self.cttexpress_api == "REST" and async_available()
+
+    def _cttexpress_rest_batch(self, function, items):
+        """Run a REST coroutine for every item with a single asyncio client.
+        If the whole batch fails (e.g.: no token), every item gets the error.
+
+        :param callable function: Coroutine called with the client and every item
+        :param list items: Items to process
+        :return list: Results (or exceptions) in the same order as the items
+        """
+        concurrency = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(
+                "delivery_cttexpress.rest_async_concurrency",
+                CTTEXPRESS_ASYNC_CONCURRENCY,
+            )
         )
+        try:
+            return run_rest_batch(
+                self._ctt_rest_request_params(), function, items, concurrency
+            )
+        except Exception as e:
+            return [e] * len(items)
 
     @api.model
     def _ctt_log_request(self, ctt_request):
-        """When debug is active requests/responses will be logged in ir.logging
+        """When debug is active requests/responses will be logged in ir.logging.
+        Otherwise they aren't even serialized.
 
         :param ctt_request: CTT Express request object
         """
+        if not self.debug_logging:
+            return
         self.log_xml(ctt_request.ctt_last_request, "ctt_request")
         self.log_xml(ctt_request.ctt_last_response, "ctt_response")
 
+    def _cttexpress_log_summary(self, message, *args):
+        """Log a line per request unless the carrier logging is off. The
+        message is only formatted if it's actually emitted.
+        """
+        if self.cttexpress_log_level in ("summary", "payload"):
+            _logger.info(message, *args)
+
+    def _cttexpress_log_payload(self, payload, message, *args):
+        """Log a request payload when the carrier asks for them. Neither the
+        message nor the payload are formatted unless it's actually emitted.
+        """
+        if self.cttexpress_log_level == "payload":
+            _logger.info(message + ": %s", *args, LazyJson(payload))
+
     def _ctt_check_error(self, error):
         """Common error checking. We stop the program when an error is returned.
 
@@ -202,13 +445,18 @@ class DeliveryCarrier(models.Model):
 
     @api.model
     def _cttexpress_format_tracking(self, tracking):
-        """Helper to format tracking history strings
+        """Helper to format tracking history strings. The status date is
+        normalized as the tracking events store it, so the same status always
+        gives the same line whatever the API it came from.
 
         :param OrderedDict tracking: CTT tracking values
         :return str: Tracking line
         """
+        status_date = self.env["stock.picking.tracking.event"]._normalize_date(
+            tracking["StatusDateTime"]
+        )
         status = "{} - [{}] {}".format(
-            fields.Datetime.to_string(tracking["StatusDateTime"]),
+            fields.Datetime.to_string(status_date),
             tracking["StatusCode"],
             tracking["StatusDescription"],
         )
@@ -220,35 +468,154 @@ class DeliveryCarrier(models.Model):
 
     @api.onchange("cttexpress_shipping_type")
     def _onchange_cttexpress_shipping_type(self):
-        """Control service validity according to credentials
+        """Control service validity according to the services hired by the
+        account. They're read from the local catalogue, so the check is skipped
+        until they've been fetched.
 
         :raises UserError: We list the available services for given credentials
         """
         if not self.cttexpress_shipping_type:
             return
-        # Avoid checking if credentials aren't setup or are invalid
-        try:
-            self.action_ctt_validate_user()
-        except UserError:
+        service_types = self._cttexpress_service_types()
+        if not service_types or self.cttexpress_shipping_type in service_types:
             return
-        ctt_request = self._ctt_request()
-        error, service_types = ctt_request.get_service_types()
-        self._ctt_log_request(ctt_request)
-        self._ctt_check_error(error)
-        type_codes, type_descriptions = zip(*service_types)
-        if self.cttexpress_shipping_type not in type_codes:
-            service_name = dict(
-                self._fields["cttexpress_shipping_type"]._description_selection(self.env)
-            )[self.cttexpress_shipping_type]
-            raise UserError(
-                _(
-                    "This CTT Express service (%(service_name)s) isn't allowed for "
-                    "this account configuration. Please choose one of the followings\n"
-                    "%(type_descriptions)s",
-                    service_name=service_name,
-                    type_descriptions=type_descriptions,
-                )
+        service_name = dict(
+            self._fields["cttexpress_shipping_type"]._description_selection(self.env)
+        )[self.cttexpress_shipping_type]
+        raise UserError(
+            _(
+                "This CTT Express service (%(service_name)s) isn't allowed for "
+                "this account configuration. Please choose one of the followings\n"
+                "%(type_descriptions)s",
+                service_name=service_name,
+                type_descriptions=tuple(service_types.values()),
+            )
+        )
+
+    def _cttexpress_account_key(self):
+        """Key of the CTT Express account in the services catalogue
+
+        :return str: Agency, customer, contract and environment
+        """
+        self.ensure_one()
+        return "{}|{}|{}|{}".format(
+            self.cttexpress_agency or "",
+            self.cttexpress_customer or "",
+            self.cttexpress_contract or "",
+            "prod" if self.prod_environment else "test",
+        )
+
+    def _cttexpress_service_types(self):
+        """Services hired by the carrier account as stored in the catalogue
+
+        :return dict: Service descriptions by code. Empty if not fetched yet
+        """
+        service_types = (
+            self.env["delivery.cttexpress.service.type"]
+            .sudo()
+            .search([("account_key", "=", self._cttexpress_account_key())])
+        )
+        return {service.code: service.name for service in service_types}
+
+    def action_ctt_refresh_service_types(self):
+        """Fetch the services hired by the carrier accounts now
+
+        :raises UserError: If any account couldn't be refreshed
+        """
+        errors = self._cttexpress_refresh_service_types()
+        if errors:
+            raise UserError("\n".join(errors))
+
+    def _cttexpress_refresh_service_types(self):
+        """Ask CTT for the services of every account concurrently and replace
+        them in the catalogue. Carriers sharing an account are requested once.
+
+        :return list: Error messages of the accounts that failed
+        """
+        accounts = {}
+        for carrier in self.filtered(
+            lambda c: c.delivery_type == "ctt"
+            and c.cttexpress_api == "SOAP"
+            and c.cttexpress_user
+        ):
+            accounts.setdefault(carrier._cttexpress_account_key(), carrier)
+        if not accounts:
+            return []
+
+        def get_service_types(request_params):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error, service_types = ctt_request.get_service_types()
+            except Exception as e:
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, service_types
+
+        carriers = list(accounts.values())
+        responses = concurrent_map(
+            get_service_types,
+            [carrier._ctt_request_params() for carrier in carriers],
+            self._cttexpress_max_workers(),
+        )
+        ServiceType = self.env["delivery.cttexpress.service.type"].sudo()
+        now = fields.Datetime.now()
+        errors = []
+        refreshed_keys = []
+        vals_list = []
+        for (account_key, carrier), response in zip(accounts.items(), responses):
+            ctt_request, error, service_types = carrier._cttexpress_unpack_response(
+                response
             )
+            if ctt_request:
+                carrier._ctt_log_request(ctt_request)
+            error_msg = carrier._cttexpress_error_message(error)
+            if error_msg:
+                errors.append("{}: {}".format(carrier.name, error_msg))
+                continue
+            refreshed_keys.append(account_key)
+            vals_list += [
+                {
+                    "account_key": account_key,
+                    "code": code,
+                    "name": description,
+                    "refresh_date": now,
+                }
+                for code, description in service_types
+            ]
+        ServiceType.search([("account_key", "in", refreshed_keys)]).unlink()
+        ServiceType.create(vals_list)
+        return errors
+
+    @api.model
+    def _cron_cttexpress_refresh_service_types(self):
+        """Refresh the services of the accounts not fetched in the last hours"""
+        ttl = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(
+                "delivery_cttexpress.service_types_ttl", CTTEXPRESS_SERVICE_TYPES_TTL
+            )
+        )
+        fresh_keys = set(
+            self.env["delivery.cttexpress.service.type"]
+            .sudo()
+            .search(
+                [
+                    (
+                        "refresh_date",
+                        ">",
+                        fields.Datetime.now() - timedelta(hours=ttl),
+                    )
+                ]
+            )
+            .mapped("account_key")
+        )
+        carriers = self.browse(self._get_ctt_carrier_ids()).filtered(
+            lambda c: c.active and c._cttexpress_account_key() not in fresh_keys
+        )
+        for error in carriers._cttexpress_refresh_service_types():
+            _logger.warning("CTT Express services not refreshed. %s", error)
 
     def action_ctt_validate_user(self):
         """Maps to API's ValidateUser method
@@ -311,7 +678,6 @@ class DeliveryCarrier(models.Model):
                     "comments": ""
                 },
             }
-            _logger.info("Manifest a enviar: %s", json.dumps(manifest, indent=4))
             return manifest
         else:
             # Estructura para SOAP (la versión original)
@@ -353,6 +719,10 @@ class DeliveryCarrier(models.Model):
         if self.delivery_type != 'ctt':
             return super().rate_shipment(order)
 
+        # Tarifas propias de CTT compiladas en memoria
+        if self._cttexpress_rate_table()["bands"]:
+            return self._cttexpress_rate_order(order)
+
         # Si usas reglas de precio de Odoo, usa la lógica estándar
         if self.delivery_type == 'ctt' and self.fixed_price is not None:
             return {'success': True, 'price': self.fixed_price, 'error_message': False, 'warning_message': False}
@@ -366,103 +736,607 @@ class DeliveryCarrier(models.Model):
             'warning_message': False,
         }
 
-    def send_shipping(self, pickings):
-        result = []
+    @ormcache("self.id")
+    def _cttexpress_rate_table(self):
+        """Compile the carrier rates into sorted weight bands by service, zone
+        and zip prefix, so rating is a dictionary and a bisect lookup. It's
+        cleared whenever the rates change.
+
+        :return dict: Weight bands by (service, zone, zip prefix) and the zip
+            prefix lengths to try, from the longest to the shortest
+        """
+        rows = {}
+        for rate in self.sudo().cttexpress_rate_ids:
+            key = (rate.service_code or "", rate.zone or "", rate.zip_prefix or "")
+            rows.setdefault(key, []).append(
+                (rate.max_weight, rate.price, rate.extra_package_price)
+            )
+        bands = {}
+        for key, key_rows in rows.items():
+            key_rows.sort()
+            bands[key] = tuple(tuple(column) for column in zip(*key_rows))
+        prefix_lengths = {len(prefix) for _service, _zone, prefix in bands} | {0}
+        return {
+            "bands": bands,
+            "prefix_lengths": tuple(sorted(prefix_lengths, reverse=True)),
+        }
 
+    def _rate_shipment_multi_prices(self, orders, values):
+        """Mirror `rate_shipment`: the compiled rates or the fixed price"""
+        if self.delivery_type != "ctt":
+            return super()._rate_shipment_multi_prices(orders, values)
+        table = self._cttexpress_rate_table()
+        if not table["bands"]:
+            return [self.fixed_price] * len(orders)
+        service = self._cttexpress_service_code()
+        packages = self.default_number_of_packages or 1
+        prices = []
+        for weight, zip_code, country_code in zip(
+            values["weight"], values["zip"], values["country_code"]
+        ):
+            price = lookup_rate(
+                table,
+                service,
+                get_zone(country_code, zip_code),
+                zip_code,
+                weight,
+                packages,
+            )
+            prices.append(price if price is not None else False)
+        return prices
+
+    def _cttexpress_service_code(self):
+        if self.cttexpress_api == "REST":
+            return self.cttexpress_rest_shipping_type
+        return self.cttexpress_shipping_type
+
+    def _cttexpress_rate_order(self, order, weight=None):
+        """Rate the order with the compiled CTT Express rates
+
+        :param sale.order order: Order to rate
+        :param float weight: Order weight, if already known
+        :return dict: Rating result as `rate_shipment` returns it
+        """
+        if weight is None:
+            # Como `rate_shipment_multi`: el peso de envío del pedido primero
+            weight = (
+                self.env.context.get("order_weight")
+                or order.shipping_weight
+                or order._get_estimated_weight()
+            )
+        partner = order.partner_shipping_id
+        country_code = partner.country_id.code
+        zip_code = (partner.zip or "").strip()
+        price = lookup_rate(
+            self._cttexpress_rate_table(),
+            self._cttexpress_service_code(),
+            get_zone(country_code, zip_code),
+            zip_code,
+            weight,
+            self.default_number_of_packages or 1,
+        )
+        if price is None:
+            return {
+                "success": False,
+                "price": 0.0,
+                "error_message": _(
+                    "There's no CTT Express rate for %(weight)s kg to %(zip)s %(country)s"
+                )
+                % {"weight": weight, "zip": zip_code, "country": country_code or ""},
+                "warning_message": False,
+            }
+        return {
+            "success": True,
+            "price": price,
+            "error_message": False,
+            "warning_message": False,
+        }
+
+    def send_shipping(self, pickings):
         # Only continue if delivery type is CTT
         if self.delivery_type != "ctt":
-            _logger.info("Skipping shipping because delivery_type is not CTT.")
+            _logger.debug("Skipping shipping because delivery_type is not CTT.")
             return super().send_shipping(pickings)
+        result = self.cttexpress_send_shipping_batch(pickings)
+        # The standard flow sends the pickings one by one: keep failing hard there
+        if len(pickings) == 1 and result[0].get("error_message"):
+            raise UserError(result[0]["error_message"])
+        return result
+
+    def cttexpress_send_shipping_batch(self, pickings):
+        """Record the shippings of many pickings at once. The payloads are
+        prepared first, then the shippings and their labels are requested
+        concurrently and finally the results are written on the pickings.
 
+        :param recordset pickings: `stock.picking` recordset
+        :return list: One dict per picking in the same order. Those pickings
+            that couldn't be recorded have the error in the `error_message` key.
+        """
+        self.ensure_one()
+        prefetched = self.env.context.get("cttexpress_shipping_responses") or {}
+        pending = pickings.filtered(lambda p: p.id not in prefetched)
+        responses = dict(prefetched)
+        responses.update(self._cttexpress_send_shipping_requests(pending))
+        result = []
         for picking in pickings:
-            _logger.info("picking a enviar: %s", json.dumps(picking.read(), indent=4, default=str))
-            vals = self._prepare_cttexpress_shipping(picking)
-            if self.cttexpress_api == 'REST':
-                # Uso de la integración REST
-                rest_api = self._ctt_rest_request()
-                api_result = rest_api.createShipment(vals)
-                tracking = api_result.get("shipping_data", {}).get("shipping_code")
-            else:
-                # Uso de la integración SOAP (método actual)
-                ctt_request = self._ctt_request()
-                try:
-                    error, documents, tracking = ctt_request.manifest_shipping(vals)
-                    self._ctt_check_error(error)
-                except Exception as e:
-                    _logger.debug("Excepción en manifest_shipping para picking %s: %s", picking.name, e)
-                    raise e
-                finally:
-                    self._ctt_log_request(ctt_request)
+            response = responses[picking.id]
+            vals = response["vals"]
+            error_message = self._cttexpress_check_shipping_response(
+                picking, response
+            )
+            if error_message:
+                vals.update(
+                    {
+                        "tracking_number": False,
+                        "exact_price": 0.0,
+                        "error_message": error_message,
+                    }
+                )
+                result.append(vals)
+                continue
+            tracking = response["tracking"]
+            self._cttexpress_log_summary(
+                "CTT Express shipping of %s recorded: %s", picking.name, tracking
+            )
             # Se asigna el tracking al picking
             if tracking:
                 if not picking.carrier_tracking_ref:
                     picking.carrier_tracking_ref = tracking
                 else:
                     picking.carrier_tracking_ref += "," + tracking
-
-            price_result = self.rate_shipment(picking.sale_id)
-            exact_price = price_result.get("price", 0.0)
-            picking.write({
-                'carrier_price': exact_price,
-            })
-
-            vals.update({
-                "tracking_number": tracking,
-                "exact_price": exact_price,
-            })
-            # Solicitar la etiqueta
-            time.sleep(2)
-            documents = self.cttexpress_get_label(tracking)
-            if not documents:
-                attachments = []
-            else:
-                attachments = documents
-            picking.message_post(body=_("CTT Shipping Documents"), attachments=attachments)
+            vals["tracking_number"] = tracking
             result.append(vals)
+        shipped = pickings.browse(
+            [p.id for p, vals in zip(pickings, result) if not vals.get("error_message")]
+        )
+        shipped.filtered("cttexpress_shipping_error").write(
+            {"cttexpress_shipping_error": False}
+        )
+        prices = self._cttexpress_shipping_prices(shipped)
+        # Grouped writes and chatter posts once every shipping is recorded
+        pickings_by_price = {}
+        for picking, vals in zip(pickings, result):
+            if not vals.get("error_message"):
+                vals["exact_price"] = prices[picking]
+                pickings_by_price.setdefault(
+                    vals["exact_price"], self.env["stock.picking"]
+                )
+                pickings_by_price[vals["exact_price"]] |= picking
+        for price, price_pickings in pickings_by_price.items():
+            price_pickings.write({"carrier_price": price})
+        pending_label_pickings = self.env["stock.picking"]
+        picking_labels = []
+        for picking, vals in zip(pickings, result):
+            if vals.get("error_message") or not vals["tracking_number"]:
+                continue
+            response = responses[picking.id]
+            label_error = self._cttexpress_error_message(response["label_error"])
+            if label_error:
+                picking.message_post(
+                    body=_("CTT Express label couldn't be retrieved: %s") % label_error
+                )
+            attachments = self._cttexpress_format_label(
+                vals["tracking_number"], response["label"]
+            )
+            if not attachments:
+                pending_label_pickings |= picking
+                continue
+            picking_labels.append((picking, attachments))
+        self._cttexpress_post_labels(picking_labels)
+        # The scheduled action will attach them once they're ready
+        pending_label_pickings.write(
+            {"cttexpress_label_pending": True, "cttexpress_label_attempts": 0}
+        )
         return result
 
+    def _cttexpress_check_shipping_response(self, picking, response):
+        """Log the requests of a shipping response and post its error, if any,
+        in the picking chatter. The requests are only logged once.
+
+        :param record picking: `stock.picking` record
+        :param dict response: Response as `_cttexpress_send_shipping_requests`
+            returns it
+        :return str: Error message or False if the shipping was recorded. It's
+            kept in `cttexpress_shipping_error` too, so the pickings can be found.
+        """
+        for ctt_request in response["requests"]:
+            self._ctt_log_request(ctt_request)
+        response["requests"] = []
+        error_message = self._cttexpress_error_message(response["error"])
+        if error_message:
+            _logger.debug(
+                "Error recording CTT Express shipping for %s: %s",
+                picking.name,
+                error_message,
+            )
+            picking.message_post(
+                body=_("CTT Express shipping couldn't be recorded: %s")
+                % error_message
+            )
+            picking.cttexpress_shipping_error = error_message
+        return error_message
+
+    def _cttexpress_quote_fingerprint(self, weight, partner):
+        """What a quote depends on: the carrier, the weight and the destination
+
+        :param float weight: Shipping weight
+        :param res.partner partner: Delivery address
+        :return str: Fingerprint of the quote
+        """
+        digits = self.env["decimal.precision"].precision_get("Stock Weight")
+        return "{}|{}|{}|{}".format(
+            self.id,
+            float_repr(float_round(weight or 0.0, precision_digits=digits), digits),
+            partner.country_id.code or "",
+            (partner.zip or "").strip(),
+        )
+
+    def _cttexpress_shipping_prices(self, pickings):
+        """Carrier price of the pickings. The price quoted in the sale order is
+        reused when the picking has the same weight and destination it was
+        quoted for. The rest of the orders are rated at once.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return dict: Price by picking
+        """
+        prices = {}
+        to_rate = pickings.browse()
+        for picking in pickings:
+            order = picking.sale_id
+            fingerprint = self._cttexpress_quote_fingerprint(
+                picking.shipping_weight or picking.weight, picking.partner_id
+            )
+            if order and order.cttexpress_quote_fingerprint == fingerprint:
+                prices[picking] = order.cttexpress_quote_price
+            else:
+                to_rate |= picking
+        orders = to_rate.sale_id
+        matrix = self.rate_shipment_multi(orders)[self.id] if orders else {}
+        no_order_price = None
+        for picking in to_rate:
+            if picking.sale_id:
+                prices[picking] = matrix[picking.sale_id.id] or 0.0
+                continue
+            if no_order_price is None:
+                no_order_price = self.rate_shipment(picking.sale_id).get("price", 0.0)
+            prices[picking] = no_order_price
+        return prices
+
+    def _cttexpress_send_shipping_requests(self, pickings):
+        """Network part of the shippings recording. The shippings and their
+        labels are requested concurrently through a bounded worker pool.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return dict: Responses by picking id. Every response is a dict with the
+            payload (`vals`), the `tracking` code, the `label` content, the
+            `error` and `label_error` (exceptions or lists of error codes) and
+            the SOAP `requests` to be logged.
+        """
+        self.ensure_one()
+        if not pickings:
+            return {}
+        payloads = []
+        for picking in pickings:
+            payload = self._prepare_cttexpress_shipping(picking)
+            self._cttexpress_log_payload(payload, "Shipping of %s", picking.name)
+            payloads.append(payload)
+        if self._cttexpress_use_rest_async():
+            return dict(
+                zip(pickings.ids, self._cttexpress_send_rest_async_requests(payloads))
+            )
+        create_shipping = self._cttexpress_create_shipping_function()
+        get_label = self._cttexpress_get_label_function()
+        deferred_label = self.cttexpress_label_mode == "deferred"
+        label_timeout = self.cttexpress_label_timeout
+
+        def _label_answered(label_response):
+            # An error answer is final too: only a missing label is retried
+            _ctt_request, error, label = label_response
+            return bool(label) or any(code for code, _msg in error or [])
+
+        def _send(vals):
+            response = {
+                "vals": vals,
+                "tracking": False,
+                "label": False,
+                "error": False,
+                "label_error": False,
+                "requests": [],
+            }
+            try:
+                ctt_request, error, tracking = create_shipping(vals)
+            except Exception as e:
+                response["error"] = e
+                if getattr(e, "ctt_request", None):
+                    response["requests"].append(e.ctt_request)
+                return response
+            if ctt_request:
+                response["requests"].append(ctt_request)
+            response.update(tracking=tracking, error=error)
+            if (
+                not tracking
+                or deferred_label
+                or any(code for code, _msg in error or [])
+            ):
+                return response
+            # The label isn't always ready right after recording the shipping
+            try:
+                ctt_request, label_error, label = retry_until(
+                    lambda: get_label(tracking), _label_answered, label_timeout
+                )
+            except Exception as e:
+                response["label_error"] = e
+                if getattr(e, "ctt_request", None):
+                    response["requests"].append(e.ctt_request)
+                return response
+            if ctt_request:
+                response["requests"].append(ctt_request)
+            response.update(label=label, label_error=label_error)
+            return response
+
+        responses = concurrent_map(_send, payloads, self._cttexpress_max_workers())
+        return dict(zip(pickings.ids, responses))
+
+    def _cttexpress_send_rest_async_requests(self, payloads):
+        """`_cttexpress_send_shipping_requests` for REST accounts, with every
+        shipping and label requested from a single asyncio client.
+
+        :param list payloads: Prepared shipping values
+        :return list: Responses in the same order as the payloads
+        """
+        print_format = self._cttexpress_rest_print_format()
+        deferred_label = self.cttexpress_label_mode == "deferred"
+        label_timeout = self.cttexpress_label_timeout
+
+        async def _send(rest_api, vals):
+            response = {
+                "vals": vals,
+                "tracking": False,
+                "label": False,
+                "error": False,
+                "label_error": False,
+                "requests": [],
+            }
+            try:
+                api_result = await rest_api.createShipment(vals)
+            except Exception as e:
+                response["error"] = e
+                return response
+            tracking = api_result.get("shipping_data", {}).get("shipping_code")
+            response.update(tracking=tracking, error=[])
+            if not tracking or deferred_label:
+                return response
+            # The label isn't always ready right after recording the shipping
+            try:
+                api_result = await async_retry_until(
+                    lambda: rest_api.printLabel(tracking, print_format),
+                    rest_label_content,
+                    label_timeout,
+                )
+            except Exception as e:
+                response["label_error"] = e
+                return response
+            response.update(label=rest_label_content(api_result), label_error=[])
+            return response
+
+        responses = self._cttexpress_rest_batch(_send, payloads)
+        return [
+            response
+            if isinstance(response, dict)
+            else {
+                "vals": vals,
+                "tracking": False,
+                "label": False,
+                "error": response,
+                "label_error": False,
+                "requests": [],
+            }
+            for vals, response in zip(payloads, responses)
+        ]
+
+    def _cttexpress_create_shipping_function(self):
+        """Get a function that records a shipping from its prepared values. It
+        doesn't use the ORM, so it can be called from worker threads.
+
+        :return callable: Function that takes the shipping values and returns a
+            tuple with the SOAP request object (or None), the error codes and the
+            shipping code.
+        """
+        self.ensure_one()
+        if self.cttexpress_api == "REST":
+            # Uso de la integración REST
+            rest_api = self._ctt_rest_request()
+
+            def create_shipping(vals):
+                api_result = rest_api.createShipment(vals)
+                tracking = api_result.get("shipping_data", {}).get("shipping_code")
+                return None, [], tracking
+
+            return create_shipping
+        # Uso de la integración SOAP
+        request_params = self._ctt_request_params()
+
+        def create_shipping(vals):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error, _documents, tracking = ctt_request.manifest_shipping(vals)
+            except Exception as e:
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, tracking
+
+        return create_shipping
+
+    def _cttexpress_error_message(self, error):
+        """Get the error message of a failed API call
+
+        :param error: Exception or list of tuples in the form of (code, description)
+        :return str: Error message or False if there's no error
+        """
+        if not error:
+            return False
+        if isinstance(error, Exception):
+            if isinstance(error, UserError):
+                return error.args[0]
+            return str(error) or error.__class__.__name__
+        try:
+            self._ctt_check_error(error)
+        except UserError as e:
+            return e.args[0]
+        return False
+
     def cancel_shipment(self, pickings):
         """Cancela la expedición
 
         :param recordset pickings: pickings `stock.picking` recordset
         :returns boolean: True si la cancelación fue exitosa
         """
-        for picking in pickings.filtered("carrier_tracking_ref"):
-            if self.cttexpress_api == 'REST':
-                rest_api = self._ctt_rest_request()
-                try:
-                    response = rest_api.cancelShipment(picking.carrier_tracking_ref)
-                    _logger.info("Respuesta de cancelShipment (REST): %s", response)
-                    if not response:
-                        # Si la respuesta está vacía, se asume que no hay error.
-                        api_result = {}
-                    else:
-                        api_result = response.json()
-                    _logger.info("Respuesta completa de cancelShipment (REST): %s", json.dumps(api_result, indent=4))
-                    # Si en la respuesta existe un campo error, lo procesamos
-                    error = api_result.get("error")
-                    if error:
-                        self._ctt_check_error(error)
-                except requests.exceptions.JSONDecodeError as e:
-                    _logger.error("Error al decodificar JSON en cancelShipment (REST): %s", e)
-                    raise UserError(_("La respuesta de cancelShipment está vacía o no es JSON válido."))
-            else:
-                # Integración SOAP
-                ctt_request = self._ctt_request()
-                try:
-                    error = ctt_request.cancel_shipping(picking.carrier_tracking_ref)
-                    self._ctt_check_error(error)
-                    _logger.debug("Cancelación en CTT Express ID %s (tracking: %s)", picking.id, picking.carrier_tracking_ref)
-                except Exception as e:
-                    _logger.error("Error en cancel_shipping (SOAP) para picking %s: %s", picking.name, e)
-                    raise e
-                finally:
-                    self._ctt_log_request(ctt_request)
-            # Asegurarse de que el picking esté en estado 'done'
-            if picking.state != 'done':
-                picking.state = 'done'
+        if self.delivery_type != "ctt":
+            return super().cancel_shipment(pickings)
+        self._cttexpress_cancel_pickings(pickings)
         return True
 
+    def _cttexpress_cancel_pickings(self, pickings, values=None):
+        """Cancel the shippings of many pickings. The cancellations are requested
+        concurrently and the pickings whose shipping was cancelled are updated
+        together. The failed ones are left as they were with the error posted.
+
+        :param recordset pickings: `stock.picking` recordset
+        :param dict values: Other values to write on the cancelled pickings
+        :raises UserError: If no shipping could be cancelled
+        :return recordset: The pickings whose shipping was cancelled
+        """
+        cancelled, errors = self._cttexpress_request_cancellations(pickings)
+        if errors and not cancelled:
+            raise UserError(self._cttexpress_cancellation_errors(errors))
+        self._cttexpress_apply_cancellations(cancelled, errors, values)
+        return cancelled
+
+    def _cttexpress_request_cancellations(self, pickings):
+        """Request concurrently the cancellation of the shippings of many
+        pickings. Nothing is written, so the results of many carriers can be
+        gathered before updating any picking.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return tuple: tuple containing:
+            recordset: The pickings whose shipping was cancelled
+            list: Tuples (picking, error message) of the failed ones
+        """
+        self.ensure_one()
+        cancelled = self.env["stock.picking"]
+        errors = []
+        pickings = pickings.filtered("carrier_tracking_ref")
+        if not pickings:
+            return cancelled, errors
+        references = pickings.mapped("carrier_tracking_ref")
+        if self._cttexpress_use_rest_async():
+            responses = [
+                response
+                if isinstance(response, Exception)
+                else (None, rest_cancel_error(response))
+                for response in self._cttexpress_rest_batch(
+                    lambda rest_api, reference: rest_api.cancelShipment(reference),
+                    references,
+                )
+            ]
+        else:
+            responses = concurrent_map(
+                self._cttexpress_cancel_shipping_function(),
+                references,
+                self._cttexpress_max_workers(),
+            )
+        for picking, response in zip(pickings, responses):
+            if isinstance(response, Exception):
+                ctt_request, error = getattr(response, "ctt_request", None), response
+            else:
+                ctt_request, error = response
+            if ctt_request:
+                self._ctt_log_request(ctt_request)
+            error_message = self._cttexpress_error_message(error)
+            if error_message:
+                _logger.warning(
+                    "CTT Express cancellation of %s failed: %s",
+                    picking.name,
+                    error_message,
+                )
+                errors.append((picking, error_message))
+                continue
+            cancelled |= picking
+        return cancelled, errors
+
+    @api.model
+    def _cttexpress_cancellation_errors(self, errors):
+        """Message of the failed cancellations
+
+        :param list errors: Tuples (picking, error message)
+        :return str: One line per picking
+        """
+        return "\n".join(
+            "{}: {}".format(picking.name, message) for picking, message in errors
+        )
+
+    @api.model
+    def _cttexpress_apply_cancellations(self, cancelled, errors, values=None):
+        """Update the pickings once their cancellations have been requested.
+        The cancelled ones are written together and the failed ones get the
+        error posted.
+
+        :param recordset cancelled: The pickings whose shipping was cancelled
+        :param list errors: Tuples (picking, error message) of the failed ones
+        :param dict values: Other values to write on the cancelled pickings
+        """
+        for picking, error_message in errors:
+            picking.message_post(
+                body=_(
+                    "CTT Express shipping %(reference)s couldn't be cancelled: "
+                    "%(error)s",
+                    reference=picking.carrier_tracking_ref,
+                    error=error_message,
+                )
+            )
+        for picking in cancelled:
+            picking.message_post(
+                body=_("Shipment %s cancelled") % picking.carrier_tracking_ref
+            )
+        # Asegurarse de que el picking esté en estado 'done'
+        cancel_values = dict(
+            self._get_canceled_shipment_values(), state="done", **(values or {})
+        )
+        self.env["stock.picking"]._write_tracking_values(
+            {picking: cancel_values for picking in cancelled}
+        )
+
+    def _cttexpress_cancel_shipping_function(self):
+        """Get a function that cancels a shipping by its code. It doesn't use
+        the ORM, so it can be called from worker threads.
+
+        :return callable: Function that takes the shipping code and returns a
+            tuple with the SOAP request object (or None) and the error codes.
+        """
+        self.ensure_one()
+        if self.cttexpress_api == "REST":
+            rest_api = self._ctt_rest_request()
+
+            def cancel_shipping(reference):
+                response = rest_api.cancelShipment(reference)
+                return None, rest_cancel_error(response)
+
+            return cancel_shipping
+        request_params = self._ctt_request_params()
+
+        def cancel_shipping(reference):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error = ctt_request.cancel_shipping(reference)
+            except Exception as e:
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error
+
+        return cancel_shipping
+
     def cttexpress_get_label(self, reference):
         """Genera la etiqueta para un picking usando el API de CTT Express.
 
@@ -472,79 +1346,276 @@ class DeliveryCarrier(models.Model):
         self.ensure_one()
         if not reference:
             return []
+        ctt_request, error, label_content = None, [], False
+        try:
+            ctt_request, error, label_content = self._cttexpress_get_label_function()(
+                reference
+            )
+        except Exception as e:
+            _logger.error("Error al obtener la etiqueta de CTT Express: %s", e)
+            ctt_request = getattr(e, "ctt_request", None)
+            raise e
+        finally:
+            if ctt_request:
+                self._ctt_log_request(ctt_request)
+        self._ctt_check_error(error)
+        return self._cttexpress_format_label(reference, label_content)
 
-        if self.cttexpress_api == 'REST':
-            # Selección del formato de impresión: si cttexpress_document_model_code es "NOSINGLE", se usa document_format;
-            # de lo contrario se usa cttexpress_document_model_code.
-            if self.cttexpress_document_model_code == 'NOSINGLE':
-                print_format = self.cttexpress_document_format
+    def _cttexpress_attach_labels(self, pickings):
+        """Retrieve the labels of the given pickings and attach them in one pass.
+        Those pickings whose label isn't ready yet are kept pending.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return recordset: Pickings whose label was attached, to them or to
+            another picking of the batch
+        """
+        self.ensure_one()
+        pickings = pickings.filtered("carrier_tracking_ref")
+        labels = self.cttexpress_get_labels(pickings.mapped("carrier_tracking_ref"))
+        done_pickings = self.env["stock.picking"]
+        picking_labels = []
+        for picking in pickings:
+            error_message, attachments = labels[picking.carrier_tracking_ref]
+            if error_message:
+                _logger.info(
+                    "CTT Express label for %s not available yet: %s",
+                    picking.name,
+                    error_message,
+                )
+                continue
+            if attachments is None:
+                # Attached to the picking whose document includes its label
+                done_pickings |= picking
+                continue
+            if not attachments:
+                continue
+            picking_labels.append((picking, attachments))
+            done_pickings |= picking
+        self._cttexpress_post_labels(picking_labels)
+        done_pickings.write({"cttexpress_label_pending": False})
+        return done_pickings
+
+    def _cttexpress_post_labels(self, picking_labels, body=None):
+        """Store the labels straight as attachments of their pickings, all of
+        them in a single batch, and post them in the pickings chatter.
+
+        :param list picking_labels: Tuples (picking, labels) where the labels
+            are lists of (file_name, file_content) tuples
+        :param str body: Message body. Defaults to a generic one.
+        :return dict: Attachments by picking
+        """
+        vals_list = []
+        owners = []
+        for picking, labels in picking_labels:
+            for file_name, file_content in labels:
+                vals_list.append(
+                    {
+                        "name": file_name,
+                        "raw": file_content,
+                        "res_model": "stock.picking",
+                        "res_id": picking.id,
+                    }
+                )
+                owners.append(picking)
+        if not vals_list:
+            return {}
+        attachments = self.env["ir.attachment"].create(vals_list)
+        attachments_by_picking = {}
+        for picking, attachment in zip(owners, attachments):
+            attachments_by_picking.setdefault(picking, self.env["ir.attachment"])
+            attachments_by_picking[picking] |= attachment
+        for picking, picking_attachments in attachments_by_picking.items():
+            picking.message_post(
+                body=body or _("CTT Shipping Documents"),
+                attachment_ids=picking_attachments.ids,
+            )
+        return attachments_by_picking
+
+    def cttexpress_get_labels(self, references):
+        """Get the labels of many shipping codes with as few requests as
+        possible. SOAP accounts ask for them in chunks of shipping codes, REST
+        ones one by one. Anyway, the requests run concurrently.
+
+        :param list references: Tracking IDs (shipping references)
+        :return dict: For every reference, a tuple with the error message (or
+            False) and the list of (file_name, file_content) attachments. The
+            list is None when the label is in the attachments of another one.
+        """
+        self.ensure_one()
+        references = list(dict.fromkeys(filter(None, references)))
+        responses = None
+        if self.cttexpress_api == "REST":
+            chunks = [[reference] for reference in references]
+            if self._cttexpress_use_rest_async():
+                print_format = self._cttexpress_rest_print_format()
+                results = self._cttexpress_rest_batch(
+                    lambda rest_api, reference: rest_api.printLabel(
+                        reference, print_format
+                    ),
+                    references,
+                )
+                responses = [
+                    result
+                    if isinstance(result, Exception)
+                    else (None, [], {reference: rest_label_content(result)})
+                    for reference, result in zip(references, results)
+                ]
             else:
-                print_format = self.cttexpress_document_model_code
+                get_label = self._cttexpress_get_label_function()
 
-            rest_api = self._ctt_rest_request()
-            try:
-                api_result = rest_api.printLabel(reference, print_format)
-                if "data" in api_result and api_result["data"]:
-                    # Se extrae el contenido en Base64
-                    label_b64 = api_result["data"][0].get("label", False)
+                def get_labels(chunk):
+                    ctt_request, error, label_content = get_label(chunk[0])
+                    return ctt_request, error, {chunk[0]: label_content}
+
+        else:
+            chunk_size = int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("delivery_cttexpress.label_chunk_size", 50)
+            )
+            chunks = [
+                references[i : i + chunk_size]
+                for i in range(0, len(references), chunk_size)
+            ]
+            get_labels = self._cttexpress_get_labels_function()
+        if responses is None:
+            responses = concurrent_map(
+                get_labels, chunks, self._cttexpress_max_workers()
+            )
+        labels = {}
+        for chunk, response in zip(chunks, responses):
+            ctt_request, error, chunk_labels = self._cttexpress_unpack_response(
+                response
+            )
+            chunk_labels = chunk_labels or {}
+            if ctt_request:
+                self._ctt_log_request(ctt_request)
+            error_message = self._cttexpress_error_message(error)
+            for reference in chunk:
+                if error_message:
+                    labels[reference] = (error_message, [])
+                elif reference in chunk_labels and chunk_labels[reference] is None:
+                    # Su etiqueta va en el documento de otro envío
+                    labels[reference] = (False, None)
                 else:
-                    label_b64 = False
+                    labels[reference] = (
+                        False,
+                        self._cttexpress_format_label(
+                            reference, chunk_labels.get(reference)
+                        ),
+                    )
+        return labels
+
+    def _cttexpress_get_labels_function(self):
+        """Get a function that requests the labels of several shipping codes at
+        once with GetDocumentsV2. It doesn't use the ORM, so it can be called
+        from worker threads.
+
+        :return callable: Function that takes a list of shipping codes and
+            returns a tuple with the SOAP request object, the error codes and a
+            dict with the documents of every shipping code.
+        """
+        self.ensure_one()
+        request_params = self._ctt_request_params()
+        model_code = self.cttexpress_document_model_code
+        kind_code = self.cttexpress_document_format
+
+        def get_labels(references):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error, documents = ctt_request.get_documents_multi(
+                    references, model_code=model_code, kind_code=kind_code
+                )
             except Exception as e:
-                _logger.error("Error en printLabel (REST): %s", e)
-                raise e
-            if label_b64:
-                try:
-                    # Decodificamos la etiqueta de Base64 a bytes
-                    label_content = base64.b64decode(label_b64)
-                except Exception as e:
-                    _logger.error("Error al decodificar la etiqueta REST: %s", e)
-                    raise e
-            else:
-                label_content = False
-        else:
-            # Uso de la integración SOAP (versión actual)
-            ctt_request = self._ctt_request()
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, map_documents(references, documents)
+
+        return get_labels
+
+    def _cttexpress_get_label_function(self):
+        """Get a function that requests the label of a shipping code. It doesn't
+        use the ORM, so it can be called from worker threads.
+
+        :return callable: Function that takes the shipping code and returns a
+            tuple with the SOAP request object (or None), the error codes and the
+            label content.
+        """
+        self.ensure_one()
+        if self.cttexpress_api == 'REST':
+            print_format = self._cttexpress_rest_print_format()
+            rest_api = self._ctt_rest_request()
+
+            def get_label(reference):
+                api_result = rest_api.printLabel(reference, print_format)
+                return None, [], rest_label_content(api_result)
+
+            return get_label
+        # Uso de la integración SOAP
+        request_params = self._ctt_request_params()
+        model_code = self.cttexpress_document_model_code
+        kind_code = self.cttexpress_document_format
+
+        def get_label(reference):
+            ctt_request = CTTExpressRequest(**request_params)
             try:
                 error, label_content = ctt_request.get_documents_multi(
-                    reference,
-                    model_code=self.cttexpress_document_model_code,
-                    kind_code=self.cttexpress_document_format,
+                    reference, model_code=model_code, kind_code=kind_code
                 )
-                self._ctt_check_error(error)
             except Exception as e:
-                _logger.error("Error en get_documents_multi (SOAP): %s", e)
-                raise e
-            finally:
-                self._ctt_log_request(ctt_request)
-        
-        if not label_content:
-            return []
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, label_content
 
-        # En el caso SOAP, label_content puede ser una lista (por ejemplo, una lista de tuplas)
-        # Procesamos la respuesta para asegurarnos de obtener un único adjunto en formato (file_name, bytes)
-        if isinstance(label_content, list):
-            # Tomamos el primer documento (si hay más, podrías adaptarlo según tus necesidades)
-            file_doc = label_content[0]
-            # file_doc debería ser una tupla (file_name, file_data)
-            if isinstance(file_doc, (list, tuple)) and len(file_doc) == 2:
-                file_name, file_data = file_doc
-                # Si file_data no es bytes, intentamos convertirlo
-                if not isinstance(file_data, bytes):
-                    try:
-                        file_data = bytes(file_data)
-                    except Exception as e:
-                        _logger.error("Error al convertir el contenido de la etiqueta SOAP a bytes: %s", e)
-                        raise e
-                label_content = file_data
-                file_name = f"ctt_label_{reference}.{self.cttexpress_document_format.lower()}"
-            else:
-                _logger.error("Formato inesperado en la respuesta SOAP: %s", label_content)
-                return []
-        else:
-            # Si label_content no es una lista, asumimos que ya es el contenido binario
-            file_name = f"ctt_label_{reference}.{self.cttexpress_document_format.lower()}"
+        return get_label
+
+    def _cttexpress_rest_print_format(self):
+        """Formato de impresión de las etiquetas REST: si
+        cttexpress_document_model_code es "NOSINGLE", se usa document_format; de
+        lo contrario se usa cttexpress_document_model_code.
+        """
+        if self.cttexpress_document_model_code == "NOSINGLE":
+            return self.cttexpress_document_format
+        return self.cttexpress_document_model_code
+
+    def _cttexpress_format_label(self, reference, label_content):
+        """Get the label as message attachments
 
-        return [(file_name, label_content)]
+        :param str reference: Tracking ID (shipping reference)
+        :param label_content: Label bytes or list of SOAP documents
+        :return list: Tuplas (file_name, file_content), una por documento
+        """
+        if not label_content:
+            return []
+        extension = self.cttexpress_document_format.lower()
+        # Respuesta REST: el contenido binario de la etiqueta
+        if not isinstance(label_content, list):
+            return [(f"ctt_label_{reference}.{extension}", label_content)]
+        # Respuesta SOAP: una lista de documentos (file_name, file_data). Se
+        # adjuntan todos, p. ej. una etiqueta por bulto.
+        attachments = []
+        for file_doc in label_content:
+            if not isinstance(file_doc, (list, tuple)) or len(file_doc) != 2:
+                _logger.error("Formato inesperado en la respuesta SOAP: %s", file_doc)
+                continue
+            file_data = file_doc[1]
+            if not isinstance(file_data, bytes):
+                try:
+                    file_data = bytes(file_data)
+                except Exception as e:
+                    _logger.error(
+                        "Error al convertir el contenido de la etiqueta SOAP a "
+                        "bytes: %s",
+                        e,
+                    )
+                    raise e
+            suffix = f"_{len(attachments) + 1}" if attachments else ""
+            attachments.append(
+                (f"ctt_label_{reference}{suffix}.{extension}", file_data)
+            )
+        return attachments
 
     def cttexpress_tracking_state_update(self, picking):
         """Wildcard method for CTT Express tracking followup
@@ -554,22 +1625,150 @@ class DeliveryCarrier(models.Model):
         self.ensure_one()
         if not picking.carrier_tracking_ref:
             return
-        ctt_request = self._ctt_request()
+        get_tracking = self._cttexpress_tracking_function()
         try:
-            error, trackings = ctt_request.get_tracking(picking.carrier_tracking_ref)
-            self._ctt_check_error(error)
+            ctt_request, error, trackings = get_tracking(picking.carrier_tracking_ref)
         except Exception as e:
-            raise e
-        finally:
+            if getattr(e, "ctt_request", None):
+                self._ctt_log_request(e.ctt_request)
+            raise
+        if ctt_request:
             self._ctt_log_request(ctt_request)
-        picking.tracking_state_history = "\n".join(
-            [self._cttexpress_format_tracking(tracking) for tracking in trackings]
-        )
-        current_tracking = trackings.pop()
-        picking.tracking_state = self._cttexpress_format_tracking(current_tracking)
-        picking.delivery_state = CTTEXPRESS_DELIVERY_STATES_STATIC.get(
-            current_tracking["StatusCode"], "incidence"
-        )
+        self._ctt_check_error(error)
+        self._cttexpress_apply_trackings([(picking, trackings)])
+
+    # `delivery_state` looks for the methods prefixed with the delivery type
+    def ctt_tracking_state_update(self, picking):
+        return self.cttexpress_tracking_state_update(picking)
+
+    def ctt_tracking_state_update_batch(self, pickings):
+        """Update the tracking state of many pickings. The tracking requests run
+        concurrently and a failing one doesn't stop the rest.
+
+        :param recordset pickings: `stock.picking` recordset
+        :return dict: Error messages by picking id
+        """
+        self.ensure_one()
+        pickings = pickings.filtered("carrier_tracking_ref")
+        references = pickings.mapped("carrier_tracking_ref")
+        if self._cttexpress_use_rest_async():
+            responses = [
+                response
+                if isinstance(response, Exception)
+                else (None, [], rest_trackings(response))
+                for response in self._cttexpress_rest_batch(
+                    lambda rest_api, reference: rest_api.getTracking(reference),
+                    references,
+                )
+            ]
+        else:
+            responses = concurrent_map(
+                self._cttexpress_tracking_function(),
+                references,
+                self._cttexpress_max_workers(),
+            )
+        errors = {}
+        picking_trackings = []
+        for picking, response in zip(pickings, responses):
+            ctt_request, error, trackings = self._cttexpress_unpack_response(response)
+            if ctt_request:
+                self._ctt_log_request(ctt_request)
+            error_message = self._cttexpress_error_message(error)
+            if error_message:
+                _logger.warning(
+                    "CTT Express tracking of %s failed: %s", picking.name, error_message
+                )
+                errors[picking.id] = error_message
+                continue
+            picking_trackings.append((picking, trackings))
+        self._cttexpress_apply_trackings(picking_trackings)
+        return errors
+
+    def _cttexpress_tracking_function(self):
+        """Get a function that gets the tracking history of a shipping by its
+        code. It doesn't use the ORM, so it can be called from worker threads.
+
+        :return callable: Function that takes the shipping code and returns a
+            tuple with the SOAP request object (or None), the error codes and
+            the tracking values.
+        """
+        self.ensure_one()
+        if self.cttexpress_api == "REST":
+            rest_api = self._ctt_rest_request()
+
+            def get_tracking(reference):
+                return None, [], rest_trackings(rest_api.getTracking(reference))
+
+            return get_tracking
+        request_params = self._ctt_request_params()
+
+        def get_tracking(reference):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error, trackings = ctt_request.get_tracking(reference)
+            except Exception as e:
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, trackings
+
+        return get_tracking
+
+    def _cttexpress_apply_trackings(self, picking_trackings):
+        """Store the tracking events gathered from the API and update the
+        pickings whose newest status changed. Pickings with the same new
+        values are written at once.
+
+        :param list picking_trackings: Tuples (picking, trackings) where the
+            trackings are the CTT tracking values, from the oldest to the newest
+        """
+        events_vals = []
+        values = {}
+        for picking, trackings in picking_trackings:
+            if not trackings:
+                continue
+            events_vals += [
+                self._cttexpress_prepare_tracking_event(picking, tracking)
+                for tracking in trackings
+            ]
+            current_tracking = trackings[-1]
+            values[picking] = {
+                "tracking_state": self._cttexpress_format_tracking(current_tracking),
+                "delivery_state": CTTEXPRESS_DELIVERY_STATES_STATIC.get(
+                    current_tracking["StatusCode"], "incident"
+                ),
+            }
+        self.env["stock.picking.tracking.event"].sudo()._create_missing(events_vals)
+        self.env["stock.picking"]._write_tracking_values(values)
+
+    @api.model
+    def _cttexpress_prepare_tracking_event(self, picking, tracking):
+        """Tracking event values
+
+        :param record picking: `stock.picking` record
+        :param OrderedDict tracking: CTT tracking values
+        :return dict: `stock.picking.tracking.event` values
+        """
+        return {
+            "picking_id": picking.id,
+            # Normalized by `_create_missing`
+            "date": tracking["StatusDateTime"],
+            "status_code": tracking["StatusCode"],
+            "description": tracking["StatusDescription"],
+            "incident_code": tracking["IncidentCode"] or False,
+            "incident_description": tracking["IncidentDescription"] or False,
+        }
+
+    @api.model
+    def _cttexpress_unpack_response(self, response):
+        """Unpack a response returned by a worker thread
+
+        :param response: Tuple (ctt_request, error, result) or the exception
+        :return tuple: (ctt_request, error, result)
+        """
+        if isinstance(response, Exception):
+            return getattr(response, "ctt_request", None), response, None
+        return response
 
     def get_tracking_link(self, picking):
         """Wildcard method for CTT Express tracking link.
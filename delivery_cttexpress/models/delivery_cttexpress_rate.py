@@ -0,0 +1,105 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from bisect import bisect_left
+
+from odoo import api, fields, models
+
+from .cttexpress_master_data import CTTEXPRESS_ISLAND_ZIP_PREFIXES
+
+CTTEXPRESS_ZONES = [
+    ("peninsula", "Peninsula"),
+    ("baleares", "Balearic Islands"),
+    ("canarias", "Canary Islands"),
+    ("international", "International"),
+]
+
+
+def get_zone(country_code, zip_code):
+    """Rating zone of a destination
+
+    :param str country_code: Destination country code
+    :param str zip_code: Destination zip code
+    :return str: CTT Express zone
+    """
+    if country_code and country_code != "ES":
+        return "international"
+    return CTTEXPRESS_ISLAND_ZIP_PREFIXES.get((zip_code or "")[:2], "peninsula")
+
+
+def lookup_rate(table, service, zone, zip_code, weight, packages=1):
+    """Price of a shipping in a compiled rate table. Rates for the service are
+    preferred over the generic ones, longer zip prefixes over shorter ones and
+    rates for the zone over the ones for any zone. Within them, the first
+    weight band covering the weight is used.
+
+    :param dict table: Table compiled by `_cttexpress_rate_table`
+    :param str service: CTT Express service code
+    :param str zone: Destination zone (see `get_zone`)
+    :param str zip_code: Destination zip code
+    :param float weight: Shipping weight in kg
+    :param int packages: Number of packages
+    :return float: The price or None if no rate applies
+    """
+    zip_code = zip_code or ""
+    bands = table["bands"]
+    for service_key in (service or "", ""):
+        for prefix_length in table["prefix_lengths"]:
+            if prefix_length > len(zip_code):
+                continue
+            prefix = zip_code[:prefix_length]
+            for zone_key in (zone, ""):
+                band = bands.get((service_key, zone_key, prefix))
+                if not band:
+                    continue
+                weights, prices, extra_prices = band
+                index = bisect_left(weights, weight)
+                if index < len(weights):
+                    return prices[index] + extra_prices[index] * max(packages - 1, 0)
+    return None
+
+
+class DeliveryCttexpressRate(models.Model):
+    _name = "delivery.cttexpress.rate"
+    _description = "CTT Express rate"
+    _order = "carrier_id, service_code, zone, zip_prefix, max_weight"
+
+    carrier_id = fields.Many2one(
+        comodel_name="delivery.carrier",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    service_code = fields.Char(help="Leave it empty to apply it to every service")
+    zone = fields.Selection(
+        selection=CTTEXPRESS_ZONES,
+        help="Leave it empty to apply it to every zone",
+    )
+    zip_prefix = fields.Char(
+        help="Apply it only to the zip codes starting this way. The longest "
+        "matching prefix is used."
+    )
+    max_weight = fields.Float(
+        string="Up to weight (kg)",
+        required=True,
+        digits="Stock Weight",
+    )
+    price = fields.Float(required=True, digits="Product Price")
+    extra_package_price = fields.Float(
+        string="Price per extra package",
+        digits="Product Price",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
@@ -0,0 +1,21 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import fields, models
+
+
+class DeliveryCttexpressServiceType(models.Model):
+    """Services hired by a CTT Express account, as the API's GetServiceTypes
+    returns them. They're refreshed by a scheduled action so the carrier form
+    doesn't have to ask CTT every time."""
+
+    _name = "delivery.cttexpress.service.type"
+    _description = "CTT Express account service"
+    _order = "account_key, code"
+
+    account_key = fields.Char(
+        required=True,
+        index=True,
+        help="Agency, customer, contract and environment of the account",
+    )
+    code = fields.Char(required=True)
+    name = fields.Char()
+    refresh_date = fields.Datetime(required=True)
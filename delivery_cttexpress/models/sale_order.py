@@ -0,0 +1,12 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import fields, models
+
+
+class SaleOrder(models.Model):
+    _inherit = "sale.order"
+
+    cttexpress_quote_fingerprint = fields.Char(
+        copy=False,
+        help="Carrier, weight and destination the CTT Express quote was made for",
+    )
+    cttexpress_quote_price = fields.Float(copy=False, digits="Product Price")
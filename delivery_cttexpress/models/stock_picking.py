@@ -1,13 +1,43 @@
 # Copyright 2022 Tecnativa - David Vidal
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import _, models
 import logging
+import tempfile
+from contextlib import ExitStack
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
 _logger = logging.getLogger(__name__)
 
+# Runs of the pending labels scheduled action after which we give up on a label.
+# Can be changed with the `delivery_cttexpress.label_max_attempts` system parameter.
+CTTEXPRESS_LABEL_MAX_ATTEMPTS = 12
+
 class StockPicking(models.Model):
     _inherit = "stock.picking"
 
+    cttexpress_label_pending = fields.Boolean(
+        string="CTT Express label pending",
+        readonly=True,
+        copy=False,
+        help="The shipping is recorded but its label will be attached later",
+    )
+    cttexpress_label_attempts = fields.Integer(
+        string="CTT Express label attempts",
+        readonly=True,
+        copy=False,
+        help="Times the scheduled action has tried to get the pending label",
+    )
+    cttexpress_shipping_error = fields.Char(
+        string="CTT Express shipping error",
+        readonly=True,
+        copy=False,
+        help="The shipping couldn't be recorded when the picking was validated. "
+        "It can be sent to the shipper again.",
+    )
+
     def cttexpress_get_label(self):
         """Get label for current picking
 
@@ -20,18 +50,235 @@ class StockPicking(models.Model):
         if not self.carrier_id._is_ctt() or not tracking_ref:
             return
         label = self.carrier_id.cttexpress_get_label(tracking_ref)
-        self.message_post(
-            body=_("CTT Express label for %s") % tracking_ref,
-            attachments=label,
+        self.carrier_id._cttexpress_post_labels(
+            [(self, label)], body=_("CTT Express label for %s") % tracking_ref
         )
+        if label and self.cttexpress_label_pending:
+            self.cttexpress_label_pending = False
         return label
-        
+
+    def cancel_shipment(self):
+        """Cancel the CTT Express shippings of every carrier in a single batch
+        instead of one picking after the other. The cancellations of all the
+        carriers are requested before writing anything, so an error can't roll
+        back the pickings of shippings already cancelled at CTT.
+
+        :raises UserError: If no shipping could be cancelled
+        """
+        ctt_ids = self.env["delivery.carrier"]._get_ctt_carrier_ids()
+        ctt_pickings = self.filtered(lambda p: p.carrier_id.id in ctt_ids)
+        res = None
+        if self - ctt_pickings:
+            res = super(StockPicking, self - ctt_pickings).cancel_shipment()
+        cancelled = self.browse()
+        errors = []
+        for carrier, pickings in ctt_pickings.grouped("carrier_id").items():
+            carrier_cancelled, carrier_errors = (
+                carrier._cttexpress_request_cancellations(pickings)
+            )
+            cancelled |= carrier_cancelled
+            errors += carrier_errors
+        Carrier = self.env["delivery.carrier"]
+        # Nada se ha anulado, así que se puede deshacer todo
+        if errors and not cancelled and self == ctt_pickings:
+            raise UserError(Carrier._cttexpress_cancellation_errors(errors))
+        Carrier._cttexpress_apply_cancellations(
+            cancelled, errors, {"carrier_tracking_ref": False}
+        )
+        return res
+
+    def cttexpress_get_labels(self):
+        """Get the labels of all the pickings with as few requests as possible
+        and attach them"""
+        ctt_ids = self.env["delivery.carrier"]._get_ctt_carrier_ids()
+        pickings = self.filtered(
+            lambda p: p.carrier_id.id in ctt_ids and p.carrier_tracking_ref
+        )
+        for carrier in pickings.carrier_id:
+            carrier._cttexpress_attach_labels(
+                pickings.filtered(lambda p: p.carrier_id == carrier)
+            )
+
+    def cttexpress_merge_labels(self):
+        """Merge the current PDF labels of every picking into a single
+        printable file. Every label is read through the attachment API, so any
+        storage works, and spooled to a temporary file before reading the next
+        one, so their contents aren't held in memory together. The merged file
+        is written to a temporary file as well and read once to attach it.
+        The PDF library still loads the pages themselves when writing them.
+
+        :return dict: Action to download the merged labels
+        """
+        attachments = self.env["ir.attachment"].search(
+            [
+                ("res_model", "=", "stock.picking"),
+                ("res_id", "in", self.ids),
+                ("name", "=like", "ctt_label_%.pdf"),
+            ],
+            order="id desc",
+        )
+        attachments_by_picking = {}
+        for attachment in attachments:
+            attachments_by_picking.setdefault(attachment.res_id, []).append(
+                attachment
+            )
+        labels = []
+        for picking in self:
+            labels += picking._cttexpress_current_labels(
+                attachments_by_picking.get(picking.id, [])
+            )
+        if not labels:
+            raise UserError(_("There are no CTT Express PDF labels to merge"))
+        writer = PdfFileWriter()
+        with ExitStack() as stack:
+            for attachment in labels:
+                label_file = stack.enter_context(tempfile.TemporaryFile())
+                label_file.write(attachment.raw)
+                label_file.seek(0)
+                # Que la caché no retenga el contenido de todas las etiquetas
+                attachment.invalidate_recordset(["raw", "datas"])
+                reader = PdfFileReader(label_file, strict=False)
+                for page in range(reader.getNumPages()):
+                    writer.addPage(reader.getPage(page))
+            output = stack.enter_context(tempfile.TemporaryFile())
+            writer.write(output)
+            output.seek(0)
+            merged = self.env["ir.attachment"].create(
+                {
+                    "name": "ctt_labels_{}.pdf".format(
+                        fields.Datetime.now().strftime("%Y%m%d%H%M%S")
+                    ),
+                    "raw": output.read(),
+                    "mimetype": "application/pdf",
+                }
+            )
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/web/content/{}?download=true".format(merged.id),
+            "target": "self",
+        }
+
+    def _cttexpress_current_labels(self, attachments):
+        """Labels of the picking to print: the last copy of every document of
+        its current shipping. Without shipping code, the last label.
+
+        :param list attachments: Label attachments of the picking, newest first
+        :return list: `ir.attachment` records in the document order
+        """
+        self.ensure_one()
+        reference = self.carrier_tracking_ref
+        if not reference:
+            return attachments[:1]
+        labels = {}
+        for attachment in attachments:
+            if attachment.name == f"ctt_label_{reference}.pdf" or (
+                attachment.name.startswith(f"ctt_label_{reference}_")
+            ):
+                labels.setdefault(attachment.name, attachment)
+        return [labels[name] for name in sorted(labels, key=lambda n: (len(n), n))]
+
+    @api.model
+    def _cron_cttexpress_attach_pending_labels(self, limit=500):
+        """Attach the labels that weren't ready when the shippings were
+        recorded, the oldest shippings first. After too many attempts the
+        label is no longer awaited and the picking gets the error posted.
+        """
+        pickings = self.search(
+            [
+                ("cttexpress_label_pending", "=", True),
+                ("carrier_tracking_ref", "!=", False),
+            ],
+            order="date_done, id",
+            limit=limit,
+        )
+        if not pickings:
+            return
+        max_attempts = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(
+                "delivery_cttexpress.label_max_attempts", CTTEXPRESS_LABEL_MAX_ATTEMPTS
+            )
+        )
+        pickings.cttexpress_get_labels()
+        failed = pickings.filtered("cttexpress_label_pending")
+        for attempts, attempts_pickings in failed.grouped(
+            lambda p: p.cttexpress_label_attempts + 1
+        ).items():
+            attempts_pickings.write({"cttexpress_label_attempts": attempts})
+        exhausted = failed.filtered(
+            lambda p: p.cttexpress_label_attempts >= max_attempts
+        )
+        for picking in exhausted:
+            picking.message_post(
+                body=_(
+                    "CTT Express label for %(reference)s couldn't be retrieved "
+                    "after %(attempts)s attempts. Use the CTT Express Label "
+                    "button to get it.",
+                    reference=picking.carrier_tracking_ref,
+                    attempts=picking.cttexpress_label_attempts,
+                )
+            )
+        exhausted.write({"cttexpress_label_pending": False})
+
+    def _send_confirmation_email(self):
+        """The standard flow records the shippings one picking after the other.
+        Request the CTT Express ones of the whole validation concurrently first
+        so `send_shipping` finds them ready.
+
+        A failed shipping mustn't roll back the validation: the other ones
+        already exist at CTT and their tracking references would be lost. The
+        failed pickings get the error in the chatter and in
+        `cttexpress_shipping_error`, and the standard flow skips them, so they
+        can be sent to the shipper again later. A single picking is handled
+        the same way."""
+        ctt_ids = self.env["delivery.carrier"]._get_ctt_carrier_ids()
+        pickings = self.filtered(
+            lambda p: p.carrier_id.id in ctt_ids
+            and p.carrier_id.integration_level == "rate_and_ship"
+            and p.picking_type_code != "incoming"
+            and not p.carrier_tracking_ref
+            and p.picking_type_id.print_label
+        )
+        if not pickings:
+            return super()._send_confirmation_email()
+        responses = {}
+        failed_pickings = self.browse()
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+            carrier_responses = carrier.sudo()._cttexpress_send_shipping_requests(
+                carrier_pickings
+            )
+            for picking in carrier_pickings:
+                response = carrier_responses.pop(picking.id)
+                if carrier.sudo()._cttexpress_check_shipping_response(
+                    picking, response
+                ):
+                    failed_pickings |= picking
+                else:
+                    responses[picking.id] = response
+        return super(
+            StockPicking,
+            self.with_context(
+                cttexpress_shipping_responses=responses,
+                cttexpress_failed_shipping_ids=failed_pickings.ids,
+            ),
+        )._send_confirmation_email()
+
+    def send_to_shipper(self):
+        self.ensure_one()
+        # Su error ya se ha publicado al validar en lote
+        if self.id in (self.env.context.get("cttexpress_failed_shipping_ids") or ()):
+            return
+        return super().send_to_shipper()
+
     def _compute_ask_number_of_packages(self):
+        ctt_ids = self.env["delivery.carrier"]._get_ctt_carrier_ids()
         for picking in self:
             picking.number_of_packages = None
             picking.ask_number_of_packages = None
             if picking.carrier_id:
-                if picking.carrier_id.delivery_type == "ctt":
+                if picking.carrier_id.id in ctt_ids:
                     custom = picking.carrier_id.get_ask_package_number_custom()
                     if custom is not None:
                         picking.ask_number_of_packages = custom
@@ -1,2 +1,6 @@
 # Disabled as the provider's test environment isn't stable enough
 # from . import test_delivery_cttexpress
+from . import test_delivery_cttexpress_offline
+from . import test_cttexpress_transport
+from . import test_cttexpress_rest
+from . import test_cttexpress_tools
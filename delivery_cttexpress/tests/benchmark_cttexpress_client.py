@@ -0,0 +1,103 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Per call latency of the CTT Express SOAP client, with and without the shared
+WSDL cache, against the local stand-in server. It doesn't need Odoo::
+
+    python delivery_cttexpress/tests/benchmark_cttexpress_client.py --calls 50
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+from cttexpress_stub_server import CTTExpressStubServer
+from zeep import Client
+from zeep.plugins import HistoryPlugin
+
+
+def _load_request_module():
+    # Loaded as a submodule of a bare package, so its relative imports work
+    # without running the Odoo models __init__
+    models_path = os.path.join(os.path.dirname(__file__), os.pardir, "models")
+    if "cttexpress_models" not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            "cttexpress_models",
+            os.path.join(models_path, "__init__.py"),
+            submodule_search_locations=[models_path],
+        )
+        sys.modules["cttexpress_models"] = importlib.util.module_from_spec(spec)
+    return importlib.import_module("cttexpress_models.cttexpress_request")
+
+
+def _credentials():
+    return dict(
+        user="000002ODOO1",
+        password="password",
+        agency="000002",
+        customer="ODOO1",
+        contract="1",
+    )
+
+
+def _uncached_call(wsdl_url):
+    """What every call used to do: parse the WSDL with a brand new client"""
+    client = Client(wsdl=wsdl_url, plugins=[HistoryPlugin(maxlen=10)])
+    return client.service.ValidateUser(
+        Id="000002ODOO1",
+        Password="password",
+        ContractCode="1",
+        ClientCode="ODOO1",
+        AgencyCode="000002",
+    )
+
+
+def _measure(function, calls):
+    timings = []
+    for _i in range(calls):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(label, timings):
+    print(
+        "{:<10} mean {:8.2f} ms | median {:8.2f} ms | max {:8.2f} ms".format(
+            label, statistics.mean(timings), statistics.median(timings), max(timings)
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--wsdl-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    server = CTTExpressStubServer(
+        latency=args.latency, wsdl_latency=args.wsdl_latency
+    ).start()
+    try:
+        request_module = _load_request_module()
+        request_module.CTTEXPRESS_API_URL["test"] = server.wsdl_url
+        before = _measure(lambda: _uncached_call(server.wsdl_url), args.calls)
+        downloads = server.wsdl_downloads
+        after = _measure(
+            lambda: request_module.CTTExpressRequest(**_credentials()).validate_user(),
+            args.calls,
+        )
+        print("{} ValidateUser calls per strategy".format(args.calls))
+        _report("before", before)
+        _report("after", after)
+        print(
+            "WSDL downloads: before {} | after {}".format(
+                downloads, server.wsdl_downloads - downloads
+            )
+        )
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Compare the CTT Express REST clients against the local stand-in server: the
+synchronous one on the worker threads pool and the asyncio one fanning out
+from a single thread. Shipments, labels and tracking requests per second::
+
+    python delivery_cttexpress/tests/benchmark_cttexpress_rest_async.py \\
+        --sizes 100,1000 --latency 0.05 --workers 8 --concurrency 100
+
+The REST clients import Odoo and the asyncio one needs aiohttp, so both must be
+importable.
+"""
+import argparse
+import time
+
+from benchmark_cttexpress_throughput import _load_module, _rest_shipping_values
+from cttexpress_stub_server import CTTExpressStubServer
+
+
+def _client_params(server):
+    return dict(
+        url=server.rest_url,
+        client_id="client",
+        client_secret="secret",
+        username="user",
+        password="password",
+        client_code="000002",
+        platform="C24",
+    )
+
+
+def _report(label, size, elapsed, results):
+    errors = sum(isinstance(result, Exception) for result in results)
+    print(
+        "{:<28} {:>8} requests {:>9.2f} s {:>10.1f} /s {:>7} errors".format(
+            label, size, elapsed, size / elapsed, errors
+        )
+    )
+
+
+def _benchmark_sync(size, args, server, rest_module, tools):
+    rest_api = rest_module.CttExpressRestAPI(**_client_params(server))
+    operations = (
+        ("shipments", rest_api.createShipment, "payloads"),
+        ("labels", lambda code: rest_api.printLabel(code, "SINGLE"), "codes"),
+        ("tracking", rest_api.getTracking, "codes"),
+    )
+    items = {"payloads": [_rest_shipping_values(i) for i in range(size)]}
+    for name, function, kind in operations:
+        start = time.perf_counter()
+        results = tools.concurrent_map(function, items[kind], args.workers)
+        _report(
+            "sync  {} workers {}".format(args.workers, name),
+            size,
+            time.perf_counter() - start,
+            results,
+        )
+        if kind == "payloads":
+            items["codes"] = [
+                r["shipping_data"]["shipping_code"]
+                for r in results
+                if not isinstance(r, Exception)
+            ]
+
+
+def _benchmark_async(size, args, server, async_module):
+    operations = (
+        ("shipments", lambda api, vals: api.createShipment(vals), "payloads"),
+        ("labels", lambda api, code: api.printLabel(code, "SINGLE"), "codes"),
+        ("tracking", lambda api, code: api.getTracking(code), "codes"),
+    )
+    items = {"payloads": [_rest_shipping_values(i) for i in range(size)]}
+    for name, function, kind in operations:
+        start = time.perf_counter()
+        results = async_module.run_rest_batch(
+            _client_params(server), function, items[kind], args.concurrency
+        )
+        _report(
+            "async {} in flight {}".format(args.concurrency, name),
+            size,
+            time.perf_counter() - start,
+            results,
+        )
+        if kind == "payloads":
+            items["codes"] = [
+                r["shipping_data"]["shipping_code"]
+                for r in results
+                if not isinstance(r, Exception)
+            ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="100,1000")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    server = CTTExpressStubServer(latency=args.latency).start()
+    try:
+        tools = _load_module("cttexpress_tools")
+        rest_module = _load_module("cttexpress_rest_request")
+        async_module = _load_module("cttexpress_rest_async_request")
+        rest_module.CTTEXPRESS_TOKEN_URL = server.token_url
+        if not async_module.async_available():
+            raise SystemExit("aiohttp isn't installed")
+        print("Latency {:.0f} ms".format(args.latency * 1000))
+        for size in [int(size) for size in args.sizes.split(",")]:
+            _benchmark_sync(size, args, server, rest_module, tools)
+            _benchmark_async(size, args, server, async_module)
+        print("Calls received: {}".format(server.calls))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Throughput of the CTT Express connector against the local stand-in server:
+shipments, labels and tracking updates per second for several batch sizes, using
+the same worker pools, chunks and request objects as the carrier methods. It
+doesn't need Odoo for the SOAP API::
+
+    python delivery_cttexpress/tests/benchmark_cttexpress_throughput.py \\
+        --sizes 1000,10000,100000 --latency 0.05 --error-rate 0.01
+
+With ``--outage-rate`` some calls are answered with HTTP 503, which exercises the
+retries and the circuit breaker of the shared transport.
+
+The REST API client imports Odoo, so it's only measured when Odoo is importable.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+from cttexpress_stub_server import CTTExpressStubServer
+
+MODELS_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "models")
+# The models are loaded as submodules of a bare package, so their relative
+# imports work without running the Odoo models __init__
+MODELS_PACKAGE = "cttexpress_models"
+# Pickings per chunk of the tracking scheduled action (see delivery_state)
+TRACKING_CHUNK_SIZE = 200
+
+
+def _load_module(name):
+    if MODELS_PACKAGE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            MODELS_PACKAGE,
+            os.path.join(MODELS_PATH, "__init__.py"),
+            submodule_search_locations=[MODELS_PATH],
+        )
+        sys.modules[MODELS_PACKAGE] = importlib.util.module_from_spec(spec)
+    return importlib.import_module("{}.{}".format(MODELS_PACKAGE, name))
+
+
+def _credentials():
+    return dict(
+        user="000002ODOO1",
+        password="password",
+        agency="000002",
+        customer="ODOO1",
+        contract="1",
+    )
+
+
+def _shipping_values(index):
+    return {
+        "ClientReference": "S%06d-WH/OUT/%06d" % (index, index),
+        "ItemsCount": 1,
+        "RecipientAddress": "Calle de La Rua, 3",
+        "RecipientCountry": "ES",
+        "RecipientName": "Mr. Odoo & Co.",
+        "RecipientPostalCode": "28001",
+        "RecipientTown": "Madrid",
+        "SenderAddress": "C/ Mayor, 1",
+        "SenderName": "My Spanish WH",
+        "SenderPostalCode": "50001",
+        "SenderTown": "Zaragoza",
+        "ShippingTypeCode": "19H",
+        "Weight": 1000,
+        "CreatedProcessCode": "ODOO",
+    }
+
+
+def _rest_shipping_values(index):
+    return {
+        "client_center_code": "000002",
+        "platform": "ODOO17",
+        "shipping_type_code": "C24",
+        "client_references": ["S%06d-WH/OUT/%06d" % (index, index)],
+        "shipping_weight_declared": 1,
+        "item_count": 1,
+        "recipient_postal_code": "28001",
+    }
+
+
+def _failed(result):
+    if isinstance(result, Exception):
+        return True
+    error = result[0] if isinstance(result, tuple) else result
+    return any(code and code != "0" for code, _msg in error or [])
+
+
+def _run(label, size, function, items, workers, tools):
+    start = time.perf_counter()
+    results = tools.concurrent_map(function, items, workers)
+    elapsed = time.perf_counter() - start
+    errors = sum(_failed(result) for result in results)
+    print(
+        "{:<22} {:>8} pickings {:>9.2f} s {:>10.1f} /s {:>7} errors".format(
+            label, size, elapsed, size / elapsed, errors
+        )
+    )
+    return results
+
+
+def _benchmark_soap(size, args, request_module, tools):
+    def manifest(values):
+        return request_module.CTTExpressRequest(**_credentials()).manifest_shipping(
+            values
+        )
+
+    results = _run(
+        "SOAP shipments",
+        size,
+        manifest,
+        [_shipping_values(i) for i in range(size)],
+        args.workers,
+        tools,
+    )
+    codes = [r[2] for r in results if not isinstance(r, Exception) and r[2]]
+
+    def documents(chunk):
+        return request_module.CTTExpressRequest(**_credentials()).get_documents_multi(
+            chunk
+        )
+
+    chunks = [
+        codes[i : i + args.label_chunk_size]
+        for i in range(0, len(codes), args.label_chunk_size)
+    ]
+    _run("SOAP labels", len(codes), documents, chunks, args.workers, tools)
+
+    def tracking(code):
+        return request_module.CTTExpressRequest(**_credentials()).get_tracking(code)
+
+    # The scheduled action walks the pickings in chunks, each one concurrently
+    start = time.perf_counter()
+    errors = 0
+    for i in range(0, len(codes), TRACKING_CHUNK_SIZE):
+        chunk = codes[i : i + TRACKING_CHUNK_SIZE]
+        errors += sum(
+            _failed(r) for r in tools.concurrent_map(tracking, chunk, args.workers)
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        "{:<22} {:>8} pickings {:>9.2f} s {:>10.1f} /s {:>7} errors".format(
+            "SOAP tracking cron", len(codes), elapsed, len(codes) / elapsed, errors
+        )
+    )
+
+
+def _benchmark_rest(size, args, server, rest_module, tools):
+    rest_module.CTTEXPRESS_TOKEN_URL = server.token_url
+    rest_api = rest_module.CttExpressRestAPI(
+        url=server.rest_url,
+        client_id="client",
+        client_secret="secret",
+        username="user",
+        password="password",
+        client_code="000002",
+        platform="C24",
+    )
+
+    def create(values):
+        result = rest_api.createShipment(values)
+        return result["shipping_data"]["shipping_code"]
+
+    results = _run(
+        "REST shipments",
+        size,
+        create,
+        [_rest_shipping_values(i) for i in range(size)],
+        args.workers,
+        tools,
+    )
+    codes = [r for r in results if not isinstance(r, Exception)]
+    _run(
+        "REST labels",
+        len(codes),
+        lambda code: rest_api.printLabel(code, "SINGLE"),
+        codes,
+        args.workers,
+        tools,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="1000")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--outage-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--label-chunk-size", type=int, default=50)
+    parser.add_argument("--api", choices=("soap", "rest", "both"), default="both")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    server = CTTExpressStubServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        outage_rate=args.outage_rate,
+    ).start()
+    try:
+        tools = _load_module("cttexpress_tools")
+        request_module = _load_module("cttexpress_request")
+        request_module.CTTEXPRESS_API_URL["test"] = server.wsdl_url
+        rest_module = None
+        if args.api in ("rest", "both"):
+            try:
+                rest_module = _load_module("cttexpress_rest_request")
+            except ImportError as e:
+                print("REST API skipped: {}".format(e), file=sys.stderr)
+        print(
+            "Latency {:.0f} ms | error rate {:.1%} | outage rate {:.1%} | "
+            "{} workers".format(
+                args.latency * 1000, args.error_rate, args.outage_rate, args.workers
+            )
+        )
+        for size in sizes:
+            if args.api in ("soap", "both"):
+                _benchmark_soap(size, args, request_module, tools)
+            if rest_module:
+                _benchmark_rest(size, args, server, rest_module, tools)
+        print("Calls received: {}".format(server.calls))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,649 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Local stand-in for the CTT Express APIs.
+
+It serves the ClientsAPI SOAP operations used by `CTTExpressRequest` and the
+REST endpoints used by `CttExpressRestAPI`, so the connector can be measured
+without reaching the carrier servers. Latency, error rate and outage rate (HTTP
+503 answers) are configurable.
+Usage::
+
+    server = CTTExpressStubServer(latency=0.01, error_rate=0.05)
+    server.start()
+    CTTEXPRESS_API_URL["test"] = server.wsdl_url
+    CttExpressRestAPI(server.rest_url, ...)  # with CTTEXPRESS_TOKEN_URL patched
+    ...
+    server.stop()
+
+Or standalone, until interrupted::
+
+    python delivery_cttexpress/tests/cttexpress_stub_server.py --port 8800
+"""
+import argparse
+import base64
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from lxml import etree
+
+NAMESPACE = "http://tempuri.org/"
+SOAP_NAMESPACE = "http://schemas.xmlsoap.org/soap/envelope/"
+
+CREDENTIALS = ("Id", "Password", "ContractCode", "ClientCode", "AgencyCode")
+
+SHIPPING_INPUTS = (
+    ("ClientReference", "xs:string"),
+    ("ClientDepartmentCode", "xs:string"),
+    ("ItemsCount", "xs:int"),
+    ("IsClientPodScanRequired", "xs:boolean"),
+    ("RecipientAddress", "xs:string"),
+    ("RecipientCountry", "xs:string"),
+    ("RecipientEmail", "xs:string"),
+    ("RecipientSMS", "xs:string"),
+    ("RecipientMobile", "xs:string"),
+    ("RecipientName", "xs:string"),
+    ("RecipientPhone", "xs:string"),
+    ("RecipientPostalCode", "xs:string"),
+    ("RecipientTown", "xs:string"),
+    ("RefundValue", "xs:decimal"),
+    ("HasReturn", "xs:boolean"),
+    ("IsSaturdayDelivery", "xs:boolean"),
+    ("SenderAddress", "xs:string"),
+    ("SenderName", "xs:string"),
+    ("SenderPhone", "xs:string"),
+    ("SenderPostalCode", "xs:string"),
+    ("SenderTown", "xs:string"),
+    ("ShippingComments", "xs:string"),
+    ("ShippingTypeCode", "xs:string"),
+    ("Weight", "xs:int"),
+    ("PodScanInstructions", "xs:string"),
+    ("IsFragile", "xs:boolean"),
+    ("RefundTypeCode", "xs:string"),
+    ("CreatedProcessCode", "xs:string"),
+    ("HasControl", "xs:boolean"),
+    ("HasFinalManagement", "xs:boolean"),
+)
+
+# Operation name: (extra input elements as (name, type), result type)
+OPERATIONS = {
+    "ValidateUser": ((), "ArrayOfErrorResult"),
+    "ManifestShipping": (SHIPPING_INPUTS, "ManifestShippingResult"),
+    "GetTracking": ((("ShippingCode", "xs:string"),), "GetTrackingResult"),
+    "GetDocuments": ((("ShippingCode", "xs:string"),), "DocumentsResult"),
+    "GetDocumentsV2": (
+        (
+            ("ShippingCodes", "tns:ArrayOfstring"),
+            ("DocumentCode", "xs:string"),
+            ("ModelCode", "xs:string"),
+            ("KindCode", "xs:string"),
+        ),
+        "DocumentsResult",
+    ),
+    "GetServiceTypes": ((), "GetServiceTypesResult"),
+    "CancelShipping": ((("ShippingCode", "xs:string"),), "ArrayOfErrorResult"),
+    "ReportShipping": (
+        (
+            ("ProcessCode", "xs:string"),
+            ("DocumentKindCode", "xs:string"),
+            ("FromDate", "xs:string"),
+            ("ToDate", "xs:string"),
+        ),
+        "DocumentsResult",
+    ),
+    "CreateRequest": (
+        (
+            ("DeliveryDate", "xs:dateTime"),
+            ("HourMinuteMin1", "xs:string"),
+            ("HourMinuteMax1", "xs:string"),
+        ),
+        "CreateRequestResult",
+    ),
+}
+
+WSDL_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions name="ClientsAPI" targetNamespace="{ns}"
+    xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{ns}">
+  <wsdl:types>
+    <xs:schema elementFormDefault="qualified" targetNamespace="{ns}">
+      <xs:complexType name="ArrayOfstring">
+        <xs:sequence>
+          <xs:element minOccurs="0" maxOccurs="unbounded" name="string"
+              nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ErrorResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCode" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="ErrorMessage" nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ArrayOfErrorResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" maxOccurs="unbounded" name="ErrorResult"
+              nillable="true" type="tns:ErrorResult"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="Document">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="FileName" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="FileContent" nillable="true" type="xs:base64Binary"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ArrayOfDocument">
+        <xs:sequence>
+          <xs:element minOccurs="0" maxOccurs="unbounded" name="Document"
+              nillable="true" type="tns:Document"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="DocumentsResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCodes" nillable="true" type="tns:ArrayOfErrorResult"/>
+          <xs:element minOccurs="0" name="Documents" nillable="true" type="tns:ArrayOfDocument"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ManifestShippingResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCodes" nillable="true" type="tns:ArrayOfErrorResult"/>
+          <xs:element minOccurs="0" name="Documents" nillable="true" type="tns:ArrayOfDocument"/>
+          <xs:element minOccurs="0" name="ShippingCode" nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="Tracking">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="StatusDateTime" type="xs:dateTime"/>
+          <xs:element minOccurs="0" name="StatusCode" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="StatusDescription" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="IncidentCode" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="IncidentDescription" nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ArrayOfTracking">
+        <xs:sequence>
+          <xs:element minOccurs="0" maxOccurs="unbounded" name="Tracking"
+              nillable="true" type="tns:Tracking"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="GetTrackingResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCodes" nillable="true" type="tns:ArrayOfErrorResult"/>
+          <xs:element minOccurs="0" name="Tracking" nillable="true" type="tns:ArrayOfTracking"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ClientShippingType">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ShippingTypeCode" nillable="true" type="xs:string"/>
+          <xs:element minOccurs="0" name="ShippingTypeDescription" nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="ArrayOfClientShippingType">
+        <xs:sequence>
+          <xs:element minOccurs="0" maxOccurs="unbounded" name="ClientShippingType"
+              nillable="true" type="tns:ClientShippingType"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="GetServiceTypesResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCodes" nillable="true" type="tns:ArrayOfErrorResult"/>
+          <xs:element minOccurs="0" name="Services" nillable="true" type="tns:ArrayOfClientShippingType"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="CreateRequestResult">
+        <xs:sequence>
+          <xs:element minOccurs="0" name="ErrorCodes" nillable="true" type="tns:ArrayOfErrorResult"/>
+          <xs:element minOccurs="0" name="RequestShippingCode" nillable="true" type="xs:string"/>
+        </xs:sequence>
+      </xs:complexType>
+{elements}
+    </xs:schema>
+  </wsdl:types>
+{messages}
+  <wsdl:portType name="IClientsAPI">
+{port_operations}
+  </wsdl:portType>
+  <wsdl:binding name="BasicHttpBinding_IClientsAPI" type="tns:IClientsAPI">
+    <soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+{binding_operations}
+  </wsdl:binding>
+  <wsdl:service name="ClientsAPI">
+    <wsdl:port name="BasicHttpBinding_IClientsAPI" binding="tns:BasicHttpBinding_IClientsAPI">
+      <soap:address location="{location}"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+# A minimal valid PDF, returned as every label and report
+LABEL_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 283 425]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+LABEL_B64 = base64.b64encode(LABEL_PDF).decode()
+
+REST_TOKEN_PATH = "/oauth2/token"
+REST_PREFIX = "/integrations"
+REST_ROUTES = (
+    ("POST", re.compile(r"/manifest/v1\.0/shippings$"), "_rest_create_shipment"),
+    (
+        "POST",
+        re.compile(r"/manifest/v1\.0/rpc-cancel-shipping-by-shipping-code/([^/]+)$"),
+        "_rest_cancel_shipment",
+    ),
+    (
+        "GET",
+        re.compile(r"/trf/labelling/v1\.0/shippings/([^/]+)/shipping-labels$"),
+        "_rest_print_label",
+    ),
+    (
+        "GET",
+        re.compile(r"/trf/item-history-api/history/([^/]+)$"),
+        "_rest_get_tracking",
+    ),
+)
+
+
+def _build_wsdl(location):
+    elements, messages, port_operations, binding_operations = [], [], [], []
+    for operation, (inputs, result_type) in OPERATIONS.items():
+        fields = "".join(
+            '<xs:element minOccurs="0" name="%s" nillable="true" type="%s"/>'
+            % (name, field_type)
+            for name, field_type in [(c, "xs:string") for c in CREDENTIALS]
+            + list(inputs)
+        )
+        elements.append(
+            '<xs:element name="{op}"><xs:complexType><xs:sequence>{fields}'
+            "</xs:sequence></xs:complexType></xs:element>"
+            '<xs:element name="{op}Response"><xs:complexType><xs:sequence>'
+            '<xs:element minOccurs="0" name="{op}Result" nillable="true" '
+            'type="tns:{result}"/></xs:sequence></xs:complexType></xs:element>'.format(
+                op=operation, fields=fields, result=result_type
+            )
+        )
+        messages.append(
+            '<wsdl:message name="{op}Request"><wsdl:part name="parameters" '
+            'element="tns:{op}"/></wsdl:message>'
+            '<wsdl:message name="{op}ResponseMessage"><wsdl:part name="parameters" '
+            'element="tns:{op}Response"/></wsdl:message>'.format(op=operation)
+        )
+        port_operations.append(
+            '<wsdl:operation name="{op}"><wsdl:input message="tns:{op}Request"/>'
+            '<wsdl:output message="tns:{op}ResponseMessage"/></wsdl:operation>'.format(
+                op=operation
+            )
+        )
+        binding_operations.append(
+            '<wsdl:operation name="{op}"><soap:operation soapAction="{ns}IClientsAPI/'
+            '{op}" style="document"/><wsdl:input><soap:body use="literal"/>'
+            '</wsdl:input><wsdl:output><soap:body use="literal"/></wsdl:output>'
+            "</wsdl:operation>".format(op=operation, ns=NAMESPACE)
+        )
+    return WSDL_TEMPLATE.format(
+        ns=NAMESPACE,
+        location=location,
+        elements="\n".join(elements),
+        messages="\n".join(messages),
+        port_operations="\n".join(port_operations),
+        binding_operations="\n".join(binding_operations),
+    ).encode()
+
+
+def _error_codes(code="0", message="OK"):
+    return (
+        "<ErrorCodes><ErrorResult><ErrorCode>{}</ErrorCode>"
+        "<ErrorMessage>{}</ErrorMessage></ErrorResult></ErrorCodes>".format(
+            code, message
+        )
+    )
+
+
+def _documents(shipping_codes):
+    return "<Documents>{}</Documents>".format(
+        "".join(
+            "<Document><FileName>{}.pdf</FileName><FileContent>{}</FileContent>"
+            "</Document>".format(code, LABEL_B64)
+            for code in shipping_codes
+        )
+    )
+
+
+def _validate_user_result(server, values):
+    return (
+        "<ErrorResult><ErrorCode>0</ErrorCode>"
+        "<ErrorMessage>Usuario validado</ErrorMessage></ErrorResult>"
+    )
+
+
+def _manifest_shipping_result(server, values):
+    return "<ErrorCodes/><Documents/><ShippingCode>{}</ShippingCode>".format(
+        server.next_shipping_code()
+    )
+
+
+def _get_tracking_result(server, values):
+    return (
+        "<ErrorCodes/><Tracking><Tracking>"
+        "<StatusDateTime>2022-01-01T09:00:00</StatusDateTime>"
+        "<StatusCode>0</StatusCode>"
+        "<StatusDescription>PENDIENTE DE ENTRADA EN RED</StatusDescription>"
+        "<IncidentCode/><IncidentDescription/>"
+        "</Tracking><Tracking>"
+        "<StatusDateTime>2022-01-01T10:00:00</StatusDateTime>"
+        "<StatusCode>1</StatusCode><StatusDescription>EN TRANSITO</StatusDescription>"
+        "<IncidentCode/><IncidentDescription/>"
+        "</Tracking></Tracking>"
+    )
+
+
+def _get_documents_result(server, values):
+    return "<ErrorCodes/>" + _documents([values["ShippingCode"]])
+
+
+def _get_documents_v2_result(server, values):
+    return "<ErrorCodes/>" + _documents(values["ShippingCodes"] or [])
+
+
+def _get_service_types_result(server, values):
+    return (
+        "<ErrorCodes/><Services>"
+        "<ClientShippingType><ShippingTypeCode>19H</ShippingTypeCode>"
+        "<ShippingTypeDescription>24 HORAS</ShippingTypeDescription>"
+        "</ClientShippingType><ClientShippingType>"
+        "<ShippingTypeCode>48H</ShippingTypeCode>"
+        "<ShippingTypeDescription>48 HORAS</ShippingTypeDescription>"
+        "</ClientShippingType></Services>"
+    )
+
+
+def _cancel_shipping_result(server, values):
+    return (
+        "<ErrorResult><ErrorCode>0</ErrorCode>"
+        "<ErrorMessage>Envío anulado</ErrorMessage></ErrorResult>"
+    )
+
+
+def _report_shipping_result(server, values):
+    return "<ErrorCodes/>" + _documents(["manifest"])
+
+
+def _create_request_result(server, values):
+    return "<ErrorCodes/><RequestShippingCode>{}</RequestShippingCode>".format(
+        server.next_shipping_code()
+    )
+
+
+def _soap_error_result(operation):
+    error = _error_codes("1", "Error simulado")
+    if OPERATIONS[operation][1] == "ArrayOfErrorResult":
+        # These operations answer the errors list straight away
+        return error[len("<ErrorCodes>") : -len("</ErrorCodes>")]
+    return error
+
+
+RESULTS = {
+    "ValidateUser": _validate_user_result,
+    "ManifestShipping": _manifest_shipping_result,
+    "GetTracking": _get_tracking_result,
+    "GetDocuments": _get_documents_result,
+    "GetDocumentsV2": _get_documents_v2_result,
+    "GetServiceTypes": _get_service_types_result,
+    "CancelShipping": _cancel_shipping_result,
+    "ReportShipping": _report_shipping_result,
+    "CreateRequest": _create_request_result,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one packet to avoid delayed ACK stalls
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        """Keep the benchmark output clean"""
+
+    def _reply(self, body, content_type="text/xml; charset=utf-8", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, values, status=200):
+        self._reply(json.dumps(values).encode(), "application/json", status)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path.startswith(REST_PREFIX):
+            return self._rest("GET", path)
+        self.server.wsdl_downloads += 1
+        time.sleep(self.server.wsdl_latency)
+        self._reply(self.server.wsdl)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == REST_TOKEN_PATH:
+            return self._rest_token()
+        if path.startswith(REST_PREFIX):
+            return self._rest("POST", path)
+        request = etree.fromstring(self._read_body())
+        body = request.find("{%s}Body" % SOAP_NAMESPACE)[0]
+        operation = etree.QName(body).localname
+        values = {
+            etree.QName(node).localname: (
+                [child.text for child in node] if len(node) else node.text
+            )
+            for node in body
+        }
+        self.server.count(operation)
+        time.sleep(self.server.latency)
+        if self.server.unavailable():
+            return self._reply(b"Service Unavailable", "text/plain", 503)
+        if self.server.fails():
+            result = _soap_error_result(operation)
+        else:
+            result = RESULTS[operation](self.server, values)
+        response = (
+            '<s:Envelope xmlns:s="{soap}"><s:Body><{op}Response xmlns="{ns}">'
+            "<{op}Result>{result}</{op}Result></{op}Response></s:Body></s:Envelope>"
+        ).format(soap=SOAP_NAMESPACE, ns=NAMESPACE, op=operation, result=result)
+        self._reply(response.encode())
+
+    # REST API
+
+    def _rest_token(self):
+        self._read_body()
+        self.server.count("token")
+        time.sleep(self.server.latency)
+        self._reply_json(
+            {
+                "access_token": self.server.token,
+                "expires_in": 3600,
+                "token_type": "Bearer",
+            }
+        )
+
+    def _rest(self, method, path):
+        self._read_body()
+        path = path[len(REST_PREFIX) :]
+        for route_method, pattern, handler in REST_ROUTES:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return self._reply_json({"error": "Not found"}, 404)
+        self.server.count(handler[len("_rest_") :])
+        time.sleep(self.server.latency)
+        if self.headers.get("Authorization") != "Bearer " + self.server.token:
+            return self._reply_json({"error": "Unauthorized"}, 401)
+        if self.server.unavailable():
+            return self._reply_json({"error": "Service Unavailable"}, 503)
+        if self.server.fails():
+            return self._reply_json({"error": "Error simulado"}, 500)
+        getattr(self, handler)(*match.groups())
+
+    def _rest_create_shipment(self):
+        self._reply_json(
+            {"shipping_data": {"shipping_code": self.server.next_shipping_code()}},
+            201,
+        )
+
+    def _rest_cancel_shipment(self, shipping_code):
+        self._reply(b"", "application/json", 201)
+
+    def _rest_print_label(self, shipping_code):
+        self._reply_json({"data": [{"label": LABEL_B64}]})
+
+    def _rest_get_tracking(self, shipping_code):
+        self._reply_json(
+            {
+                "data": {
+                    "shipping_code": shipping_code,
+                    "shipping_history": {
+                        "events": [
+                            {
+                                "code": "0",
+                                "description": "PENDIENTE DE ENTRADA EN RED",
+                                "event_date": "2026-01-01T08:00:00",
+                            },
+                            {
+                                "code": "1",
+                                "description": "EN TRANSITO",
+                                "event_date": "2026-01-01T12:00:00",
+                            },
+                        ]
+                    },
+                }
+            }
+        )
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many clients connect at once, the default backlog (5) would drop them
+    request_queue_size = 1024
+
+    def __init__(self, address, latency, wsdl_latency, error_rate, outage_rate):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.wsdl_latency = wsdl_latency
+        self.error_rate = error_rate
+        self.outage_rate = outage_rate
+        self.wsdl_downloads = 0
+        self.calls = {}
+        self.token = uuid.uuid4().hex
+        self._shipping_codes = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def fails(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def unavailable(self):
+        return self.outage_rate and random.random() < self.outage_rate
+
+    def next_shipping_code(self):
+        with self._lock:
+            return "0000%014d" % next(self._shipping_codes)
+
+
+class CTTExpressStubServer:
+    """Threaded HTTP server answering as the CTT Express SOAP and REST APIs.
+
+    :param float latency: Seconds to wait before answering an operation
+    :param float wsdl_latency: Seconds to wait before serving the WSDL
+    :param float error_rate: Share of the operations answered with an error
+    :param float outage_rate: Share of the operations answered with HTTP 503
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        wsdl_latency=0.0,
+        error_rate=0.0,
+        outage_rate=0.0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.httpd = _StubHTTPServer(
+            (host, port), latency, wsdl_latency, error_rate, outage_rate
+        )
+        self.httpd.wsdl = _build_wsdl(self.url + "/ClientsAPI.svc")
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def wsdl_url(self):
+        return self.url + "/ClientsAPI.svc?singleWsdl"
+
+    @property
+    def rest_url(self):
+        return self.url + REST_PREFIX
+
+    @property
+    def token_url(self):
+        return self.url + REST_TOKEN_PATH
+
+    @property
+    def wsdl_downloads(self):
+        return self.httpd.wsdl_downloads
+
+    @property
+    def calls(self):
+        """Number of calls received by operation"""
+        return dict(self.httpd.calls)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--outage-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = CTTExpressStubServer(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        outage_rate=args.outage_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print("WSDL: {}\nREST: {}".format(server.wsdl_url, server.rest_url))
+    print("Token: {}".format(server.token_url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from datetime import datetime, timezone
+from unittest import skipUnless
+from unittest.mock import patch
+
+from odoo.tests.common import BaseCase
+
+from ..models import cttexpress_transport as transport
+from ..models.cttexpress_rest_async_request import async_available, run_rest_batch
+from ..models.cttexpress_rest_request import CttExpressRestAPI, invalidate_token_cache
+from ..models.delivery_carrier import rest_trackings
+from .cttexpress_stub_server import CTTExpressStubServer
+
+MODELS_MODULE = "odoo.addons.delivery_cttexpress.models"
+
+
+class TestCTTExpressRest(BaseCase):
+    """REST clients against the local stand-in of the CTT Express API"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = CTTExpressStubServer(latency=0)
+        cls.server.start()
+        cls.addClassCleanup(cls.server.stop)
+
+    def setUp(self):
+        super().setUp()
+        transport.reset_transport()
+        self.addCleanup(transport.reset_transport)
+        invalidate_token_cache()
+        self.addCleanup(invalidate_token_cache)
+        token_url_patcher = patch(
+            MODELS_MODULE + ".cttexpress_rest_request.CTTEXPRESS_TOKEN_URL",
+            self.server.token_url,
+        )
+        token_url_patcher.start()
+        self.addCleanup(token_url_patcher.stop)
+        self.client_params = {
+            "url": self.server.rest_url,
+            "client_id": "client",
+            "client_secret": "secret",
+            "username": "user",
+            "password": "password",
+            "client_code": "000002",
+            "platform": "C24",
+        }
+
+    def test_rest_trackings(self):
+        api_result = {
+            "data": {
+                "shipping_code": "0000000000001",
+                "shipping_history": {
+                    "events": [
+                        {
+                            "code": "4",
+                            "description": "INCIDENCIA",
+                            "event_date": "2026-01-02T09:30:00Z",
+                            "incident_code": "12",
+                            "incident_description": "AUSENTE",
+                        },
+                        {
+                            "code": "0",
+                            "description": "PENDIENTE DE ENTRADA EN RED",
+                            "event_date": "2026-01-01T08:00:00Z",
+                        },
+                    ]
+                },
+            }
+        }
+        trackings = rest_trackings(api_result)
+        # From the oldest to the newest, whatever the order they came in
+        self.assertEqual([t["StatusCode"] for t in trackings], ["0", "4"])
+        self.assertEqual(
+            trackings[1]["StatusDateTime"],
+            datetime(2026, 1, 2, 9, 30, tzinfo=timezone.utc),
+        )
+        self.assertEqual(trackings[1]["IncidentCode"], "12")
+        self.assertEqual(trackings[1]["IncidentDescription"], "AUSENTE")
+        self.assertIsNone(trackings[0]["IncidentCode"])
+        self.assertEqual(rest_trackings({"data": {}}), [])
+
+    def test_get_tracking(self):
+        rest_api = CttExpressRestAPI(**self.client_params)
+        trackings = rest_trackings(rest_api.getTracking("0000000000001"))
+        self.assertEqual(
+            [(t["StatusCode"], t["StatusDescription"]) for t in trackings],
+            [("0", "PENDIENTE DE ENTRADA EN RED"), ("1", "EN TRANSITO")],
+        )
+        self.assertEqual(trackings[0]["StatusDateTime"], datetime(2026, 1, 1, 8, 0))
+
+    @skipUnless(async_available(), "aiohttp isn't installed")
+    def test_get_tracking_async(self):
+        references = ["0000000000001", "0000000000002", "0000000000003"]
+        calls = self.server.calls.get("get_tracking", 0)
+        results = run_rest_batch(
+            self.client_params,
+            lambda rest_api, reference: rest_api.getTracking(reference),
+            references,
+            2,
+        )
+        self.assertEqual(
+            [result["data"]["shipping_code"] for result in results], references
+        )
+        self.assertEqual(
+            [t["StatusCode"] for t in rest_trackings(results[0])], ["0", "1"]
+        )
+        self.assertEqual(self.server.calls["get_tracking"] - calls, 3)
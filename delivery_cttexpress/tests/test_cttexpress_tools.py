@@ -0,0 +1,65 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import asyncio
+from unittest.mock import AsyncMock, Mock, patch
+
+from odoo.tests.common import BaseCase
+
+from ..models.cttexpress_tools import async_retry_until, retry_until
+
+MODELS_MODULE = "odoo.addons.delivery_cttexpress.models"
+
+
+class TestCTTExpressTools(BaseCase):
+    """Helpers of the CTT Express clients that don't need the ORM. The
+    retries don't actually wait."""
+
+    def setUp(self):
+        super().setUp()
+        time_patcher = patch(MODELS_MODULE + ".cttexpress_tools.time")
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.time.monotonic.return_value = 1000.0
+
+        def sleep(seconds):
+            self.time.monotonic.return_value += seconds
+
+        self.time.sleep.side_effect = sleep
+        sleep_patcher = patch(
+            MODELS_MODULE + ".cttexpress_tools.asyncio.sleep",
+            new=AsyncMock(side_effect=sleep),
+        )
+        self.async_sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_retry_until(self):
+        # Retried while the answer isn't ready
+        function = Mock(side_effect=[False, False, "label"])
+        self.assertEqual(retry_until(function, bool, timeout=10), "label")
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.time.sleep.call_count, 2)
+        # Until the timeout, then the last answer is returned
+        function = Mock(return_value=False)
+        self.assertIs(retry_until(function, bool, timeout=10), False)
+        self.assertGreater(function.call_count, 3)
+        self.assertGreaterEqual(self.time.monotonic.return_value, 1010.0)
+        # Errors are final
+        function = Mock(side_effect=ValueError("Envío no encontrado"))
+        with self.assertRaises(ValueError):
+            retry_until(function, bool, timeout=10)
+        self.assertEqual(function.call_count, 1)
+
+    def test_async_retry_until(self):
+        function = AsyncMock(side_effect=[False, False, "label"])
+        result = asyncio.run(async_retry_until(function, bool, timeout=10))
+        self.assertEqual(result, "label")
+        self.assertEqual(function.await_count, 3)
+        self.assertEqual(self.async_sleep.await_count, 2)
+        function = AsyncMock(return_value=False)
+        self.assertIs(
+            asyncio.run(async_retry_until(function, bool, timeout=10)), False
+        )
+        self.assertGreater(function.await_count, 3)
+        function = AsyncMock(side_effect=ValueError("Envío no encontrado"))
+        with self.assertRaises(ValueError):
+            asyncio.run(async_retry_until(function, bool, timeout=10))
+        self.assertEqual(function.await_count, 1)
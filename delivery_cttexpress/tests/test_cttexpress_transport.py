@@ -0,0 +1,343 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import Mock, patch
+
+import requests
+from lxml import etree
+
+from odoo.tests.common import BaseCase
+
+from ..models import cttexpress_transport as transport
+from ..models.cttexpress_request import (
+    CTTEXPRESS_LOG_MAX_TEXT,
+    CTTExpressRequest,
+    envelope_to_string,
+    log_request,
+)
+from ..models.cttexpress_rest_request import (
+    CttExpressRestAPI,
+    invalidate_token_cache,
+)
+
+MODELS_MODULE = "odoo.addons.delivery_cttexpress.models"
+
+
+class TestCTTExpressTransport(BaseCase):
+    """Retries and circuit breaker of the CTT Express clients. No request
+    leaves the worker and the backoff doesn't actually wait."""
+
+    def setUp(self):
+        super().setUp()
+        transport.reset_transport()
+        self.addCleanup(transport.reset_transport)
+        time_patcher = patch(MODELS_MODULE + ".cttexpress_transport.time")
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        self.time.monotonic.return_value = 1000.0
+
+    def _soap_request(self):
+        with patch(
+            MODELS_MODULE + ".cttexpress_request.get_cached_wsdl",
+            return_value=(None, None),
+        ), patch(MODELS_MODULE + ".cttexpress_request.Client"):
+            ctt_request = CTTExpressRequest(
+                user="000002ODOO1",
+                password="password",
+                agency="000002",
+                customer="ODOO1",
+                contract="1",
+            )
+        # Don't let the failures of the test open the circuit
+        ctt_request.breaker = transport.CircuitBreaker("test", failure_threshold=10)
+        return ctt_request
+
+    def _rest_api(self):
+        session = Mock()
+        session.post.return_value.status_code = 200
+        session.post.return_value.json.return_value = {
+            "access_token": "token",
+            "expires_in": 3600,
+        }
+        invalidate_token_cache()
+        self.addCleanup(invalidate_token_cache)
+        with patch(
+            MODELS_MODULE + ".cttexpress_rest_request.get_session",
+            return_value=session,
+        ):
+            rest_api = CttExpressRestAPI(
+                url="https://api.test",
+                client_id="client",
+                client_secret="secret",
+                username="user",
+                password="password",
+                client_code="000002",
+                platform="C24",
+            )
+        rest_api.breaker = transport.CircuitBreaker("test", failure_threshold=10)
+        return rest_api
+
+    def test_retry_transient_errors(self):
+        function = Mock(
+            side_effect=[requests.ConnectionError(), requests.Timeout(), 1]
+        )
+        self.assertEqual(transport.call_with_retries(function, retries=3), 1)
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.time.sleep.call_count, 2)
+        # The retries are bounded
+        function = Mock(side_effect=requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            transport.call_with_retries(function, retries=3)
+        self.assertEqual(function.call_count, 4)
+        # Transient results are retried and the last one returned
+        function = Mock(return_value=503)
+        result = transport.call_with_retries(
+            function, retries=2, is_transient_result=lambda r: r == 503
+        )
+        self.assertEqual(result, 503)
+        self.assertEqual(function.call_count, 3)
+
+    def test_no_retry_other_errors(self):
+        function = Mock(side_effect=ValueError())
+        with self.assertRaises(ValueError):
+            transport.call_with_retries(function, retries=3)
+        self.assertEqual(function.call_count, 1)
+        function = Mock(side_effect=requests.ConnectionError())
+        with self.assertRaises(requests.ConnectionError):
+            transport.call_with_retries(function)
+        self.assertEqual(function.call_count, 1)
+
+    def test_soap_shippings_not_retried(self):
+        ctt_request = self._soap_request()
+        service = ctt_request.client.service
+        service.ManifestShipping.side_effect = requests.ConnectionError()
+        service.CancelShipping.side_effect = requests.ConnectionError()
+        service.GetTracking.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            ctt_request.manifest_shipping({"ClientReference": "WH/OUT/00001"})
+        with self.assertRaises(requests.ConnectionError):
+            ctt_request.cancel_shipping("0000000000001")
+        self.assertEqual(service.ManifestShipping.call_count, 1)
+        self.assertEqual(service.CancelShipping.call_count, 1)
+        # Queries are retried
+        with self.assertRaises(requests.ConnectionError):
+            ctt_request.get_tracking("0000000000001")
+        self.assertEqual(service.GetTracking.call_count, 4)
+
+    def test_rest_shippings_not_retried(self):
+        rest_api = self._rest_api()
+        rest_api.session.request.side_effect = requests.ConnectionError()
+        logger = MODELS_MODULE + ".cttexpress_rest_request"
+        with self.assertLogs(logger, "ERROR"), self.assertRaises(
+            requests.ConnectionError
+        ):
+            rest_api.createShipment({})
+        self.assertEqual(rest_api.session.request.call_count, 1)
+        with self.assertLogs(logger, "ERROR"), self.assertRaises(
+            requests.ConnectionError
+        ):
+            rest_api.cancelShipment("0000000000001")
+        self.assertEqual(rest_api.session.request.call_count, 2)
+        # Labels are retried
+        with self.assertLogs(logger, "ERROR"), self.assertRaises(
+            requests.ConnectionError
+        ):
+            rest_api.printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.request.call_count, 6)
+
+    def test_circuit_breaker_opens(self):
+        breaker = transport.CircuitBreaker("test", failure_threshold=2)
+        function = Mock(side_effect=requests.ConnectionError())
+        # The second failure opens the circuit, the third call isn't made
+        with self.assertRaises(transport.CircuitOpenError):
+            transport.call_with_retries(function, retries=3, breaker=breaker)
+        self.assertEqual(function.call_count, 2)
+        self.assertEqual(breaker.state, "open")
+        function = Mock(return_value=1)
+        with self.assertRaises(transport.CircuitOpenError):
+            transport.call_with_retries(function, breaker=breaker)
+        function.assert_not_called()
+        # Other errors mean the API answers: they don't count as failures
+        breaker = transport.CircuitBreaker("test", failure_threshold=2)
+        function = Mock(side_effect=ValueError())
+        for _i in range(3):
+            with self.assertRaises(ValueError):
+                transport.call_with_retries(function, breaker=breaker)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_circuit_breaker_half_open(self):
+        breaker = transport.CircuitBreaker(
+            "test", failure_threshold=1, reset_timeout=30
+        )
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.time.monotonic.return_value += 30
+        self.assertEqual(breaker.state, "half-open")
+        # A single call probes the API
+        breaker.before_call()
+        with self.assertRaises(transport.CircuitOpenError):
+            breaker.before_call()
+        # The probe fails: open for another period
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(transport.CircuitOpenError):
+            breaker.before_call()
+        self.time.monotonic.return_value += 30
+        # The probe works: the circuit is closed again
+        self.assertEqual(transport.call_with_retries(lambda: 1, breaker=breaker), 1)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.failures, 0)
+        breaker.before_call()
+        breaker.before_call()
+
+    def test_rest_token_in_half_open_probe(self):
+        """The token renewed after a 401 is part of the probe call: it doesn't
+        go through the breaker again"""
+        rest_api = self._rest_api()
+        rest_api.breaker = transport.CircuitBreaker(
+            "test", failure_threshold=1, reset_timeout=30
+        )
+        rest_api.breaker.record_failure()
+        self.time.monotonic.return_value += 30
+        self.assertEqual(rest_api.breaker.state, "half-open")
+        rejected, accepted = Mock(status_code=401), Mock(status_code=200)
+        accepted.json.return_value = {"data": []}
+        rest_api.session.request.side_effect = [rejected, accepted]
+        self.assertEqual(rest_api.printLabel("0000000000001", "SINGLE"), {"data": []})
+        self.assertEqual(rest_api.session.post.call_count, 2)
+        self.assertEqual(rest_api.breaker.state, "closed")
+
+    def test_rest_token_loaded_lazily(self):
+        """The client asks for the token with its first request, so a failing
+        token fails every request instead of the client creation"""
+        rest_api = self._rest_api()
+        rest_api.session.post.assert_not_called()
+        rest_api.session.post.side_effect = requests.ConnectionError()
+        logger = MODELS_MODULE + ".cttexpress_rest_request"
+        for _i in range(2):
+            with self.assertLogs(logger, "ERROR"), self.assertRaises(
+                requests.ConnectionError
+            ):
+                rest_api.createShipment({})
+        rest_api.session.request.assert_not_called()
+
+    def _patch_token_time(self):
+        time_patcher = patch(MODELS_MODULE + ".cttexpress_rest_request.time")
+        token_time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+        token_time.monotonic.return_value = 1000.0
+        return token_time
+
+    def _ok_response(self):
+        response = Mock(status_code=200)
+        response.json.return_value = {"data": []}
+        return response
+
+    def test_rest_token_cache(self):
+        """Clients of the same account share the token, but not when the
+        credentials change"""
+        self._patch_token_time()
+        rest_api = self._rest_api()
+        rest_api.session.request.return_value = self._ok_response()
+        rest_api.printLabel("0000000000001", "SINGLE")
+
+        def other_api(**credentials):
+            params = dict(
+                url=rest_api.url,
+                client_id=rest_api.client_id,
+                client_secret=rest_api.client_secret,
+                username=rest_api.username,
+                password=rest_api.password,
+                client_code=rest_api.client_code,
+                platform=rest_api.platform,
+            )
+            api = CttExpressRestAPI(**dict(params, **credentials))
+            api.session = rest_api.session
+            return api
+
+        other_api().printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 1)
+        other_api(client_secret="new secret").printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 2)
+        other_api(password="new password").printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 3)
+        # Writing the credentials of a carrier forgets the tokens of the account
+        invalidate_token_cache("client", "user")
+        other_api().printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 4)
+
+    def test_rest_token_refresh_ahead(self):
+        """The token is renewed a margin before it expires"""
+        token_time = self._patch_token_time()
+        rest_api = self._rest_api()
+        rest_api.session.request.return_value = self._ok_response()
+        rest_api.printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 1)
+        # Valid for 3600 s, renewed 60 s before
+        token_time.monotonic.return_value += 3539
+        rest_api.printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 1)
+        token_time.monotonic.return_value += 1
+        rest_api.printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.post.call_count, 2)
+
+    def test_rest_single_401_retry(self):
+        """A rejected token is renewed and the request repeated only once"""
+        self._patch_token_time()
+        rest_api = self._rest_api()
+        rejected = Mock(status_code=401)
+        rejected.raise_for_status.side_effect = requests.HTTPError(response=rejected)
+        rest_api.session.request.return_value = rejected
+        logger = MODELS_MODULE + ".cttexpress_rest_request"
+        with self.assertLogs(logger, "ERROR"), self.assertRaises(requests.HTTPError):
+            rest_api.printLabel("0000000000001", "SINGLE")
+        self.assertEqual(rest_api.session.request.call_count, 2)
+        self.assertEqual(rest_api.session.post.call_count, 2)
+
+    def _envelope(self, text):
+        envelope = etree.Element("Envelope")
+        etree.SubElement(envelope, "FileContent").text = text
+        return envelope
+
+    def test_soap_envelopes_serialized_lazily(self):
+        """The envelopes are kept as they are and only serialized when the
+        logged request/response are read"""
+        ctt_request = self._soap_request()
+        ctt_request.history = Mock(
+            last_sent={"envelope": self._envelope("request")},
+            last_received={"envelope": self._envelope("response")},
+        )
+        self.assertIs(ctt_request.ctt_last_request, False)
+        with patch(
+            MODELS_MODULE + ".cttexpress_request.envelope_to_string",
+            wraps=envelope_to_string,
+        ) as to_string:
+            self.assertEqual(log_request(lambda request: 1)(ctt_request), 1)
+            to_string.assert_not_called()
+            self.assertIn(
+                b"<FileContent>request</FileContent>", ctt_request.ctt_last_request
+            )
+            self.assertIn(
+                b"<FileContent>response</FileContent>", ctt_request.ctt_last_response
+            )
+        self.assertEqual(to_string.call_count, 2)
+        # Without history the call works anyway
+        ctt_request.history = None
+        self.assertEqual(log_request(lambda request: 2)(ctt_request), 2)
+
+    def test_soap_envelope_truncated(self):
+        """Long texts, like the label documents, are truncated in the logs but
+        not in the envelope itself"""
+        long_text = "A" * (CTTEXPRESS_LOG_MAX_TEXT + 100)
+        envelope = self._envelope(long_text)
+        logged = envelope_to_string(envelope)
+        self.assertIn(
+            "{}... [{} characters truncated]".format(
+                "A" * 64, len(long_text) - 64
+            ).encode(),
+            logged,
+        )
+        self.assertNotIn(long_text.encode(), logged)
+        self.assertEqual(envelope[0].text, long_text)
+        short_text = "A" * CTTEXPRESS_LOG_MAX_TEXT
+        logged = envelope_to_string(self._envelope(short_text))
+        self.assertIn(short_text.encode(), logged)
+        self.assertIs(envelope_to_string(None), False)
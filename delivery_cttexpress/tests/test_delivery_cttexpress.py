@@ -14,7 +14,7 @@ class TestDeliveryCTTExpress(common.TransactionCase):
         cls.carrier_cttexpress = cls.env["delivery.carrier"].create(
             {
                 "name": "CTT Express",
-                "delivery_type": "cttexpress",
+                "delivery_type": "ctt",
                 "product_id": cls.shipping_product.id,
                 "debug_logging": True,
                 "prod_environment": False,
@@ -0,0 +1,800 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import io
+from unittest.mock import Mock, patch
+
+from odoo.exceptions import UserError
+from odoo.tests import Form, common
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
+from ..models.delivery_carrier import map_documents
+from ..models.delivery_cttexpress_rate import get_zone, lookup_rate
+
+CARRIER_MODULE = "odoo.addons.delivery_cttexpress.models.delivery_carrier"
+
+
+class TestDeliveryCTTExpressOffline(common.TransactionCase):
+    """Tests that don't reach CTT Express: the API calls are mocked"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.shipping_product = cls.env["product.product"].create(
+            {"type": "service", "name": "Test Shipping costs", "list_price": 10.0}
+        )
+        cls.carrier = cls.env["delivery.carrier"].create(
+            {
+                "name": "CTT Express",
+                "delivery_type": "ctt",
+                "product_id": cls.shipping_product.id,
+                "prod_environment": False,
+                "cttexpress_api": "SOAP",
+                "cttexpress_user": "000002ODOO1",
+                "cttexpress_password": "password",
+                "cttexpress_agency": "000002",
+                "cttexpress_contract": "1",
+                "cttexpress_customer": "ODOO1",
+                "cttexpress_shipping_type": "19H",
+            }
+        )
+        cls.product = cls.env["product.product"].create(
+            {"type": "consu", "name": "Test product", "weight": 1.0}
+        )
+        cls.partner = cls.env["res.partner"].create(
+            {
+                "name": "Mr. Odoo & Co.",
+                "city": "Madrid",
+                "zip": "28001",
+                "street": "Calle de La Rua, 3",
+                "country_id": cls.env.ref("base.es").id,
+            }
+        )
+
+    def _create_picking(self):
+        order = self.env["sale.order"].create(
+            {
+                "partner_id": self.partner.id,
+                "carrier_id": self.carrier.id,
+                "order_line": [
+                    (0, 0, {"product_id": self.product.id, "product_uom_qty": 1})
+                ],
+            }
+        )
+        order.action_confirm()
+        picking = order.picking_ids
+        picking.picking_type_id.print_label = True
+        return picking
+
+    def _mock_soap_request(self):
+        """Patch the SOAP request objects built by the carrier"""
+        return patch(CARRIER_MODULE + ".CTTExpressRequest")
+
+    def test_log_request(self):
+        """Raw requests are only logged, and so serialized, with debug logging"""
+        # Reading any attribute of the request would fail
+        ctt_request = Mock(spec_set=[])
+        with patch.object(type(self.carrier), "log_xml", autospec=True) as log_xml:
+            self.carrier.debug_logging = False
+            self.carrier._ctt_log_request(ctt_request)
+            log_xml.assert_not_called()
+            self.carrier.debug_logging = True
+            ctt_request = Mock(ctt_last_request=b"<a/>", ctt_last_response=b"<b/>")
+            self.carrier._ctt_log_request(ctt_request)
+        self.assertEqual(
+            [call.args[1:] for call in log_xml.call_args_list],
+            [(b"<a/>", "ctt_request"), (b"<b/>", "ctt_response")],
+        )
+
+    def test_ctt_carrier_ids_cache(self):
+        """The cache is only cleared when the set of CTT carriers changes"""
+        registry_class = type(self.env.registry)
+        with patch.object(
+            registry_class,
+            "clear_cache",
+            autospec=True,
+            side_effect=registry_class.clear_cache,
+        ) as clear_cache:
+            self.carrier.write({"delivery_type": "ctt", "name": "CTT Express 24H"})
+            clear_cache.assert_not_called()
+            self.carrier.delivery_type = "fixed"
+            self.assertEqual(clear_cache.call_count, 1)
+            self.assertNotIn(
+                self.carrier.id, self.env["delivery.carrier"]._get_ctt_carrier_ids()
+            )
+            self.carrier.delivery_type = "ctt"
+            self.assertEqual(clear_cache.call_count, 2)
+            self.assertIn(
+                self.carrier.id, self.env["delivery.carrier"]._get_ctt_carrier_ids()
+            )
+
+    def test_service_types_catalogue(self):
+        """Hired services are kept in the local catalogue and the onchange
+        checks the service against it without calling CTT"""
+        self.assertFalse(self.carrier._cttexpress_service_types())
+        with self._mock_soap_request() as request_class:
+            request_class.return_value.get_service_types.return_value = (
+                [],
+                [("19H", "24 HORAS"), ("48H", "48 HORAS")],
+            )
+            self.carrier.action_ctt_refresh_service_types()
+            self.assertEqual(request_class.return_value.get_service_types.call_count, 1)
+        self.assertEqual(
+            self.carrier._cttexpress_service_types(),
+            {"19H": "24 HORAS", "48H": "48 HORAS"},
+        )
+        # A refresh replaces the services of the account
+        with self._mock_soap_request() as request_class:
+            request_class.return_value.get_service_types.return_value = (
+                [],
+                [("19H", "24 HORAS")],
+            )
+            self.carrier._cttexpress_refresh_service_types()
+        self.assertEqual(self.carrier._cttexpress_service_types(), {"19H": "24 HORAS"})
+        with self._mock_soap_request() as request_class:
+            carrier_form = Form(self.carrier)
+            carrier_form.cttexpress_shipping_type = "19H"
+            with self.assertRaises(UserError):
+                carrier_form.cttexpress_shipping_type = "48H"
+            request_class.assert_not_called()
+
+    def test_service_types_refresh_error(self):
+        """A failing account is reported and its catalogue is kept"""
+        with self._mock_soap_request() as request_class:
+            request_class.return_value.get_service_types.return_value = (
+                [("1", "Credenciales incorrectas")],
+                [],
+            )
+            with self.assertRaises(UserError):
+                self.carrier.action_ctt_refresh_service_types()
+        self.assertFalse(self.carrier._cttexpress_service_types())
+
+    def test_manifest_account_failure(self):
+        """A failing account doesn't throw away the manifests of the others"""
+        other_carrier = self.carrier.copy(
+            {"name": "CTT Express 2", "cttexpress_customer": "ODOO2"}
+        )
+
+        def report_shipping(request_params):
+            def _report_shipping(*args):
+                if request_params["user"] == "wrong":
+                    return [("1", "Credenciales incorrectas")], []
+                return [], [("manifest", b"manifest")]
+
+            ctt_request = Mock()
+            ctt_request.report_shipping.side_effect = _report_shipping
+            return ctt_request
+
+        other_carrier.cttexpress_user = "wrong"
+        wizard = self.env["cttexpress.manifest.wizard"].create(
+            {"carrier_ids": [(6, 0, (self.carrier | other_carrier).ids)]}
+        )
+        with patch(
+            "odoo.addons.delivery_cttexpress.wizards.cttexpress_manifest_wizard"
+            ".CTTExpressRequest",
+            side_effect=lambda **params: report_shipping(params),
+        ):
+            wizard.get_manifest()
+            self.assertEqual(wizard.state, "done")
+            self.assertEqual(len(wizard.attachment_ids), 1)
+            self.assertIn("ODOO1", wizard.attachment_ids.name)
+            self.assertIn("CTT Express 2", wizard.error_message)
+            self.assertIn("Credenciales incorrectas", wizard.error_message)
+            # Nothing to attach when every account fails
+            wizard = self.env["cttexpress.manifest.wizard"].create(
+                {"carrier_ids": [(6, 0, other_carrier.ids)]}
+            )
+            with self.assertRaises(UserError):
+                wizard.get_manifest()
+            self.assertFalse(wizard.attachment_ids)
+
+    def test_prefetched_shipping_failure(self):
+        """A failing picking of a batch validation doesn't roll back the
+        shippings already recorded at CTT: their references are kept and the
+        failed picking gets the error"""
+        good_picking = self._create_picking()
+        bad_picking = self._create_picking()
+        with self._mock_send_shipping_requests(bad_picking) as send_requests:
+            (good_picking | bad_picking)._send_confirmation_email()
+        # Both shippings are requested at once, and only once
+        send_requests.assert_called_once()
+        self.assertEqual(send_requests.call_args.args[1], good_picking | bad_picking)
+        self.assertEqual(good_picking.carrier_tracking_ref, "0000000000001")
+        self.assertFalse(good_picking.cttexpress_shipping_error)
+        self.assertFalse(bad_picking.carrier_tracking_ref)
+        self.assertIn("Error simulado", bad_picking.message_ids[:1].body)
+        self.assertIn("Error simulado", bad_picking.cttexpress_shipping_error)
+        self.assertEqual(
+            self.env["stock.picking"].search(
+                [("cttexpress_shipping_error", "!=", False)]
+            ),
+            bad_picking,
+        )
+
+    def test_single_shipping_failure(self):
+        """A single picking fails like the ones of a batch: the validation goes
+        on and the picking is flagged until its shipping is recorded"""
+        picking = self._create_picking()
+        with self._mock_send_shipping_requests(picking):
+            picking._send_confirmation_email()
+        self.assertFalse(picking.carrier_tracking_ref)
+        self.assertIn("Error simulado", picking.cttexpress_shipping_error)
+        # Sending it again by hand records it and clears the error
+        with self._mock_send_shipping_requests(self.env["stock.picking"]):
+            picking.send_to_shipper()
+        self.assertEqual(picking.carrier_tracking_ref, "0000000000001")
+        self.assertFalse(picking.cttexpress_shipping_error)
+
+    def _mock_send_shipping_requests(self, failed_pickings):
+        """Patch the shipping requests. Those of `failed_pickings` fail."""
+
+        def send_shipping_requests(carrier, pickings):
+            responses = {}
+            for picking in pickings:
+                failed = picking in failed_pickings
+                responses[picking.id] = {
+                    "vals": {},
+                    "tracking": not failed and "0000000000001",
+                    "label": False,
+                    "error": [("1", "Error simulado")] if failed else [],
+                    "label_error": False,
+                    "requests": [],
+                }
+            return responses
+
+        return patch.object(
+            type(self.carrier),
+            "_cttexpress_send_shipping_requests",
+            autospec=True,
+            side_effect=send_shipping_requests,
+        )
+
+    def _create_rates(self):
+        return self.env["delivery.cttexpress.rate"].create(
+            [
+                {"carrier_id": self.carrier.id, "max_weight": 5, "price": 5},
+                {
+                    "carrier_id": self.carrier.id,
+                    "max_weight": 10,
+                    "price": 8,
+                    "extra_package_price": 1,
+                },
+                {
+                    "carrier_id": self.carrier.id,
+                    "zone": "baleares",
+                    "max_weight": 5,
+                    "price": 12,
+                },
+                {
+                    "carrier_id": self.carrier.id,
+                    "zip_prefix": "280",
+                    "max_weight": 5,
+                    "price": 4,
+                },
+                {
+                    "carrier_id": self.carrier.id,
+                    "service_code": "19H",
+                    "zone": "canarias",
+                    "max_weight": 5,
+                    "price": 20,
+                },
+            ]
+        )
+
+    def test_rate_zones(self):
+        self.assertEqual(get_zone("ES", "28001"), "peninsula")
+        self.assertEqual(get_zone("ES", "07001"), "baleares")
+        self.assertEqual(get_zone("ES", "35001"), "canarias")
+        self.assertEqual(get_zone("ES", "38001"), "canarias")
+        self.assertEqual(get_zone(False, "07001"), "baleares")
+        self.assertEqual(get_zone("ES", False), "peninsula")
+        self.assertEqual(get_zone("PT", "07001"), "international")
+
+    def test_rate_lookup(self):
+        self._create_rates()
+        table = self.carrier._cttexpress_rate_table()
+        self.assertEqual(table["prefix_lengths"], (3, 0))
+
+        def rate(zip_code, weight, service="19H", packages=1):
+            zone = get_zone("ES", zip_code)
+            return lookup_rate(table, service, zone, zip_code, weight, packages)
+
+        # The longest zip prefix wins and a band includes its maximum weight
+        self.assertEqual(rate("28001", 5), 4)
+        # Heavier shippings fall back to the next matching rates
+        self.assertEqual(rate("28001", 5.01), 8)
+        self.assertEqual(rate("28001", 5.01, packages=3), 10)
+        self.assertEqual(rate("08001", 0.5), 5)
+        # Zone rates are preferred over the ones for any zone
+        self.assertEqual(rate("07001", 5), 12)
+        self.assertEqual(rate("07001", 6), 8)
+        # Service rates are preferred over the generic ones
+        self.assertEqual(rate("35001", 1), 20)
+        self.assertEqual(rate("38001", 1), 20)
+        self.assertEqual(rate("35001", 1, service="48H"), 5)
+        # Nothing covers the weight
+        self.assertIsNone(rate("28001", 10.5))
+        empty_table = {"bands": {}, "prefix_lengths": (0,)}
+        self.assertIsNone(lookup_rate(empty_table, "19H", "peninsula", "28001", 1))
+
+    def test_rate_shipment(self):
+        rates = self._create_rates()
+        order = self._create_picking().sale_id
+        res = self.carrier.rate_shipment(order)
+        self.assertTrue(res["success"])
+        self.assertEqual(res["price"], 4)
+        res = self.carrier.with_context(order_weight=50).rate_shipment(order)
+        self.assertFalse(res["success"])
+        self.assertEqual(res["price"], 0.0)
+        self.assertIn("28001", res["error_message"])
+        # Editing a rate recompiles the table
+        table = self.carrier._cttexpress_rate_table()
+        rates.filtered("zip_prefix").price = 3
+        self.assertIsNot(self.carrier._cttexpress_rate_table(), table)
+        self.assertEqual(self.carrier.rate_shipment(order)["price"], 3)
+        rates.filtered("zip_prefix").unlink()
+        self.assertEqual(self.carrier.rate_shipment(order)["price"], 5)
+
+    def test_all_shipment_rates(self):
+        """The carrier wizard rates the order with every available carrier,
+        the CTT Express ones with their own rates without calling CTT"""
+        self._create_rates()
+        fixed_carrier = self.env["delivery.carrier"].create(
+            {
+                "name": "Fixed carrier",
+                "delivery_type": "fixed",
+                "fixed_price": 9,
+                "product_id": self.shipping_product.id,
+            }
+        )
+        order = self._create_picking().sale_id
+        wizard = self.env["choose.delivery.carrier"].create(
+            {"order_id": order.id, "carrier_id": self.carrier.id}
+        )
+        carrier_class = type(self.carrier)
+        with patch.object(
+            carrier_class,
+            "_cttexpress_rate_order",
+            autospec=True,
+            side_effect=carrier_class._cttexpress_rate_order,
+        ) as rate_order:
+            rates = wizard._get_all_shipment_rates()
+        self.assertEqual(rates[self.carrier]["price"], 4)
+        self.assertEqual(rates[fixed_carrier]["price"], 9)
+        # The weight of the wizard is passed on, not computed again
+        rate_order.assert_called_once_with(self.carrier, order, wizard.total_weight)
+        self.assertIn("CTT Express: ", wizard.cttexpress_carrier_rates)
+        self.assertIn("Fixed carrier: ", wizard.cttexpress_carrier_rates)
+        # A failing carrier doesn't prevent rating the others
+        with patch.object(
+            carrier_class, "fixed_rate_shipment", side_effect=Exception("Sin tarifa")
+        ):
+            rates = wizard._get_all_shipment_rates()
+        self.assertTrue(rates[self.carrier]["success"])
+        self.assertFalse(rates[fixed_carrier]["success"])
+        self.assertIn("Sin tarifa", rates[fixed_carrier]["error_message"])
+
+    def test_rate_shipment_weight(self):
+        """Rating one order and many of them weigh the order the same way"""
+        self._create_rates()
+        order = self._create_picking().sale_id
+        order.shipping_weight = 7
+        self.assertEqual(self.carrier.rate_shipment(order)["price"], 8)
+        self.assertEqual(
+            self.carrier.rate_shipment_multi(order)[self.carrier.id][order.id], 8
+        )
+
+    def test_quote_reuse(self):
+        """The price quoted in the order is kept while the picking has the
+        weight and destination it was quoted for"""
+        self._create_rates()
+        picking = self._create_picking()
+        order = picking.sale_id
+        wizard = self.env["choose.delivery.carrier"].create(
+            {"order_id": order.id, "carrier_id": self.carrier.id}
+        )
+        wizard.delivery_price = 42
+        wizard.button_confirm()
+        self.assertEqual(order.cttexpress_quote_price, 42)
+        with patch.object(
+            type(self.carrier), "rate_shipment_multi", autospec=True
+        ) as rate_shipment_multi:
+            prices = self.carrier._cttexpress_shipping_prices(picking)
+        rate_shipment_multi.assert_not_called()
+        self.assertEqual(prices, {picking: 42})
+        # Another destination rates the order again
+        self.partner.zip = "07001"
+        prices = self.carrier._cttexpress_shipping_prices(picking)
+        self.assertEqual(prices[picking], 12)
+        self.partner.zip = "28001"
+        prices = self.carrier._cttexpress_shipping_prices(picking)
+        self.assertEqual(prices[picking], 42)
+        # And so does another weight
+        picking.shipping_weight = 7
+        prices = self.carrier._cttexpress_shipping_prices(picking)
+        self.assertEqual(prices[picking], self.carrier.rate_shipment(order)["price"])
+
+    def _mock_cancel_shipping(self, errors):
+        """Patch the cancellation requests. The shippings in `errors` fail with
+        the given error codes, or exception."""
+
+        def cancel_shipping(reference):
+            error = errors.get(reference, [])
+            if isinstance(error, Exception):
+                raise error
+            return None, error
+
+        return patch.object(
+            type(self.carrier),
+            "_cttexpress_cancel_shipping_function",
+            autospec=True,
+            return_value=cancel_shipping,
+        )
+
+    def test_cancel_shipments_partial_failure(self):
+        """The cancelled pickings are written at once and the failed ones keep
+        their shipping with the error posted"""
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings |= self._create_picking()
+        for index, picking in enumerate(pickings, 1):
+            picking.carrier_tracking_ref = "000000000000%s" % index
+        errors = {
+            "0000000000002": [("1", "Envío no anulable")],
+            "0000000000003": Exception("Tiempo de espera agotado"),
+        }
+        picking_class = type(pickings)
+        with self._mock_cancel_shipping(errors), patch.object(
+            picking_class, "write", autospec=True, side_effect=picking_class.write
+        ) as write:
+            pickings.cancel_shipment()
+        cancel_writes = [
+            call.args[0]
+            for call in write.call_args_list
+            if "carrier_tracking_ref" in call.args[1]
+        ]
+        self.assertEqual(cancel_writes, [pickings[0]])
+        self.assertFalse(pickings[0].carrier_tracking_ref)
+        self.assertEqual(pickings[0].delivery_state, "canceled_shipment")
+        self.assertEqual(pickings[1].carrier_tracking_ref, "0000000000002")
+        self.assertIn("Envío no anulable", pickings[1].message_ids[:1].body)
+        self.assertEqual(pickings[2].carrier_tracking_ref, "0000000000003")
+        self.assertIn("Tiempo de espera agotado", pickings[2].message_ids[:1].body)
+
+    def test_cancel_shipments_all_failed(self):
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings[0].carrier_tracking_ref = "0000000000001"
+        pickings[1].carrier_tracking_ref = "0000000000002"
+        errors = {
+            "0000000000001": [("1", "Envío no anulable")],
+            "0000000000002": [("1", "Envío no anulable")],
+        }
+        with self._mock_cancel_shipping(errors), self.assertRaises(UserError):
+            pickings.cancel_shipment()
+        self.assertEqual(
+            pickings.mapped("carrier_tracking_ref"), ["0000000000001", "0000000000002"]
+        )
+
+    def test_cancel_shipments_many_carriers(self):
+        """A carrier whose cancellations all fail doesn't undo the pickings of
+        the shippings already cancelled with the other carriers"""
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings |= self._create_picking()
+        for index, picking in enumerate(pickings, 1):
+            picking.carrier_tracking_ref = "000000000000%s" % index
+        pickings[2].carrier_id = self.carrier.copy({"name": "CTT Express 2"})
+        errors = {"0000000000003": [("1", "Envío no anulable")]}
+        picking_class = type(pickings)
+        with self._mock_cancel_shipping(errors), patch.object(
+            picking_class, "write", autospec=True, side_effect=picking_class.write
+        ) as write:
+            pickings.cancel_shipment()
+        cancel_writes = [
+            call.args[0]
+            for call in write.call_args_list
+            if "carrier_tracking_ref" in call.args[1]
+        ]
+        self.assertEqual(cancel_writes, [pickings[:2]])
+        self.assertEqual(pickings[:2].mapped("carrier_tracking_ref"), [False, False])
+        self.assertEqual(pickings[2].carrier_tracking_ref, "0000000000003")
+        self.assertIn("Envío no anulable", pickings[2].message_ids[:1].body)
+
+    def test_rest_tracking_batch(self):
+        """REST accounts get the tracking history from the REST API, and a
+        failing shipping doesn't stop the others"""
+        self.carrier.cttexpress_api = "REST"
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings[0].carrier_tracking_ref = "0000000000001"
+        pickings[1].carrier_tracking_ref = "0000000000002"
+        api_result = {
+            "data": {
+                "shipping_code": "0000000000001",
+                "shipping_history": {
+                    "events": [
+                        {
+                            "code": "1",
+                            "description": "EN TRANSITO",
+                            "event_date": "2026-01-01T13:00:00+01:00",
+                        },
+                        {
+                            "code": "0",
+                            "description": "PENDIENTE DE ENTRADA EN RED",
+                            "event_date": "2026-01-01T08:00:00",
+                        },
+                    ]
+                },
+            }
+        }
+        carrier_class = type(self.carrier)
+        with patch.object(
+            carrier_class, "_cttexpress_use_rest_async", return_value=True
+        ), patch.object(
+            carrier_class,
+            "_cttexpress_rest_batch",
+            autospec=True,
+            return_value=[api_result, Exception("Error simulado")],
+        ) as rest_batch:
+            errors = self.carrier.ctt_tracking_state_update_batch(pickings)
+        rest_batch.assert_called_once()
+        self.assertEqual(
+            rest_batch.call_args.args[2], pickings.mapped("carrier_tracking_ref")
+        )
+        self.assertEqual(errors, {pickings[1].id: "Error simulado"})
+        self.assertEqual(pickings[0].delivery_state, "in_transit")
+        # The state keeps the status date, in UTC like the events
+        self.assertEqual(
+            pickings[0].tracking_state, "2026-01-01 12:00:00 - [1] EN TRANSITO"
+        )
+        self.assertEqual(len(pickings[0].tracking_event_ids), 2)
+        self.assertFalse(pickings[1].tracking_state)
+
+    def test_map_documents(self):
+        references = ["0000000000001", "0000000000002"]
+        # The file names tell the shipping code, whatever the order
+        documents = [
+            ("label_0000000000002.pdf", b"2"),
+            ("label_0000000000001.pdf", b"1"),
+            ("label_0000000000001_2.pdf", b"1b"),
+        ]
+        self.assertEqual(
+            map_documents(references, documents),
+            {
+                "0000000000001": [documents[1], documents[2]],
+                "0000000000002": [documents[0]],
+            },
+        )
+        # A document for every code, in the order they were requested
+        documents = [("label.pdf", b"1"), ("label.pdf", b"2")]
+        self.assertEqual(
+            map_documents(references, documents),
+            {"0000000000001": [documents[0]], "0000000000002": [documents[1]]},
+        )
+        # A combined document goes to the first code only
+        documents = [("labels.pdf", b"12")]
+        with self.assertLogs(CARRIER_MODULE, "INFO"):
+            self.assertEqual(
+                map_documents(references, documents),
+                {"0000000000001": documents, "0000000000002": None},
+            )
+        # So do the documents whose count doesn't match the codes
+        references.append("0000000000003")
+        documents = [("label_0000000000001.pdf", b"1"), ("labels.pdf", b"23")]
+        with self.assertLogs(CARRIER_MODULE, "INFO"):
+            self.assertEqual(
+                map_documents(references, documents),
+                {
+                    "0000000000001": documents,
+                    "0000000000002": None,
+                    "0000000000003": None,
+                },
+            )
+
+    def test_format_label_documents(self):
+        """Every document of a shipping is kept"""
+        self.assertEqual(
+            self.carrier._cttexpress_format_label(
+                "0000000000001", [("a.pdf", b"1"), ("b.pdf", bytearray(b"2"))]
+            ),
+            [
+                ("ctt_label_0000000000001.pdf", b"1"),
+                ("ctt_label_0000000000001_2.pdf", b"2"),
+            ],
+        )
+        self.assertEqual(
+            self.carrier._cttexpress_format_label("0000000000001", b"1"),
+            [("ctt_label_0000000000001.pdf", b"1")],
+        )
+        self.assertFalse(self.carrier._cttexpress_format_label("0000000000001", []))
+
+    def test_attach_combined_labels(self):
+        """A combined document is attached once and no picking stays pending"""
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings[0].carrier_tracking_ref = "0000000000001"
+        pickings[1].carrier_tracking_ref = "0000000000002"
+        pickings.cttexpress_label_pending = True
+
+        def get_labels(references):
+            return None, [], map_documents(references, [("labels.pdf", b"%PDF")])
+
+        with patch.object(
+            type(self.carrier),
+            "_cttexpress_get_labels_function",
+            autospec=True,
+            return_value=get_labels,
+        ), self.assertLogs(CARRIER_MODULE, "INFO"):
+            done = self.carrier._cttexpress_attach_labels(pickings)
+        self.assertEqual(done, pickings)
+        self.assertFalse(any(pickings.mapped("cttexpress_label_pending")))
+        attachments = self.env["ir.attachment"].search(
+            [("res_model", "=", "stock.picking"), ("res_id", "in", pickings.ids)]
+        )
+        self.assertEqual(attachments.mapped("res_id"), [pickings[0].id])
+        self.assertEqual(attachments.name, "ctt_label_0000000000001.pdf")
+
+    def _pdf(self, pages=1):
+        writer = PdfFileWriter()
+        for _i in range(pages):
+            writer.addBlankPage(72, 72)
+        output = io.BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def test_post_labels(self):
+        """The labels of all the pickings are created in a single batch and
+        every picking gets its own ones posted"""
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        attachment_class = type(self.env["ir.attachment"])
+        with patch.object(
+            attachment_class,
+            "create",
+            autospec=True,
+            side_effect=attachment_class.create,
+        ) as create:
+            attachments = self.carrier._cttexpress_post_labels(
+                [
+                    (
+                        pickings[0],
+                        [("ctt_label_1.pdf", b"1"), ("ctt_label_1_2.pdf", b"2")],
+                    ),
+                    (pickings[1], [("ctt_label_2.pdf", b"3")]),
+                ]
+            )
+        create.assert_called_once()
+        self.assertEqual(
+            attachments[pickings[0]].mapped("name"),
+            ["ctt_label_1.pdf", "ctt_label_1_2.pdf"],
+        )
+        self.assertEqual(attachments[pickings[1]].raw, b"3")
+        self.assertEqual(attachments[pickings[1]].res_id, pickings[1].id)
+        self.assertEqual(
+            pickings[0].message_ids[:1].attachment_ids, attachments[pickings[0]]
+        )
+        self.assertEqual(self.carrier._cttexpress_post_labels([]), {})
+
+    def test_merge_labels(self):
+        """The current labels of every picking are merged in the pickings order"""
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        pickings[0].carrier_tracking_ref = "0000000000001"
+        with self.assertRaises(UserError):
+            pickings.cttexpress_merge_labels()
+        self.carrier._cttexpress_post_labels(
+            [
+                # A label of a former shipping and an outdated copy aren't merged
+                (pickings[0], [("ctt_label_0000000000009.pdf", self._pdf(5))]),
+                (pickings[0], [("ctt_label_0000000000001.pdf", self._pdf(5))]),
+                (pickings[1], [("ctt_label_0000000000002.pdf", self._pdf(1))]),
+                (
+                    pickings[0],
+                    [
+                        ("ctt_label_0000000000001.pdf", self._pdf(1)),
+                        ("ctt_label_0000000000001_2.pdf", self._pdf(2)),
+                    ],
+                ),
+            ]
+        )
+        action = pickings.cttexpress_merge_labels()
+        merged = self.env["ir.attachment"].browse(
+            int(action["url"].split("/")[-1].split("?")[0])
+        )
+        self.assertEqual(merged.mimetype, "application/pdf")
+        reader = PdfFileReader(io.BytesIO(merged.raw), strict=False)
+        # 1 + 2 pages of the first picking. Without a shipping code, the last
+        # label of the second one.
+        self.assertEqual(reader.getNumPages(), 4)
+
+    def test_deferred_labels(self):
+        """With deferred labels the shippings are recorded without waiting for
+        them and the scheduled action attaches them later, the oldest first"""
+        self.carrier.cttexpress_label_mode = "deferred"
+        # One shipping after the other, so they get the codes in order
+        self.env["ir.config_parameter"].sudo().set_param(
+            "delivery_cttexpress.max_workers", 1
+        )
+        pickings = self._create_picking()
+        pickings |= self._create_picking()
+        codes = iter(["0000000000001", "0000000000002"])
+
+        def create_shipping(vals):
+            return None, [], next(codes)
+
+        carrier_class = type(self.carrier)
+        with patch.object(
+            carrier_class,
+            "_cttexpress_create_shipping_function",
+            autospec=True,
+            return_value=create_shipping,
+        ), patch.object(
+            carrier_class, "_cttexpress_get_label_function", autospec=True
+        ) as get_label_function:
+            self.carrier.send_shipping(pickings)
+        get_label_function.return_value.assert_not_called()
+        self.assertEqual(
+            pickings.mapped("carrier_tracking_ref"), ["0000000000001", "0000000000002"]
+        )
+        self.assertTrue(all(pickings.mapped("cttexpress_label_pending")))
+        pickings[0].date_done = "2026-01-02 10:00:00"
+        pickings[1].date_done = "2026-01-01 10:00:00"
+
+        def get_labels(references):
+            return None, [], {reference: [] for reference in references}
+
+        with patch.object(
+            carrier_class,
+            "_cttexpress_get_labels_function",
+            autospec=True,
+            return_value=get_labels,
+        ):
+            self.env["stock.picking"]._cron_cttexpress_attach_pending_labels(limit=1)
+        # The oldest shipping is tried first
+        self.assertEqual(pickings.mapped("cttexpress_label_attempts"), [0, 1])
+        self.assertTrue(all(pickings.mapped("cttexpress_label_pending")))
+
+        def get_labels(references):
+            return None, [], {ref: [("label.pdf", b"%PDF")] for ref in references}
+
+        with patch.object(
+            carrier_class,
+            "_cttexpress_get_labels_function",
+            autospec=True,
+            return_value=get_labels,
+        ):
+            self.env["stock.picking"]._cron_cttexpress_attach_pending_labels()
+        self.assertFalse(any(pickings.mapped("cttexpress_label_pending")))
+        self.assertEqual(
+            pickings[0].message_ids[:1].attachment_ids.name,
+            "ctt_label_0000000000001.pdf",
+        )
+
+    def test_pending_labels_give_up(self):
+        """Labels that never get ready are given up with the error posted"""
+        picking = self._create_picking()
+        picking.write(
+            {
+                "carrier_tracking_ref": "0000000000001",
+                "cttexpress_label_pending": True,
+            }
+        )
+        self.env["ir.config_parameter"].sudo().set_param(
+            "delivery_cttexpress.label_max_attempts", 2
+        )
+
+        def get_labels(references):
+            return None, [], {reference: [] for reference in references}
+
+        with patch.object(
+            type(self.carrier),
+            "_cttexpress_get_labels_function",
+            autospec=True,
+            return_value=get_labels,
+        ):
+            self.env["stock.picking"]._cron_cttexpress_attach_pending_labels()
+            self.assertTrue(picking.cttexpress_label_pending)
+            self.env["stock.picking"]._cron_cttexpress_attach_pending_labels()
+        self.assertFalse(picking.cttexpress_label_pending)
+        self.assertEqual(picking.cttexpress_label_attempts, 2)
+        self.assertIn("2 attempts", picking.message_ids[:1].body)
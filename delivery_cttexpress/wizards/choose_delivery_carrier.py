@@ -1,11 +1,38 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models, api, _
-from odoo.exceptions import ValidationError
-from odoo.tools.json import scriptsafe as json_safe
+from odoo import api, fields, models
+from odoo.tools.misc import format_amount
 
 class ChooseCttDeliveryCarrier(models.TransientModel):
     _inherit = 'choose.delivery.carrier'
 
+    cttexpress_carrier_rates = fields.Text(
+        string="Tarifas de los transportistas",
+        compute="_compute_cttexpress_carrier_rates",
+        help="Precio del envío con cada transportista disponible",
+    )
+
+    @api.depends("order_id", "available_carrier_ids", "total_weight")
+    def _compute_cttexpress_carrier_rates(self):
+        for wizard in self:
+            if not wizard.order_id:
+                wizard.cttexpress_carrier_rates = False
+                continue
+            currency = wizard.order_id.currency_id
+            lines = []
+            for carrier, vals in wizard._get_all_shipment_rates().items():
+                if vals.get("success"):
+                    lines.append(
+                        "{}: {}".format(
+                            carrier.name,
+                            format_amount(wizard.env, vals["price"], currency),
+                        )
+                    )
+                else:
+                    lines.append(
+                        "{}: {}".format(carrier.name, vals.get("error_message"))
+                    )
+            wizard.cttexpress_carrier_rates = "\n".join(lines)
+
     def _get_shipment_rate(self):
         # Aquí puedes personalizar la lógica o capturar el error y manejarlo
         try:
@@ -19,4 +46,51 @@ class ChooseCttDeliveryCarrier(models.TransientModel):
         except Exception as e:
             # Manejo del error personalizado
             return {'error_message': f"Ocurrió un error: {str(e)}"}
-        
+
+    def button_confirm(self):
+        res = super().button_confirm()
+        if self.carrier_id.delivery_type == "ctt":
+            # Se guarda la cotización para reutilizarla al enviar si no cambia
+            self.order_id.write(
+                {
+                    "cttexpress_quote_fingerprint": (
+                        self.carrier_id._cttexpress_quote_fingerprint(
+                            self.total_weight, self.order_id.partner_shipping_id
+                        )
+                    ),
+                    "cttexpress_quote_price": self.delivery_price,
+                }
+            )
+        return res
+
+    def _get_all_shipment_rates(self):
+        """Rate the order with every available carrier at once. The order
+        weight is computed once for all of them and CTT Express carriers with
+        their own rates are looked up in their compiled tables.
+
+        :return dict: Rating result by carrier
+        """
+        self.ensure_one()
+        weight = self.total_weight
+        rates = {}
+        for carrier in self.available_carrier_ids:
+            try:
+                if (
+                    carrier.delivery_type == "ctt"
+                    and carrier._cttexpress_rate_table()["bands"]
+                ):
+                    rates[carrier] = carrier._cttexpress_rate_order(
+                        self.order_id, weight
+                    )
+                else:
+                    rates[carrier] = carrier.with_context(
+                        order_weight=weight
+                    ).rate_shipment(self.order_id)
+            except Exception as e:
+                rates[carrier] = {
+                    "success": False,
+                    "price": 0.0,
+                    "error_message": f"Ocurrió un error: {str(e)}",
+                    "warning_message": False,
+                }
+        return rates
@@ -1,8 +1,10 @@
 # Copyright 2022 Tecnativa - David Vidal
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-import base64
+from odoo import fields, models
+from odoo.exceptions import UserError
 
-from odoo import fields, models, _
+from ..models.cttexpress_request import CTTExpressRequest
+from ..models.cttexpress_tools import concurrent_map
 
 
 class CTTExpressManifestWizard(models.TransientModel):
@@ -31,37 +33,69 @@ class CTTExpressManifestWizard(models.TransientModel):
     attachment_ids = fields.Many2many(
         comodel_name="ir.attachment", readonly=True, string="Manifests"
     )
+    error_message = fields.Text(
+        string="Failed accounts",
+        readonly=True,
+        help="Accounts whose manifest couldn't be obtained",
+    )
 
     def get_manifest(self):
-        """List of shippings for the given dates as CTT provides them"""
+        """List of shippings for the given dates as CTT provides them. Every
+        account is requested concurrently. The manifests obtained are attached
+        even if other accounts fail, whose errors are shown in the wizard.
+
+        :raises UserError: If no account manifest could be obtained
+        """
         # Se obtienen los carriers filtrados por is_ctt
         carriers = self.carrier_ids or self.env["delivery.carrier"].search(
             [("is_ctt", "=", True)]
         )
         # Evitar obtener manifiestos repetidos. Los carriers con distinta configuración
         # de servicio podrían producir el mismo manifiesto.
-        unique_accounts = {
-            (c.cttexpress_customer, c.cttexpress_contract, c.cttexpress_agency)
-            for c in carriers
-        }
-        filtered_carriers = self.env["delivery.carrier"]
-        for customer, contract, agency in unique_accounts:
-            filtered_carriers += fields.first(
-                carriers.filtered(
-                    lambda x: x.cttexpress_customer == customer
-                    and x.cttexpress_contract == contract
-                    and x.cttexpress_agency == agency
-                )
+        account_carriers = {}
+        for carrier in carriers:
+            account_carriers.setdefault(
+                (
+                    carrier.cttexpress_customer,
+                    carrier.cttexpress_contract,
+                    carrier.cttexpress_agency,
+                ),
+                carrier,
             )
-        for carrier in filtered_carriers:
-            ctt_request = carrier._ctt_request()
-            from_date_str = fields.Date.to_string(self.from_date)
-            to_date_str = fields.Date.to_string(self.to_date)
-            error, manifest = ctt_request.report_shipping(
-                "ODOO", self.document_type, from_date_str, to_date_str
+        filtered_carriers = list(account_carriers.values())
+        from_date_str = fields.Date.to_string(self.from_date)
+        to_date_str = fields.Date.to_string(self.to_date)
+        document_type = self.document_type
+
+        def report_shipping(request_params):
+            ctt_request = CTTExpressRequest(**request_params)
+            try:
+                error, manifest = ctt_request.report_shipping(
+                    "ODOO", document_type, from_date_str, to_date_str
+                )
+            except Exception as e:
+                # Keep the request so it can be logged anyway
+                e.ctt_request = ctt_request
+                raise
+            return ctt_request, error, manifest
+
+        responses = concurrent_map(
+            report_shipping,
+            [carrier._ctt_request_params() for carrier in filtered_carriers],
+            self.env["delivery.carrier"]._cttexpress_max_workers(),
+        )
+        errors = []
+        vals_list = []
+        for carrier, response in zip(filtered_carriers, responses):
+            ctt_request, error, manifest = carrier._cttexpress_unpack_response(
+                response
             )
-            carrier._ctt_check_error(error)
-            carrier._ctt_log_request(ctt_request)
+            if ctt_request:
+                carrier._ctt_log_request(ctt_request)
+            error_msg = carrier._cttexpress_error_message(error)
+            if error_msg:
+                errors.append("{}: {}".format(carrier.name, error_msg))
+                continue
             for _filename, file in manifest:
                 filename = "{}{}{}-{}-{}.{}".format(
                     carrier.cttexpress_customer,
@@ -69,17 +103,21 @@ class CTTExpressManifestWizard(models.TransientModel):
                     carrier.cttexpress_agency,
                     from_date_str.replace("-", ""),
                     to_date_str.replace("-", ""),
-                    self.document_type.lower(),
+                    document_type.lower(),
                 )
-                self.attachment_ids += self.env["ir.attachment"].create(
+                vals_list.append(
                     {
-                        "datas": base64.b64encode(file),
+                        "raw": file,
                         "name": filename,
                         "res_model": self._name,
                         "res_id": self.id,
                         "type": "binary",
                     }
                 )
+        if errors and len(errors) == len(filtered_carriers):
+            raise UserError("\n".join(errors))
+        self.attachment_ids += self.env["ir.attachment"].create(vals_list)
+        self.error_message = "\n".join(errors)
         self.state = "done"
         return dict(
             self.env["ir.actions.act_window"]._for_xml_id(
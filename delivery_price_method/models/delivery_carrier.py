@@ -1,7 +1,20 @@
 # Copyright 2020 Trey, Kilobytes de Soluciones
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-from odoo import fields, models
+import operator
+
+from odoo import api, fields, models
+from odoo.tools import ormcache
+
+from .rate_cache import RATE_CACHE
+
+RULE_OPERATORS = {
+    "==": operator.eq,
+    "<=": operator.le,
+    "<": operator.lt,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
 
 
 class DeliveryCarrier(models.Model):
@@ -19,18 +32,115 @@ class DeliveryCarrier(models.Model):
     )
 
     def rate_shipment(self, order):
-        """Trick the method for using all the upstream code for the
-        price computation in case of using fixed or base_on_rule.
+        """Rate the order, reusing a recent result for the same carrier
+        configuration and order fingerprint when there's one.
         """
-        previous_method = False
-        if self.price_method in ("fixed", "base_on_rule"):
-            previous_method = self.delivery_type
-            self.sudo().delivery_type = self.price_method
-        res = super().rate_shipment(order)
-        if previous_method:
-            self.sudo().delivery_type = previous_method
+        self.ensure_one()
+        key = self._get_rate_cache_key(order)
+        if key:
+            res = RATE_CACHE.get(key)
+            if res is not None:
+                return dict(res)
+        res = self._rate_shipment_uncached(order)
+        if key and res.get("success"):
+            RATE_CACHE.set(key, dict(res))
         return res
 
+    def _rate_shipment_uncached(self, order):
+        """Trick the method for using all the upstream code for the
+        price computation in case of using fixed or base_on_rule. The price
+        method is set on an in-memory copy of the carrier, so the record isn't
+        written and concurrent ratings don't lock its row.
+        """
+        if (
+            self.price_method in ("fixed", "base_on_rule")
+            and self.delivery_type != self.price_method
+        ):
+            carrier = self.new({"delivery_type": self.price_method}, origin=self)
+            return super(DeliveryCarrier, carrier).rate_shipment(order)
+        return super().rate_shipment(order)
+
+    def _get_rate_cache_version(self):
+        """Stamp of the carrier configuration the rating depends on. Any change
+        in it makes the cached ratings of the carrier unreachable.
+        """
+        return (
+            self.write_date,
+            self.delivery_type,
+            self.price_method,
+            self.fixed_price,
+            self.margin,
+            self.free_over,
+            self.amount,
+            self.product_id.id,
+            tuple(self.country_ids.ids),
+            tuple(self.state_ids.ids),
+            tuple(
+                (
+                    rule.id,
+                    rule.variable,
+                    rule.operator,
+                    rule.max_value,
+                    rule.list_base_price,
+                    rule.list_price,
+                    rule.variable_factor,
+                )
+                for rule in self.sudo().price_rule_ids
+            ),
+        )
+
+    @api.model
+    @ormcache()
+    def _get_rate_cache_params(self):
+        """Size and seconds to live of the rate cache, from the system
+        parameters. Cached per registry: writing a parameter clears it.
+
+        :return tuple: (max_size, ttl)
+        """
+        params = self.env["ir.config_parameter"].sudo()
+        return (
+            int(params.get_param("delivery_price_method.rate_cache_size", 1024)),
+            float(params.get_param("delivery_price_method.rate_cache_ttl", 300)),
+        )
+
+    def _get_rate_cache_key(self, order):
+        """Key of the rating of the order in the rate cache: the carrier and its
+        configuration stamp, plus the stored weight, amount, destination,
+        pricelist and fiscal position of the order and the last write of it and
+        its lines, so nothing has to be computed for a cache hit.
+
+        :return tuple: The key, or None if the rating can't be cached
+        """
+        max_size, ttl = self._get_rate_cache_params()
+        RATE_CACHE.configure(max_size, ttl)
+        if not max_size or not isinstance(order.id, int):
+            return None
+        partner = order.partner_shipping_id
+        lines = order.order_line
+        return (
+            self.env.cr.dbname,
+            self.id,
+            self._get_rate_cache_version(),
+            self.env.context.get("order_weight") or order.shipping_weight,
+            order.amount_total,
+            partner.id,
+            partner.zip,
+            partner.state_id.id,
+            partner.country_id.id,
+            order.pricelist_id.id,
+            order.currency_id.id,
+            order.fiscal_position_id.id,
+            order.company_id.id,
+            order.write_date,
+            len(lines),
+            max(lines.mapped("write_date"), default=None),
+        )
+
+    @api.model
+    def rate_cache_info(self):
+        """Hits, misses and size of the rate cache of this worker"""
+        return RATE_CACHE.info()
+
     def send_shipping(self, pickings):
         res = super().send_shipping(pickings)
         if self.price_method in ("fixed", "base_on_rule"):
@@ -39,3 +149,126 @@ class DeliveryCarrier(models.Model):
                 del rate["tracking_number"]  # remove offending key
                 res[index].update(rate)
         return res
+
+    def rate_shipment_multi(self, orders):
+        """Rate many orders with many carriers at once. The orders data is read
+        once for every carrier and the price rules are evaluated column-wise,
+        each rule over all the orders not matched yet.
+
+        The prices are the ones computed by the price method, in the company
+        currency, before the margins and the taxes `rate_shipment` applies.
+
+        :param sale.order orders: Orders to rate
+        :return dict: Price by order id by carrier id. It's False when the
+            carrier can't deliver the order.
+        """
+        values = self._get_rate_shipment_multi_values(orders)
+        return {
+            carrier.id: dict(
+                zip(orders.ids, carrier._rate_shipment_multi_prices(orders, values))
+            )
+            for carrier in self
+        }
+
+    def _get_rate_shipment_multi_values(self, orders):
+        """Gather the rating values of the orders as `_get_price_available`
+        does, with a single read of the orders and of their lines.
+
+        :param sale.order orders: Orders to rate
+        :return dict: Lists of values in the same order as the orders
+        """
+        orders = orders.sudo()
+        index = {order_id: i for i, order_id in enumerate(orders.ids)}
+        size = len(orders)
+        total_delivery = [0.0] * size
+        weight = [0.0] * size
+        volume = [0.0] * size
+        quantity = [0.0] * size
+        lines = self.env["sale.order.line"].sudo().search(
+            [("order_id", "in", orders.ids), ("state", "!=", "cancel")]
+        )
+        for line in lines:
+            i = index[line.order_id.id]
+            if line.is_delivery:
+                total_delivery[i] += line.price_total
+            product = line.product_id
+            if not product or line.is_delivery or product.type == "service":
+                continue
+            qty = line.product_uom._compute_quantity(
+                line.product_uom_qty, product.uom_id
+            )
+            weight[i] += (product.weight or 0.0) * qty
+            volume[i] += (product.volume or 0.0) * qty
+            quantity[i] += qty
+        total = []
+        for i, order in enumerate(orders):
+            total.append(
+                self._compute_currency(
+                    order,
+                    (order.amount_total or 0.0) - total_delivery[i],
+                    "pricelist_to_company",
+                )
+            )
+            weight[i] = order.shipping_weight or weight[i]
+        return {
+            "price": total,
+            "weight": weight,
+            "volume": volume,
+            "wv": [w * v for w, v in zip(weight, volume)],
+            "quantity": quantity,
+            "zip": [(o.partner_shipping_id.zip or "").strip() for o in orders],
+            "country_code": [o.partner_shipping_id.country_id.code for o in orders],
+        }
+
+    def _rate_shipment_multi_prices(self, orders, values):
+        """Prices of the orders for this carrier. Integrated carriers without a
+        local price method are asked order by order.
+
+        :param sale.order orders: Orders to rate
+        :param dict values: Values from `_get_rate_shipment_multi_values`
+        :return list: Price (or False) of every order
+        """
+        self.ensure_one()
+        method = self.delivery_type
+        if self.price_method in ("fixed", "base_on_rule"):
+            method = self.price_method
+        if method == "fixed":
+            prices = [self.fixed_price] * len(orders)
+        elif method == "base_on_rule":
+            prices = self._rate_shipment_multi_rules(values)
+        else:
+            prices = []
+            for order in orders:
+                res = self.rate_shipment(order)
+                prices.append(res.get("success") and res["price"])
+            return prices
+        for i, order in enumerate(orders):
+            if not self._match_address(order.partner_shipping_id):
+                prices[i] = False
+            elif self.free_over and values["price"][i] >= self.amount:
+                prices[i] = 0.0
+        return prices
+
+    def _rate_shipment_multi_rules(self, values):
+        """Evaluate the price rules over all the orders, as
+        `_get_price_from_picking` does for one of them.
+
+        :param dict values: Values from `_get_rate_shipment_multi_values`
+        :return list: Price (or False) of every order
+        """
+        prices = [False] * len(values["price"])
+        pending = list(range(len(prices)))
+        for rule in self.sudo().price_rule_ids:
+            compare = RULE_OPERATORS[rule.operator]
+            column = values[rule.variable]
+            factors = values[rule.variable_factor]
+            not_matched = []
+            for i in pending:
+                if compare(column[i], rule.max_value):
+                    prices[i] = rule.list_base_price + rule.list_price * factors[i]
+                else:
+                    not_matched.append(i)
+            pending = not_matched
+            if not pending:
+                break
+        return prices
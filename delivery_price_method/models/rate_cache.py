@@ -0,0 +1,71 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateCache:
+    """Bounded LRU cache of rating results whose entries expire after a while.
+    It's shared by the threads of a worker, so it's guarded by a lock.
+
+    :param int max_size: Maximum number of entries kept
+    :param float ttl: Seconds an entry is valid for
+    """
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_size, ttl):
+        """Change the size and the seconds to live, dropping the oldest entries
+        that don't fit anymore. Nothing is done if they're the same.
+        """
+        if (max_size, ttl) == (self.max_size, self.ttl):
+            return
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            while len(self._entries) > max(max_size, 0):
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Cached value of the key, or None if it's missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Cache statistics, to check it's doing its job"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
+
+
+RATE_CACHE = RateCache()
@@ -0,0 +1,81 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Concurrent ratings of the same carrier, each one in its own transaction kept
+open for a while as a checkout would do. If rating the carrier wrote it, every
+transaction would wait for the row lock of the previous one and the total time
+would grow with the number of threads::
+
+    python delivery_price_method/tests/benchmark_rate_shipment.py \\
+        -c odoo.conf -d database --order-id 1 --threads 20
+
+The carrier of the sale order must use the fixed or the based on rules price
+method. Nothing is committed.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import odoo
+
+
+def _rate(registry, order_id, hold, barrier, timings):
+    with registry.cursor() as cr:
+        env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+        order = env["sale.order"].browse(order_id)
+        barrier.wait()
+        start = time.perf_counter()
+        order.carrier_id.rate_shipment(order)
+        env.flush_all()
+        # Keep the transaction open, as the rest of the checkout would do
+        time.sleep(hold)
+        timings.append((time.perf_counter() - start) * 1000)
+        cr.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--config", required=True)
+    parser.add_argument("-d", "--database", required=True)
+    parser.add_argument("--order-id", type=int, required=True)
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--hold", type=float, default=0.2)
+    args = parser.parse_args()
+    odoo.tools.config.parse_config(["-c", args.config, "-d", args.database])
+    registry = odoo.registry(args.database)
+    with registry.cursor() as cr:
+        env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+        carrier = env["sale.order"].browse(args.order_id).carrier_id
+        print(
+            "Carrier {} ({} / {})".format(
+                carrier.name, carrier.delivery_type, carrier.price_method
+            )
+        )
+    barrier = threading.Barrier(args.threads)
+    timings = []
+    threads = [
+        threading.Thread(
+            target=_rate,
+            args=(registry, args.order_id, args.hold, barrier, timings),
+        )
+        for _i in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = (time.perf_counter() - start) * 1000
+    print(
+        "{} concurrent ratings holding {:.0f} ms: total {:.0f} ms | "
+        "median {:.0f} ms | max {:.0f} ms".format(
+            args.threads,
+            args.hold * 1000,
+            total,
+            statistics.median(timings),
+            max(timings),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 # Copyright 2020 Trey, Kilobytes de Soluciones
 # Copyright 2020 Tecnativa - Pedro M. Baeza
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from unittest.mock import patch
+
 from odoo.tests import Form
 from odoo.tests.common import TransactionCase
 from odoo.tools import float_compare
@@ -118,3 +120,77 @@ class TestDeliveryPriceMethod(TransactionCase):
         delivery_lines = sale.order_line.filtered(lambda r: r.is_delivery)
         delivery_price = sum(delivery_lines.mapped("price_unit"))
         self.assertEqual(delivery_price, 11.11)
+
+    def test_rate_shipment_no_write(self):
+        self.carrier.write(
+            {"delivery_type": "base_on_rule", "price_method": "fixed", "fixed_price": 5}
+        )
+        with patch.object(type(self.carrier), "write", autospec=True) as write:
+            res = self.carrier.rate_shipment(self.sale)
+            self.env.flush_all()
+        write.assert_not_called()
+        self.assertEqual(res["price"], 5)
+        self.assertEqual(self.carrier.delivery_type, "base_on_rule")
+
+    def test_rate_shipment_multi(self):
+        rule_carrier = self.carrier.copy(
+            {
+                "price_method": "base_on_rule",
+                "price_rule_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "variable": "quantity",
+                            "operator": ">",
+                            "max_value": 5,
+                            "list_base_price": 20,
+                        },
+                    ),
+                    (
+                        0,
+                        0,
+                        {
+                            "variable": "quantity",
+                            "operator": "<=",
+                            "max_value": 5,
+                            "list_base_price": 10,
+                            "list_price": 1,
+                            "variable_factor": "quantity",
+                        },
+                    ),
+                ],
+            }
+        )
+        big_sale = self.sale.copy()
+        big_sale.order_line.product_uom_qty = 10
+        carriers = self.carrier | rule_carrier
+        orders = self.sale | big_sale
+        matrix = carriers.rate_shipment_multi(orders)
+        self.assertEqual(
+            matrix[self.carrier.id], {self.sale.id: 99.99, big_sale.id: 99.99}
+        )
+        self.assertEqual(matrix[rule_carrier.id], {self.sale.id: 11, big_sale.id: 20})
+        self.assertEqual(
+            matrix[rule_carrier.id][self.sale.id],
+            rule_carrier.rate_shipment(self.sale)["price"],
+        )
+
+    def test_rate_cache(self):
+        self.carrier.write({"price_method": "fixed", "fixed_price": 5})
+        info = self.carrier.rate_cache_info()
+        self.assertEqual(self.carrier.rate_shipment(self.sale)["price"], 5)
+        self.assertEqual(self.carrier.rate_shipment(self.sale)["price"], 5)
+        new_info = self.carrier.rate_cache_info()
+        self.assertEqual(new_info["misses"], info["misses"] + 1)
+        self.assertEqual(new_info["hits"], info["hits"] + 1)
+        # A configuration change isn't served from the cache
+        self.carrier.fixed_price = 7
+        self.assertEqual(self.carrier.rate_shipment(self.sale)["price"], 7)
+        self.assertEqual(self.carrier.rate_cache_info()["misses"], info["misses"] + 2)
+        # The system parameters are read again after they're changed
+        self.env["ir.config_parameter"].sudo().set_param(
+            "delivery_price_method.rate_cache_ttl", 60
+        )
+        self.assertEqual(self.carrier.rate_shipment(self.sale)["price"], 7)
+        self.assertEqual(self.carrier.rate_cache_info()["ttl"], 60)
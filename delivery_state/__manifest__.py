@@ -16,8 +16,10 @@
     "version": "17.0.1.0.0",
     "depends": ["delivery", "stock_delivery"],
     "data": [
+        "security/ir.model.access.csv",
         "data/ir_cron_data.xml",
         "data/mail_template.xml",
+        "views/delivery_carrier_views.xml",
         "views/res_config_settings_view.xml",
         "views/stock_picking_views.xml",
     ],
@@ -1,12 +1,78 @@
 # Copyright 2020 Trey, Kilobytes de Soluciones
 # Copyright 2020 FactorLibre
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
-from odoo import fields, models
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+# Minimum and maximum hours between tracking checks for every delivery state.
+# Within them, the delay grows with the time the picking spent in the state.
+TRACKING_CHECK_DELAYS = {
+    False: (2, 12),
+    "shipping_recorded_in_carrier": (2, 12),
+    "in_transit": (1, 24),
+    "incident": (6, 72),
+    "warehouse_delivered": (12, 72),
+}
+# States we don't expect updates for
+TRACKING_FINAL_STATES = ("customer_delivered", "canceled_shipment", "no_update")
 
 
 class DeliveryCarrier(models.Model):
     _inherit = "delivery.carrier"
 
+    tracking_transit_days = fields.Integer(
+        string="Expected transit days",
+        default=2,
+        help="Days a shipping usually takes to be delivered. Pickings in transit "
+        "are checked more often from then on.",
+    )
+
+    def _get_tracking_check_delay(self, picking, now):
+        """Time to wait before checking the tracking of the picking again. The
+        longer a picking stays in the same state, the less often it's checked,
+        but in transit pickings are checked often when they're due to be
+        delivered, so customer deliveries are noticed soon.
+
+        :param record picking: `stock.picking` record
+        :param datetime now: Current time
+        :return timedelta: Delay or None when no more checks are needed
+        """
+        state = picking.delivery_state
+        if state in TRACKING_FINAL_STATES:
+            return None
+        min_hours, max_hours = TRACKING_CHECK_DELAYS.get(state, TRACKING_CHECK_DELAYS[False])
+        age = now - (picking.delivery_state_date or picking.date_done or now)
+        if state == "in_transit" and picking.date_shipped:
+            expected = fields.Datetime.to_datetime(picking.date_shipped) + timedelta(
+                days=self.tracking_transit_days
+            )
+            if expected <= now:
+                overdue = now - expected
+                # Expected today: check often. Long overdue: back off again.
+                if overdue < timedelta(days=max(self.tracking_transit_days, 1)):
+                    return timedelta(hours=min_hours)
+                age = overdue
+        hours = age.total_seconds() / 3600 / 4
+        return timedelta(hours=min(max(hours, min_hours), max_hours))
+
+    def _tracking_state_update(self, pickings):
+        """Update the tracking state of the given pickings of this carrier.
+        Providers able to update many pickings at once should define:
+            <my_provider>_tracking_state_update_batch(pickings)
+        Otherwise, the method for a single picking is called for every one:
+            <my_provider>_tracking_state_update(picking)
+        """
+        self.ensure_one()
+        batch_method = "%s_tracking_state_update_batch" % self.delivery_type
+        method = "%s_tracking_state_update" % self.delivery_type
+        if hasattr(self, batch_method):
+            getattr(self, batch_method)(pickings)
+        elif hasattr(self, method):
+            for picking in pickings:
+                getattr(self, method)(picking)
+        pickings._schedule_next_tracking_check()
+
     def send_shipping(self, pickings):
         res = super().send_shipping(pickings)
         pickings.write(
@@ -19,11 +85,14 @@ class DeliveryCarrier(models.Model):
 
     def cancel_shipment(self, pickings):
         res = super().cancel_shipment(pickings)
-        pickings.write(
-            {
-                "delivery_state": "canceled_shipment",
-                "date_delivered": False,
-                "date_shipped": False,
-            }
-        )
+        pickings.write(self._get_canceled_shipment_values())
         return res
+
+    @api.model
+    def _get_canceled_shipment_values(self):
+        """Values of the pickings whose shipping has been cancelled"""
+        return {
+            "delivery_state": "canceled_shipment",
+            "date_delivered": False,
+            "date_shipped": False,
+        }
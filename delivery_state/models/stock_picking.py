@@ -3,8 +3,22 @@
 # Copyright 2020 Tecnativa - David Vidal
 # Copyright 2022 Tecnativa - Víctor Martínez
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import logging
+import threading
+import time
+from datetime import timedelta
+
 from odoo import api, fields, models
 
+_logger = logging.getLogger(__name__)
+
+# Pickings updated (and committed) at once by the scheduled action
+TRACKING_CHUNK_SIZE = 200
+# Seconds the scheduled action runs before rescheduling itself
+TRACKING_TIME_BUDGET = 600
+# Tracking checks are scheduled in slots of these minutes
+TRACKING_CHECK_SLOT_MINUTES = 15
+
 
 class StockPicking(models.Model):
     _inherit = "stock.picking"
@@ -20,11 +34,16 @@ class StockPicking(models.Model):
     tracking_state = fields.Char(
         readonly=True,
         index=True,
-        tracking=True,
     )
     tracking_state_history = fields.Text(
         readonly=True,
     )
+    tracking_event_ids = fields.One2many(
+        comodel_name="stock.picking.tracking.event",
+        inverse_name="picking_id",
+        string="Tracking events",
+        readonly=True,
+    )
     delivery_state = fields.Selection(
         selection=[
             ("shipping_recorded_in_carrier", "Shipping recorded in carrier"),
@@ -39,49 +58,174 @@ class StockPicking(models.Model):
         tracking=True,
         readonly=True,
     )
+    delivery_state_date = fields.Datetime(
+        string="Carrier State Date",
+        readonly=True,
+        copy=False,
+        help="Last time the carrier state changed",
+    )
+    next_tracking_check = fields.Datetime(
+        readonly=True,
+        copy=False,
+        index=True,
+        help="The scheduled action won't ask the carrier for updates before",
+    )
 
     def tracking_state_update(self):
         """Call to the service provider API which should have the method
         defined in the model as:
             <my_provider>_tracking_state_update
-        It can be triggered manually or by the cron."""
-        for picking in self.filtered("carrier_id"):
-            method = "%s_tracking_state_update" % picking.delivery_type
-            if hasattr(picking.carrier_id, method):
-                getattr(picking.carrier_id, method)(picking)
+        It can be triggered manually or by the cron. Providers can update all
+        the pickings of a carrier at once defining:
+            <my_provider>_tracking_state_update_batch
+        """
+        for carrier in self.carrier_id:
+            carrier._tracking_state_update(
+                self.filtered(lambda p: p.carrier_id == carrier)
+            )
+
+    @api.model
+    def _get_delivery_state_update_domain(self):
+        return [
+            ("state", "=", "done"),
+            (
+                "delivery_state",
+                "not in",
+                ["customer_delivered", "canceled_shipment", "no_update"],
+            ),
+            # These won't ever autoupdate, so we don't want to evaluate them
+            ("delivery_type", "not in", [False, "fixed", "base_one_rule"]),
+            "|",
+            ("next_tracking_check", "=", False),
+            ("next_tracking_check", "<=", fields.Datetime.now()),
+        ]
+
+    def _schedule_next_tracking_check(self):
+        """Set when the carrier should be asked again for the tracking state.
+        Checks are rounded to slots so many pickings share the same date and
+        can be written at once."""
+        now = fields.Datetime.now()
+        values = {}
+        for picking in self:
+            delay = picking.carrier_id._get_tracking_check_delay(picking, now)
+            next_check = False
+            if delay:
+                next_check = (now + delay).replace(second=0, microsecond=0)
+                next_check += timedelta(
+                    minutes=-next_check.minute % TRACKING_CHECK_SLOT_MINUTES
+                )
+            values[picking] = {"next_tracking_check": next_check}
+        self._write_tracking_values(values)
+
+    @api.model
+    def _write_tracking_values(self, values):
+        """Write the tracking values of many pickings at once. Unchanged values
+        are skipped and pickings with the same new values are written together,
+        so recomputations, mail tracking and notifications are only triggered
+        for the actual changes.
+
+        :param dict values: Values to write by `stock.picking` record
+        """
+        pickings_by_vals = {}
+        for picking, vals in values.items():
+            changes = tuple(
+                sorted(
+                    (name, value)
+                    for name, value in vals.items()
+                    if picking._fields[name].convert_to_write(picking[name], picking)
+                    != value
+                )
+            )
+            if changes:
+                pickings_by_vals.setdefault(changes, self.browse())
+                pickings_by_vals[changes] |= picking
+        for changes, pickings in pickings_by_vals.items():
+            pickings.write(dict(changes))
 
     @api.model
     def _update_delivery_state(self):
         """Automated action to query the delivery states to the carriers API.
         every carrier should implement it 's own method. We split them by
-        delivery type so only those carries with the method update"""
-        pickings = self.search(
-            [
-                ("state", "=", "done"),
-                (
-                    "delivery_state",
-                    "not in",
-                    ["customer_delivered", "canceled_shipment", "no_update"],
-                ),
-                # These won't ever autoupdate, so we don't want to evaluate them
-                ("delivery_type", "not in", [False, "fixed", "base_one_rule"]),
-            ]
+        delivery type so only those carries with the method update.
+
+        Pickings are processed in chunks committed one by one. When the time
+        budget runs out, the action reschedules itself. Updated pickings aren't
+        due anymore, so the next run goes on with the pending ones. The id
+        cursor only skips, for the rest of this run, the pickings whose update
+        failed."""
+        params = self.env["ir.config_parameter"].sudo()
+        chunk_size = int(
+            params.get_param("delivery_state.tracking_chunk_size", TRACKING_CHUNK_SIZE)
         )
-        pickings.tracking_state_update()
+        time_budget = float(
+            params.get_param(
+                "delivery_state.tracking_time_budget", TRACKING_TIME_BUDGET
+            )
+        )
+        last_id = 0
+        deadline = time.monotonic() + time_budget
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        domain = self._get_delivery_state_update_domain()
+        while True:
+            pickings = self.search(
+                domain + [("id", ">", last_id)], order="id", limit=chunk_size
+            )
+            if not pickings:
+                break
+            for carrier in pickings.carrier_id:
+                carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+                try:
+                    with self.env.cr.savepoint():
+                        carrier._tracking_state_update(carrier_pickings)
+                except Exception:
+                    _logger.exception(
+                        "Tracking state update failed for carrier %s pickings %s",
+                        carrier.name,
+                        carrier_pickings.ids,
+                    )
+            last_id = pickings[-1].id
+            if auto_commit:
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+            if time.monotonic() > deadline:
+                self.env.ref("delivery_state.ir_cron_delivery_state")._trigger()
+                break
 
     def _send_delivery_state_delivered_email(self):
-        for item in self.filtered(
+        """Notify the customers that their pickings were delivered. The emails
+        are rendered in batch for each template and left in the mail queue, so
+        the tracking updates don't wait for the mail server."""
+        pickings = self.filtered(
             lambda p: p.company_id.delivery_state_delivered_email_validation
             and p.picking_type_id.code == "outgoing"
             and p.delivery_state == "customer_delivered"
-        ):
-            source_ref = item.company_id.delivery_state_delivered_mail_template_id
-            item.with_context(force_send=True).message_post_with_source(
-                source_ref, email_layout_xmlid="mail.mail_notification_light"
+        )
+        if not pickings:
+            return
+        for template, template_pickings in pickings.grouped(
+            lambda p: p.company_id.delivery_state_delivered_mail_template_id
+        ).items():
+            template_pickings.with_context(
+                mail_notify_force_send=False
+            ).message_post_with_source(
+                template, email_layout_xmlid="mail.mail_notification_light"
             )
+        self.env.ref("mail.ir_cron_mail_scheduler_action")._trigger()
 
     def write(self, vals):
+        changed = self.browse()
+        if "delivery_state" in vals and "delivery_state_date" not in vals:
+            changed = self.filtered(
+                lambda p: p.delivery_state != vals["delivery_state"]
+            )
+            # Usual case: we can write the date along with the state
+            if changed == self:
+                vals = dict(vals, delivery_state_date=fields.Datetime.now())
+                changed = self.browse()
         res = super().write(vals)
+        if changed:
+            super(StockPicking, changed).write(
+                {"delivery_state_date": fields.Datetime.now()}
+            )
         if vals.get("delivery_state") == "customer_delivered":
             self._send_delivery_state_delivered_email()
         return res
@@ -0,0 +1,67 @@
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from datetime import datetime, timezone
+
+from odoo import api, fields, models
+
+
+class StockPickingTrackingEvent(models.Model):
+    _name = "stock.picking.tracking.event"
+    _description = "Picking tracking event"
+    _order = "date desc, id desc"
+
+    picking_id = fields.Many2one(
+        comodel_name="stock.picking",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    date = fields.Datetime(required=True)
+    status_code = fields.Char(required=True)
+    description = fields.Char()
+    incident_code = fields.Char()
+    incident_description = fields.Char()
+
+    _sql_constraints = [
+        (
+            "picking_status_date_uniq",
+            "unique(picking_id, status_code, date)",
+            "This tracking event is already registered for this picking",
+        )
+    ]
+
+    @api.model
+    def _normalize_date(self, value):
+        """Event date as it's stored: naive UTC and to the second
+
+        :param value: Datetime, maybe timezone aware, or its string
+        :return datetime: Normalized date
+        """
+        if isinstance(value, datetime) and value.tzinfo:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return fields.Datetime.to_datetime(value).replace(microsecond=0)
+
+    @api.model
+    def _create_missing(self, vals_list):
+        """Create in batch the given events that aren't stored yet. Their dates
+        are normalized first, so the same event is recognized whatever the
+        precision or timezone the carrier gave it.
+
+        :param list vals_list: Events values
+        :return recordset: Created events
+        """
+        if not vals_list:
+            return self
+        existing = {
+            (event.picking_id.id, event.status_code, event.date)
+            for event in self.search(
+                [("picking_id", "in", list({v["picking_id"] for v in vals_list}))]
+            )
+        }
+        new_vals_list = []
+        for vals in vals_list:
+            date = self._normalize_date(vals["date"])
+            key = (vals["picking_id"], vals["status_code"], date)
+            if key not in existing:
+                existing.add(key)
+                new_vals_list.append(dict(vals, date=date))
+        return self.create(new_vals_list)
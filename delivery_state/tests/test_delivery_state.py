@@ -2,6 +2,7 @@
 # Copyright 2020 FactorLibre
 # Copyright 2022 Tecnativa - Víctor Martínez
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
 
 from odoo import fields
@@ -116,3 +117,100 @@ class TestDeliveryState(TransactionCase):
         )
         last_mail = fields.first(mails)
         self.assertTrue("XX-0000" in last_mail.body)
+        # The email is left in the queue instead of being sent right away
+        mail = self.env["mail.mail"].search([("mail_message_id", "=", last_mail.id)])
+        self.assertEqual(mail.state, "outgoing")
+
+    def test_tracking_check_delay(self):
+        now = fields.Datetime.now()
+        picking = self.env["stock.picking"].new(
+            {
+                "carrier_id": self.carrier.id,
+                "delivery_state": "incident",
+                "delivery_state_date": now - timedelta(hours=1),
+            }
+        )
+        recent_delay = self.carrier._get_tracking_check_delay(picking, now)
+        picking.delivery_state_date = now - timedelta(days=21)
+        old_delay = self.carrier._get_tracking_check_delay(picking, now)
+        self.assertLess(recent_delay, old_delay)
+        # In transit pickings due to be delivered are checked often
+        picking.delivery_state = "in_transit"
+        picking.date_shipped = fields.Date.today() - timedelta(days=2)
+        self.assertEqual(
+            self.carrier._get_tracking_check_delay(picking, now), timedelta(hours=1)
+        )
+        picking.delivery_state = "customer_delivered"
+        self.assertIsNone(self.carrier._get_tracking_check_delay(picking, now))
+
+    def test_create_missing_tracking_events(self):
+        self.sale.action_confirm()
+        picking = self.sale.picking_ids
+        events = self.env["stock.picking.tracking.event"]
+        events.create(
+            {
+                "picking_id": picking.id,
+                "date": datetime(2026, 1, 1, 8, 0),
+                "status_code": "0000",
+            }
+        )
+        madrid = timezone(timedelta(hours=1))
+        vals_list = [
+            # Already stored, with other precisions and timezones
+            {"date": datetime(2026, 1, 1, 8, 0, 0, 123456), "status_code": "0000"},
+            {"date": "2026-01-01 08:00:00", "status_code": "0000"},
+            {"date": datetime(2026, 1, 1, 9, 0, tzinfo=madrid), "status_code": "0000"},
+            # New, twice in the same batch
+            {"date": datetime(2026, 1, 2, 11, 0, tzinfo=madrid), "status_code": "1500"},
+            {"date": datetime(2026, 1, 2, 10, 0, 0, 500), "status_code": "1500"},
+        ]
+        created = events._create_missing(
+            [dict(vals, picking_id=picking.id) for vals in vals_list]
+        )
+        self.assertEqual(len(created), 1)
+        self.assertEqual(created.status_code, "1500")
+        self.assertEqual(created.date, datetime(2026, 1, 2, 10, 0))
+        self.assertEqual(len(picking.tracking_event_ids), 2)
+        # Nothing is created again
+        self.assertFalse(
+            events._create_missing(
+                [dict(vals, picking_id=picking.id) for vals in vals_list]
+            )
+        )
+        self.assertFalse(events._create_missing([]))
+
+    def test_write_tracking_values(self):
+        picking_type = self.env.ref("stock.picking_type_out")
+        pickings = self.env["stock.picking"].create(
+            [{"picking_type_id": picking_type.id} for _i in range(4)]
+        )
+        pickings[0].tracking_state = "[1500] EN REPARTO"
+        picking_class = type(pickings)
+        with patch.object(
+            picking_class, "write", autospec=True, side_effect=picking_class.write
+        ) as write:
+            pickings._write_tracking_values(
+                {
+                    # Unchanged
+                    pickings[0]: {"tracking_state": "[1500] EN REPARTO"},
+                    # The same change
+                    pickings[1]: {"tracking_state": "[1500] EN REPARTO"},
+                    pickings[2]: {"tracking_state": "[1500] EN REPARTO"},
+                    pickings[3]: {"tracking_state": "[2100] ENTREGADO"},
+                }
+            )
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(
+            {
+                call.args[0]: call.args[1]["tracking_state"]
+                for call in write.call_args_list
+            },
+            {
+                pickings[1:3]: "[1500] EN REPARTO",
+                pickings[3]: "[2100] ENTREGADO",
+            },
+        )
+        self.assertEqual(
+            set(pickings[:3].mapped("tracking_state")), {"[1500] EN REPARTO"}
+        )
+        self.assertEqual(pickings[3].tracking_state, "[2100] ENTREGADO")